@@ -0,0 +1,184 @@
+"""
+Compare how fast a PackageRepository/PackageInstall is seen as reconciled when watched (tappr) versus polled every second
+(what the tanzu CLI does while it waits), against a local fake API server that reconciles objects after a delay.
+
+    poetry run python hack/benchmarks/packaging.py [objects] [reconcile delay seconds]
+
+Reports the time from the reconcile on the server until the client noticed it, and the requests it took.
+"""
+
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import kubernetes as k8s
+
+from tappr.modules.tanzu.packageinstalls import GROUP, PLURAL, VERSION, package_repository_object, package_state, wait_for_reconcile
+from tappr.modules.utils.discovery import DiscoveryCache
+from tappr.modules.utils.k8s import K8s
+
+DISCOVERY = {
+    "kind": "APIResourceList",
+    "groupVersion": f"{GROUP}/{VERSION}",
+    "resources": [
+        {"name": "packagerepositories", "kind": "PackageRepository", "namespaced": True},
+        {"name": PLURAL, "kind": "PackageInstall", "namespaced": True},
+    ],
+}
+
+
+class FakeAPIServer:
+    """
+    Serves discovery, server side apply, get and watch of packaging objects, and marks every applied object
+    ReconcileSucceeded reconcile_delay seconds after it was applied.
+    """
+
+    def __init__(self, reconcile_delay: float):
+        self.reconcile_delay = reconcile_delay
+        self.objects = dict()
+        self.reconciled_at = dict()
+        self.requests = dict()
+        self.resource_version = 0
+        self.changed = threading.Condition()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.host = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def count(self, kind):
+        with self.changed:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def reconcile(self, path):
+        with self.changed:
+            obj = self.objects[path]
+            self.resource_version += 1
+            obj["metadata"]["resourceVersion"] = str(self.resource_version)
+            obj["status"] = {
+                "conditions": [{"type": "ReconcileSucceeded", "status": "True"}],
+                "observedGeneration": obj["metadata"]["generation"],
+            }
+            self.reconciled_at[obj["metadata"]["name"]] = time.time()
+            self.changed.notify_all()
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, code, obj):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == f"/apis/{GROUP}/{VERSION}":
+                    return self.send(200, DISCOVERY)
+                if query.get("watch", [""])[0].lower() == "true":
+                    server.count("watch")
+                    return self.watch(url.path, query)
+                server.count("get")
+                with server.changed:
+                    obj = server.objects.get(url.path)
+                    obj = json.loads(json.dumps(obj)) if obj is not None else None
+                if obj is None:
+                    return self.send(404, {"kind": "Status", "code": 404})
+                self.send(200, obj)
+
+            def watch(self, path, query):
+                name = query.get("fieldSelector", ["metadata.name="])[0].split("=", 1)[1]
+                since = int(query.get("resourceVersion", ["0"])[0])
+                deadline = time.time() + int(query.get("timeoutSeconds", ["30"])[0])
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                with server.changed:
+                    while time.time() < deadline:
+                        obj = server.objects.get(f"{path}/{name}")
+                        if obj is not None and int(obj["metadata"]["resourceVersion"]) > since:
+                            line = (json.dumps({"type": "MODIFIED", "object": obj}) + "\n").encode()
+                            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                            self.wfile.flush()
+                            since = int(obj["metadata"]["resourceVersion"])
+                        server.changed.wait(timeout=max(deadline - time.time(), 0))
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_PATCH(self):
+                server.count("apply")
+                url = urlparse(self.path)
+                obj = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with server.changed:
+                    server.resource_version += 1
+                    obj["metadata"].update(resourceVersion=str(server.resource_version), generation=1)
+                    server.objects[url.path] = obj
+                    server.changed.notify_all()
+                threading.Timer(server.reconcile_delay, server.reconcile, args=(url.path,)).start()
+                self.send(201, obj)
+
+        return Handler
+
+
+def watched(k8s_helper, client, name):
+    success, reason = wait_for_reconcile(
+        k8s_helper=k8s_helper, client=client, plural="packagerepositories", name=name, namespace="tap-install", timeout_seconds=60
+    )
+    return time.time() if success else None
+
+
+def polled(k8s_helper, client, name, interval=1):
+    while True:
+        success, response = k8s_helper.get_namespaced_custom_objects(
+            name=name, group=GROUP, version=VERSION, namespace="tap-install", plural="packagerepositories", client=client
+        )
+        if success:
+            row = package_state(response)
+            if row["current"] and row["condition"] == "ReconcileSucceeded":
+                return time.time()
+        time.sleep(interval)
+
+
+def run(mode, objects, delay):
+    server = FakeAPIServer(reconcile_delay=delay).start()
+    configuration = k8s.client.Configuration(host=server.host)
+    client = k8s.client.CustomObjectsApi(k8s.client.ApiClient(configuration))
+    names = [f"repository-{i}" for i in range(objects)]
+    K8s.apply_objects(
+        [package_repository_object(name=name, namespace="tap-install", url=f"registry.example.com/{name}:1.0.0") for name in names],
+        namespace="tap-install",
+        client=client,
+        discovery=DiscoveryCache(path="/tmp/tappr-benchmark-discovery"),
+    )
+    with ThreadPoolExecutor(max_workers=objects) as executor:
+        seen = list(executor.map(lambda name: (watched if mode == "watch" else polled)(K8s, client, name), names))
+    server.stop()
+    lags = sorted((seen_at - server.reconciled_at[name]) * 1000 for name, seen_at in zip(names, seen))
+    print(f"  {mode}: p50 {lags[len(lags) // 2]:7.1f} ms  max {lags[-1]:7.1f} ms after reconcile, requests {server.requests}")
+
+
+def main(objects=10, delay=3.0):
+    print(f"{objects} package repositories reconciling {delay}s after apply")
+    run("watch", objects, delay)
+    run("poll", objects, delay)
+
+
+if __name__ == "__main__":
+    main(*[cast(arg) for cast, arg in zip((int, float), sys.argv[1:3])])
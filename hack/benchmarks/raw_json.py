@@ -0,0 +1,88 @@
+"""
+Compare the kubernetes client model deserialization path against the raw json (_preload_content=False) path of the K8s helper
+for the typed reads that support raw (namespaces, secrets, services). Custom objects are plain dicts either way, so they are not measured.
+
+    poetry run python hack/benchmarks/raw_json.py [items] [rounds]
+
+The HTTP layer is stubbed out so only response handling is measured.
+"""
+
+import base64
+import json
+import sys
+import time
+
+import kubernetes as k8s
+import urllib3
+
+from tappr.modules.utils.k8s import K8s
+
+
+def namespace(i):
+    return {
+        "apiVersion": "v1",
+        "kind": "Namespace",
+        "metadata": {
+            "name": f"namespace-{i}",
+            "resourceVersion": str(1000 + i),
+            "annotations": {f"tkg.tanzu.vmware.com/annotation-{n}": f"value-{n}" for n in range(5)},
+            "labels": {"kubernetes.io/metadata.name": f"namespace-{i}"},
+        },
+        "spec": {"finalizers": ["kubernetes"]},
+        "status": {"phase": "Active"},
+    }
+
+
+def secret(i):
+    return {
+        "apiVersion": "v1",
+        "kind": "Secret",
+        "metadata": {
+            "name": f"package-{i}-values",
+            "namespace": "tap-install",
+            "resourceVersion": str(1000 + i),
+            "labels": {"app": f"package-{i}"},
+        },
+        "type": "Opaque",
+        "data": {"values.yml": base64.b64encode(("key: value\n" * 200).encode()).decode()},
+    }
+
+
+class StubPoolManager:
+    def __init__(self, body):
+        self.body = body
+
+    def request(self, method, url, preload_content=True, **kwargs):
+        return urllib3.HTTPResponse(body=self.body, status=200, headers={"Content-Type": "application/json"}, preload_content=True)
+
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main(items=500, rounds=20):
+    api_client = k8s.client.ApiClient(k8s.client.Configuration(host="http://127.0.0.1"))
+    core = k8s.client.CoreV1Api(api_client)
+
+    api_client.rest_client.pool_manager = StubPoolManager(
+        json.dumps({"apiVersion": "v1", "kind": "NamespaceList", "metadata": {}, "items": [namespace(i) for i in range(items)]}).encode()
+    )
+    print(f"{items} namespaces (typed V1NamespaceList), {rounds} rounds")
+    print(f"  deserialized: {timed(lambda: K8s.list_namespaces(client=core), rounds):8.2f} ms")
+    print(f"  raw json:     {timed(lambda: K8s.list_namespaces(client=core, raw=True), rounds):8.2f} ms")
+
+    api_client.rest_client.pool_manager = StubPoolManager(
+        json.dumps({"apiVersion": "v1", "kind": "SecretList", "metadata": {}, "items": [secret(i) for i in range(items)]}).encode()
+    )
+    print(f"{items} secrets (typed V1SecretList), {rounds} rounds")
+    print(f"  deserialized: {timed(lambda: core.list_namespaced_secret(namespace='tap-install'), rounds):8.2f} ms")
+    print(
+        f"  raw json:     {timed(lambda: K8s.raw_json(core.list_namespaced_secret(namespace='tap-install', _preload_content=False)), rounds):8.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
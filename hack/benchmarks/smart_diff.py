@@ -0,0 +1,88 @@
+"""
+Compare the line based difflib diff that tap edit used to print against the structural diff of tappr.modules.utils.diff,
+on TAP values with many clusters tracked by TAP GUI, each with a long serviceAccountToken.
+
+    poetry run python hack/benchmarks/smart_diff.py [clusters] [rounds]
+
+One cluster is untracked, one token is rotated and one top level key is changed between the two documents.
+"""
+
+import copy
+import io
+import sys
+import time
+from difflib import Differ
+
+import yaml
+from rich.console import Console
+
+from tappr.modules.utils.diff import mask_changes, render_changes, structural_diff
+
+
+def tap_values(clusters):
+    return {
+        "profile": "full",
+        "ceip_policy_disclosed": True,
+        "shared": {"ingress_domain": "127.0.0.1.nip.io", "image_registry": {"project_path": "registry.example.com/tap"}},
+        "tap_gui": {
+            "app_config": {
+                "kubernetes": {
+                    "clusterLocatorMethods": [
+                        {
+                            "type": "config",
+                            "clusters": [
+                                {
+                                    "authProvider": "serviceAccount",
+                                    "name": f"cluster-{i}-tap-gui",
+                                    "serviceAccountToken": f"eyJhbGciOiJSUzI1NiJ9.{i:08d}" + "x" * 1200,
+                                    "skipTLSVerify": True,
+                                    "url": f"https://10.0.{i // 256}.{i % 256}:6443",
+                                }
+                                for i in range(clusters)
+                            ],
+                        }
+                    ]
+                }
+            }
+        },
+    }
+
+
+def line_diff(old, new):
+    # The previous print_smart_diff, minus printing
+    return [
+        line
+        for line in Differ().compare(yaml.safe_dump(old).split("\n"), yaml.safe_dump(new).split("\n"))
+        if line.startswith("+") or line.startswith("-")
+    ]
+
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    return (time.perf_counter() - start) / rounds * 1000, result
+
+
+def main(clusters=2000, rounds=5):
+    old = tap_values(clusters)
+    new = copy.deepcopy(old)
+    located = new["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"]
+    del located[clusters // 2]
+    located[0]["serviceAccountToken"] = "rotated" + "y" * 1200
+    new["profile"] = "iterate"
+    size = len(yaml.safe_dump(old)) / 1024 / 1024
+    print(f"{clusters} tracked clusters, {size:.1f} MB of values, {rounds} rounds")
+
+    console = Console(file=io.StringIO(), width=160)
+    elapsed, changes = timed(lambda: structural_diff(old, new), rounds)
+    print(f"  structural diff:          {elapsed:9.2f} ms, {len(changes)} changes")
+    elapsed, _ = timed(lambda: [console.print(line) for line in render_changes(mask_changes(structural_diff(old, new)))], rounds)
+    print(f"  structural diff rendered: {elapsed:9.2f} ms")
+    # difflib is too slow to repeat on large inputs
+    elapsed, lines = timed(lambda: line_diff(old, new), 1)
+    print(f"  difflib line diff:        {elapsed:9.2f} ms, {len(lines)} lines")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
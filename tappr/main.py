@@ -1,3 +1,4 @@
+import atexit
 import typer
 import json
 import os
@@ -18,6 +19,7 @@ from tappr.modules.utils.enums import GKE_RELEASE_CHANNELS
 from tappr.modules.utils.creds import CredsHelper
 from tappr.modules.utils.ui import UI, Picker
 from tappr.modules.utils.k8s import K8s
+from tappr.modules.utils.jobs import FINISHED_STATES, Jobs
 from typing import Optional, List
 
 state = {"verbose": False, "context": None}
@@ -31,6 +33,7 @@ creds_helpers = CredsHelper(logger=typer_logger, subprocess_helper=subprocess_he
 ui_helpers = UI(subprocess_helper=subprocess_helpers, logger=typer_logger)
 test_framework = TestFramework(logger=typer_logger, subprocess_helper=subprocess_helpers, ui_helper=ui_helpers)
 k8s_helpers = K8s(state=state, logger=typer_logger)
+jobs_helpers = Jobs()
 tap_helpers = TanzuApplicationPlatform(
     subprocess_helper=subprocess_helpers,
     logger=typer_logger,
@@ -39,6 +42,7 @@ tap_helpers = TanzuApplicationPlatform(
     ui_helper=ui_helpers,
     k8s_helper=k8s_helpers,
     console=console,
+    jobs_helper=jobs_helpers,
 )
 tap_gui_helpers = TanzuApplicationPlatformGUI(
     subprocess_helper=subprocess_helpers,
@@ -62,6 +66,7 @@ registry_app = typer.Typer(help="Manage local docker registry.")
 tap_app = typer.Typer(help="Tanzu Application Platform management.")
 local_app = typer.Typer(help="Helpers to setup your local environment.")
 tap_gui_app = typer.Typer(help="Tanzu Application Platform GUI management.")
+jobs_app = typer.Typer(help="Background jobs started by tappr, e.g. relocations with --no-wait.")
 
 cluster_app.add_typer(create_cluster_app, name="create")
 cluster_app.add_typer(scale_cluster_app, name="scale")
@@ -69,6 +74,7 @@ cluster_app.add_typer(delete_cluster_app, name="delete")
 app.add_typer(cluster_app, name="cluster")
 app.add_typer(tap_app, name="tap")
 app.add_typer(tap_gui_app, name="gui")
+app.add_typer(jobs_app, name="jobs")
 app.add_typer(utils_app, name="utils")
 utils_app.add_typer(registry_app, name="registry")
 utils_app.add_typer(local_app, name="local")
@@ -87,6 +93,12 @@ def local_install(interactive, tool, cmd):
         typer_logger.msg(f":broken_heart: Unable to Install [yellow]{tool}[/yellow]. Use [bold]--verbose[/bold] flag for error details.")
 
 
+@atexit.register
+def print_k8s_call_stats():
+    if state["verbose"] and k8s_helpers.call_stats.verbs:
+        console.print(k8s_helpers.call_stats.table())
+
+
 # noinspection PyTypedDict
 @app.callback()
 def tappr(
@@ -525,6 +537,7 @@ def gke(
     auto_scale_down: bool = typer.Option(
         True, help="if False, adds a label do-not-automate to GKE cluster which can be used for auto cleanup scripts on GCP."
     ),
+    background: bool = typer.Option(False, help="Create the cluster in a background job, see tappr jobs --help"),
 ):
     """
     Create a GKE cluster. Assumes gcloud is set to create clusters.
@@ -631,6 +644,13 @@ def gke(
     typer_logger.msg(
         f":package: Creating a GKE cluster named [yellow]{cluster_name}[/yellow] in project [yellow]{gcp_project}[/yellow]", bold=False
     )
+    if background:
+        job = jobs_helpers.start(name=f"gke-create-{cluster_name}", cmd=cmd)
+        typer_logger.msg(
+            f":hourglass: Started job [yellow]{job['id']}[/yellow]. Use [yellow][bold]tappr jobs wait {job['id']}[/bold][/yellow] to wait for the cluster.",
+            bold=False,
+        )
+        return
     proc, out, err = ui_helpers.progress(cmd=cmd, state=state, message="Spinning up a GKE cluster")
     if proc.returncode == 0:
         typer_logger.msg(":rocket: GKE Cluster created [green]successfully[/green]")
@@ -823,6 +843,13 @@ def install(
     exclude_package: Optional[List[str]] = typer.Option(None),
     tap_values_file: str = None,
     wait: bool = typer.Option(False, help="Wait for the TAP install to complete"),
+    wait_timeout: int = typer.Option(30, help="Minutes to wait for all TAP packages to reconcile when using --wait"),
+    resume: bool = typer.Option(False, help="Skip the steps a previous run of the same install completed with unchanged inputs"),
+    tanzu_cli: bool = typer.Option(False, help="Use the tanzu CLI instead of the Kubernetes API for the package repository and install"),
+    contexts: str = typer.Option(None, help="Comma separated list of Kubernetes contexts to install TAP on concurrently"),
+    all_contexts: bool = typer.Option(False, help="Install TAP on all contexts in the KUBECONFIG concurrently"),
+    parallelism: int = typer.Option(4, help="Max number of clusters to install on at the same time with --contexts or --all-contexts"),
+    canary: str = typer.Option(None, help="Comma separated contexts to install first, the other clusters only start when these succeeded"),
 ):
     """
     Install TAP. Make sure to run tappr init before installing TAP.
@@ -830,11 +857,14 @@ def install(
     """
     if profile not in ["full", "authoring", "iterate", "run", "build", "view"]:
         raise ValueError("Invalid profile. Values can be full, authoring, iterate, build, run or view.")
-    tap_helpers.tap_install(
+    install_args = dict(
         profile=profile,
         version=version,
         tap_values_file=tap_values_file,
         wait=wait,
+        wait_timeout=wait_timeout,
+        resume=resume,
+        tanzu_cli=tanzu_cli,
         namespace=namespace,
         skip_cluster_essentials=skip_cluster_essentials,
         ingress_domain=ingress_domain,
@@ -849,6 +879,12 @@ def install(
         service_type=service_type,
         exclude_package=exclude_package,
     )
+    if contexts or all_contexts:
+        multi_cluster_run(
+            "install", contexts, all_contexts, parallelism, canary, run=lambda tap_helper, ctx: tap_helper.tap_install(**install_args)
+        )
+    else:
+        tap_helpers.tap_install(**install_args)
     typer_logger.msg("\n:runner: [cyan][bold]tappr tap status[/bold][/cyan] to see the status of your TAP install.")
     typer_logger.msg(":runner: [cyan][bold]tappr tap edit --show[/bold][/cyan] to edit TAP values config on the cluster.")
     typer_logger.msg(":runner: [cyan][bold]tappr tap setup[/bold][/cyan] to setup developer namespace.")
@@ -858,12 +894,21 @@ def install(
 @tap_app.command()
 def setup(
     namespace: str = typer.Option("default", help="Developer namespace to setup"),
+    namespaces_from: str = typer.Option(
+        None,
+        help="Yaml file with the namespaces to setup without any prompts, entries are a namespace name or a mapping with name and "
+        "optional test_pipeline (image, cmd) and scan_policy (not_allowed_severities).",
+    ),
+    parallelism: int = typer.Option(16, help="Number of namespaces to setup at the same time with --namespaces-from"),
 ):
     """
     Setup Developer Namespace.
 
     """
-    tap_helpers.developer_ns_setup(namespace=namespace)
+    if namespaces_from:
+        tap_helpers.bulk_developer_ns_setup(namespaces_from=namespaces_from, parallelism=parallelism)
+    else:
+        tap_helpers.developer_ns_setup(namespace=namespace)
 
 
 @tap_app.command()
@@ -878,12 +923,18 @@ def edit(
     show: bool = typer.Option(
         True, help="Show the current content of the tap values file on the cluster in the inline editor. Defaults to false for security purposes."
     ),
+    show_secrets: bool = typer.Option(False, help="Show passwords and tokens in the diff instead of a digest of their value"),
+    diff_output: str = typer.Option("text", help="Format of the diff of the changes, text or json"),
 ):
     """
     Modify TAP Installation.
 
     """
-    tap_helpers.edit_tap_values(namespace=namespace, from_file=from_file, force=force, show_current=show)
+    if diff_output not in ["text", "json"]:
+        raise ValueError("Invalid diff output. Values can be text or json.")
+    tap_helpers.edit_tap_values(
+        namespace=namespace, from_file=from_file, force=force, show_current=show, mask_secrets=not show_secrets, diff_output=diff_output
+    )
 
 
 @tap_app.command()
@@ -899,6 +950,9 @@ def ingress_ip(service: str = "envoy", namespace: str = typer.Option("tanzu-syst
 @tap_app.command()
 def relocate(
     version: str = typer.Option(None, help="Select the version of TAP you want to relocate from Tanzu Network to your Registry"),
+    versions: str = typer.Option(
+        None, help="Comma separated TAP versions to relocate, e.g. 1.5.0,1.6.1. Pick them from a list when neither is set."
+    ),
     tanzunet_username: str = typer.Option(None, help="Tanzu Network Username, defaults to config set by tappr init."),
     tanzunet_password: str = typer.Option(None, help="Tanzu Network Password, defaults to config set by tappr init."),
     registry_server: str = typer.Option(
@@ -910,13 +964,22 @@ def relocate(
         None, help="Default registry repo on the registry server to use for relocating TAP packages, defaults to config set by tappr init."
     ),
     wait: bool = typer.Option(True, help="Wait for the relocation to finish or run it in a separate thread in the background."),
+    parallelism: int = typer.Option(2, help="Number of versions to relocate at the same time"),
+    retries: int = typer.Option(2, help="Number of times to retry the relocation of a version that failed"),
+    resume: bool = typer.Option(True, help="Skip the versions relocated to the repository by an earlier run and continue interrupted ones"),
+    refresh: bool = typer.Option(False, help="List the TAP versions to pick from the registry instead of the cached version catalog"),
+    since: str = typer.Option(None, help="Only offer TAP versions at or after this version to pick from, e.g. 1.5"),
+    latest_patch: bool = typer.Option(False, help="Only offer the latest patch of every TAP minor version to pick from"),
 ):
     """
     Relocate packages from Tanzu Network to your Registry
 
     """
+    selected = [v.strip() for v in (versions or "").split(",") if v.strip()]
+    if version and version not in selected:
+        selected.insert(0, version)
     tap_helpers.relocate(
-        version=version,
+        versions=selected,
         tanzunet_username=tanzunet_username,
         tanzunet_password=tanzunet_password,
         registry_server=registry_server,
@@ -924,21 +987,49 @@ def relocate(
         registry_password=registry_password,
         pkg_relocation_repo=pkg_relocation_repo,
         wait=wait,
+        parallelism=parallelism,
+        retries=retries,
+        resume=resume,
+        refresh=refresh,
+        since=since,
+        latest_patch=latest_patch,
     )
 
 
+def multi_cluster_run(operation, contexts, all_contexts, parallelism, canary, run):
+    selected = commons.resolve_k8s_contexts(contexts=contexts, all_contexts=all_contexts, k8s_helper=k8s_helpers, logger=typer_logger)
+    canary = [ctx.strip() for ctx in canary.split(",") if ctx.strip()] if canary else []
+    unknown = [ctx for ctx in canary if ctx not in selected]
+    if unknown:
+        typer_logger.msg(f":worried: Canary context [yellow]{', '.join(unknown)}[/yellow] is not one of the selected contexts.", bold=False)
+        raise typer.Exit(-1)
+    if not tap_helpers.multi_cluster_run(contexts=selected, operation=operation, run=run, parallelism=parallelism, canary=canary):
+        typer_logger.msg(f":broken_heart: TAP {operation} failed on some clusters, see their log files for details.")
+        raise typer.Exit(-1)
+
+
 # noinspection PyShadowingNames
 @tap_app.command()
 def upgrade(
     version: str,
     namespace: str = typer.Option("tap-install", help="TAP installation namespace"),
     wait: bool = typer.Option(False, help="Wait for the TAP install to complete"),
+    wait_timeout: int = typer.Option(30, help="Minutes to wait for all TAP packages to reconcile when using --wait"),
+    tanzu_cli: bool = typer.Option(False, help="Use the tanzu CLI instead of the Kubernetes API for the package repository and install"),
+    contexts: str = typer.Option(None, help="Comma separated list of Kubernetes contexts to upgrade concurrently"),
+    all_contexts: bool = typer.Option(False, help="Upgrade all contexts in the KUBECONFIG concurrently"),
+    parallelism: int = typer.Option(4, help="Max number of clusters to upgrade at the same time with --contexts or --all-contexts"),
+    canary: str = typer.Option(None, help="Comma separated contexts to upgrade first, the other clusters only start when these succeeded"),
 ):
     """
     Upgrade TAP to a higher version.
 
     """
-    tap_helpers.upgrade(version=version, wait=wait, namespace=namespace)
+    upgrade_args = dict(version=version, wait=wait, namespace=namespace, wait_timeout=wait_timeout, tanzu_cli=tanzu_cli)
+    if contexts or all_contexts:
+        multi_cluster_run("upgrade", contexts, all_contexts, parallelism, canary, run=lambda tap_helper, ctx: tap_helper.upgrade(**upgrade_args))
+        return
+    tap_helpers.upgrade(**upgrade_args)
 
 
 @tap_app.command()
@@ -951,12 +1042,25 @@ def uninstall(package: str = typer.Option("tap", help="Package name to uninstall
 
 
 @tap_app.command()
-def status(namespace: str = typer.Option("tap-install", help="TAP installation namespace")):
+def status(
+    namespace: str = typer.Option("tap-install", help="TAP installation namespace"),
+    watch: bool = typer.Option(False, help="Keep watching the TAP packages and update the status table as they change"),
+    contexts: str = typer.Option(None, help="Comma separated list of Kubernetes contexts to get the status from concurrently"),
+    all_contexts: bool = typer.Option(False, help="Get the status from all contexts in the KUBECONFIG concurrently"),
+    timeout: int = typer.Option(10, help="Per cluster timeout in seconds when using --contexts or --all-contexts"),
+):
     """
     Get TAP installation status.
 
     """
-    tap_helpers.status(namespace=namespace)
+    if contexts or all_contexts:
+        tap_helpers.multi_cluster_status(
+            contexts=commons.resolve_k8s_contexts(contexts=contexts, all_contexts=all_contexts, k8s_helper=k8s_helpers, logger=typer_logger),
+            namespace=namespace,
+            timeout=timeout,
+        )
+        return
+    tap_helpers.status(namespace=namespace, watch=watch)
 
 
 @tap_gui_app.command()
@@ -970,34 +1074,167 @@ def server_ip(service: str = "server", namespace: str = "tap-gui"):
 
 # noinspection PyShadowingBuiltins
 @tap_gui_app.command()
-def list(namespace: str = typer.Option("tap-install", help="TAP installation namespace on the cluster where TAP GUI is located")):
+def list(
+    namespace: str = typer.Option("tap-install", help="TAP installation namespace on the cluster where TAP GUI is located"),
+    probe: bool = typer.Option(
+        False, help="Call every tracked cluster with its token and show latency, HTTP status and whether the token is valid"
+    ),
+    timeout: float = typer.Option(5, help="Seconds to wait for each tracked cluster to answer with --probe"),
+    parallelism: int = typer.Option(16, help="Number of tracked clusters to probe at the same time"),
+):
     """
     Get a list of Clusters tracked by TAP GUI.
 
     """
-    tap_gui_helpers.list_clusters(namespace=namespace)
+    tap_gui_helpers.list_clusters(namespace=namespace, probe=probe, timeout_seconds=timeout, parallelism=parallelism)
 
 
 @tap_gui_app.command()
 def track(
     namespace: str = typer.Option("tap-install", help="TAP installation namespace on the cluster where TAP GUI is located"),
     tap_viewer_sa: str = typer.Option("tap-gui-viewer", help="TAP Viewer service account in the cluster and namespace to be tracked"),
+    from_file: str = typer.Option(
+        None, "--from", help="YAML file listing the clusters to track, entries with context, namespace, name and service_account keys"
+    ),
+    parallelism: int = typer.Option(16, help="Number of clusters to read service account tokens from at the same time with --from"),
 ):
     """
     Add cluster credential to TAP GUI for tracking resources on GUI.
+    With --from, every cluster namespace in the file is added with a single update of the TAP values.
 
     """
-    tap_gui_helpers.track_cluster(tap_install_namespace=namespace, tap_viewer_service_account=tap_viewer_sa)
+    if from_file:
+        tap_gui_helpers.track_clusters(
+            tap_install_namespace=namespace, from_file=from_file, tap_viewer_service_account=tap_viewer_sa, parallelism=parallelism
+        )
+    else:
+        tap_gui_helpers.track_cluster(tap_install_namespace=namespace, tap_viewer_service_account=tap_viewer_sa)
 
 
 @tap_gui_app.command()
 def untrack(namespace: str = typer.Option("tap-install", help="TAP installation namespace on the cluster where TAP GUI is located")):
     """
-    Remove cluster credential from TAP GUI.
+    Remove cluster credentials from TAP GUI, all the picked clusters are removed with a single update of the TAP values.
 
     """
     tap_gui_helpers.untrack_cluster(tap_install_namespace=namespace)
 
 
+@tap_gui_app.command()
+def rotate_tokens(
+    namespace: str = typer.Option("tap-install", help="TAP installation namespace on the cluster where TAP GUI is located"),
+    tap_viewer_sa: str = typer.Option("tap-gui-viewer", help="TAP Viewer service account in the tracked clusters and namespaces"),
+    expiration_hours: int = typer.Option(24 * 365, help="Lifetime of the new tokens, the API server of a tracked cluster may cap it"),
+    parallelism: int = typer.Option(16, help="Number of tracked clusters to request tokens from at the same time"),
+    mapping: str = typer.Option(
+        None,
+        "--mapping",
+        help="YAML file with the context and namespace of clusters tracked before tappr recorded them, in the format of track --from",
+    ),
+):
+    """
+    Replace the service account tokens of all clusters tracked by TAP GUI with new ones, minted with the TokenRequest API
+    through the KUBECONFIG contexts the clusters were tracked from. All tokens are written with a single update of the TAP values.
+
+    """
+    tap_gui_helpers.rotate_tokens(
+        tap_install_namespace=namespace,
+        tap_viewer_service_account=tap_viewer_sa,
+        expiration_seconds=expiration_hours * 3600,
+        parallelism=parallelism,
+        mapping=mapping,
+    )
+
+
+# =============================================================================================
+# tappr jobs commands
+# =============================================================================================
+def pick_job(job_id, running_only=False):
+    if job_id:
+        if jobs_helpers.get(job_id) is None:
+            typer_logger.msg(f":worried: No job named [yellow]{job_id}[/yellow] found.", bold=False)
+            raise typer.Exit(-1)
+        return job_id
+    jobs = [job for job in jobs_helpers.list() if not running_only or job["state"] not in FINISHED_STATES]
+    if not jobs:
+        typer_logger.msg(":person_shrugging: No running jobs." if running_only else ":person_shrugging: No jobs found.")
+        raise typer.Exit(-1)
+    option, _ = Picker([f"{job['id']} ({job['state']})" for job in reversed(jobs)], "Select a job:").start()
+    return option.split(" ")[0]
+
+
+# noinspection PyShadowingBuiltins
+@jobs_app.command("list")
+def list_jobs(all: bool = typer.Option(False, "--all", help="Also list the jobs that finished")):
+    """
+    List the background jobs with their state and exit code.
+
+    """
+    jobs = [job for job in jobs_helpers.list() if all or job["state"] not in FINISHED_STATES]
+    if not jobs:
+        typer_logger.msg(
+            ":person_shrugging: No running jobs. Use [bold]--all[/bold] to see the jobs that finished."
+            if not all
+            else ":person_shrugging: No jobs found."
+        )
+        return
+    console.print(jobs_helpers.table(jobs))
+
+
+@jobs_app.command()
+def logs(
+    job_id: str = typer.Argument(None, help="Job to show the output of, pick from a list when not set"),
+    lines: int = typer.Option(50, help="Number of lines from the end of the output to show, 0 for all"),
+    follow: bool = typer.Option(False, help="Keep printing the output until the job finished"),
+):
+    """
+    Show the output of a background job.
+
+    """
+    job_id = pick_job(job_id)
+    for line in jobs_helpers.tail(job_id, lines=lines):
+        console.out(line, highlight=False)
+    if follow:
+        for line in jobs_helpers.follow(job_id):
+            console.out(line, highlight=False)
+
+
+@jobs_app.command()
+def wait(
+    job_id: str = typer.Argument(None, help="Job to wait for, pick from a list when not set"),
+    timeout: int = typer.Option(0, help="Minutes to wait for, 0 to wait until the job finished"),
+):
+    """
+    Wait for a background job to finish, exits with the exit code of the job.
+
+    """
+    job_id = pick_job(job_id, running_only=True)
+    with console.status(f"Waiting for job {job_id}"):
+        job = jobs_helpers.wait(job_id, timeout_seconds=timeout * 60)
+    console.print(jobs_helpers.table([job]))
+    if job["state"] not in FINISHED_STATES:
+        typer_logger.msg(f":hourglass: Job [yellow]{job_id}[/yellow] is still running.", bold=False)
+        raise typer.Exit(-1)
+    if job["state"] != "succeeded":
+        typer_logger.msg(
+            f":broken_heart: Job {job['state']}. Use [yellow][bold]tappr jobs logs {job_id}[/bold][/yellow] to see its output.", bold=False
+        )
+        raise typer.Exit(job["exit_code"] if job["exit_code"] else -1)
+
+
+@jobs_app.command()
+def cancel(job_id: str = typer.Argument(None, help="Job to cancel, pick from a list when not set")):
+    """
+    Cancel a running background job.
+
+    """
+    job_id = pick_job(job_id, running_only=True)
+    if not jobs_helpers.cancel(job_id):
+        typer_logger.msg(f":worried: Job [yellow]{job_id}[/yellow] is not running.", bold=False)
+        raise typer.Exit(-1)
+    job = jobs_helpers.wait(job_id, timeout_seconds=10, poll_seconds=0.2)
+    typer_logger.msg(f":stop_sign: Job [yellow]{job_id}[/yellow] {job['state']}", bold=False)
+
+
 if __name__ == "__main__":
     app()
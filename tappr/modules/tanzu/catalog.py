@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+CATALOG_TTL_SECONDS = 6 * 60 * 60
+
+SEMVER = re.compile(r"^v?(\d+)\.(\d+)\.(\d+)(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$")
+
+
+def catalog_dir():
+    return f'{os.environ.get("HOME")}/.config/tappr/catalog'
+
+
+def semver_key(version):
+    """
+    return a sort key that orders versions by semver precedence, None when version is not a semver (e.g. a sha256-... tag).
+    A release sorts after its pre-releases, numeric pre-release identifiers sort numerically and before alphanumeric ones.
+    """
+    match = SEMVER.match(version.strip())
+    if not match:
+        return None
+    major, minor, patch, prerelease = match.groups()
+    if prerelease is None:
+        return int(major), int(minor), int(patch), (1,)
+    identifiers = tuple((0, int(part), "") if part.isdigit() else (1, 0, part) for part in prerelease.split("."))
+    return int(major), int(minor), int(patch), (0,) + identifiers
+
+
+def sort_versions(tags):
+    """
+    return the semver tags of tags, oldest first, everything else is dropped
+    """
+    keyed = [(semver_key(tag), tag.strip()) for tag in tags]
+    return [tag for key, tag in sorted((item for item in keyed if item[0] is not None), key=lambda item: item[0])]
+
+
+def filter_versions(versions, since=None, latest_patch: bool = False):
+    """
+    return the versions (sorted oldest first) at or after since, e.g. 1.5 or 1.5.2. With latest_patch, only the newest version of each minor.
+    raises ValueError when since is not a version
+    """
+    if since:
+        parts = since.strip().lstrip("v").split(".")
+        if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+            raise ValueError(f"{since} is not a version like 1.5 or 1.5.2")
+        floor = tuple(int(part) for part in parts) + (0,) * (3 - len(parts))
+        versions = [version for version in versions if semver_key(version)[:3] >= floor]
+    if latest_patch:
+        newest = dict()
+        for version in versions:
+            newest[semver_key(version)[:2]] = version
+        versions = sorted(newest.values(), key=semver_key)
+    return versions
+
+
+def parse_tag_list(output: str):
+    """
+    return the tags in the output of imgpkg tag list, the first column of every row
+    """
+    return [line.split()[0] for line in output.splitlines() if line.strip()]
+
+
+# noinspection PyBroadException
+class VersionCatalog:
+    """
+    On disk cache of the versions published to an image repository, keyed by repository.
+    The tags are only listed from the registry when the cache is missing, older than the TTL, or refresh is asked for.
+    """
+
+    def __init__(self, ttl_seconds: int = CATALOG_TTL_SECONDS, path=None):
+        self.ttl_seconds = ttl_seconds
+        self.path = path if path else catalog_dir()
+        self._lock = threading.Lock()
+
+    def _file(self, repository):
+        return f"{self.path}/{hashlib.sha256(repository.encode()).hexdigest()[:16]}.json"
+
+    def cached(self, repository):
+        """
+        return the cache entry of repository, {"repository", "fetched", "versions"}, None when there is none
+        """
+        try:
+            with open(self._file(repository), "r") as f:
+                entry = json.loads(f.read())
+            return entry if entry.get("repository") == repository else None
+        except Exception:
+            return None
+
+    def versions(self, repository, list_tags, refresh: bool = False):
+        """
+        return the versions of repository sorted oldest first, and the cache entry they came from.
+        list_tags() returns the tags of the repository from the registry, it is only called when the cache cannot be used.
+        raises the exception of list_tags when there is no cache entry to fall back to
+        """
+        entry = self.cached(repository)
+        if entry and not refresh and time.time() - entry["fetched"] < self.ttl_seconds:
+            return entry["versions"], entry
+        try:
+            versions = sort_versions(list_tags())
+        except Exception:
+            # A stale catalog is still better than no catalog when the registry cannot be reached
+            if entry:
+                return entry["versions"], dict(entry, stale=True)
+            raise
+        entry = {"repository": repository, "fetched": time.time(), "versions": versions}
+        self._write(repository, entry)
+        return versions, entry
+
+    def _write(self, repository, entry):
+        with self._lock:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                tmp_path = f"{self._file(repository)}.{os.getpid()}"
+                with open(tmp_path, "w") as f:
+                    f.write(json.dumps(entry))
+                os.replace(tmp_path, self._file(repository))
+            except Exception:
+                pass
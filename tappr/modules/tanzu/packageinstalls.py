@@ -0,0 +1,291 @@
+import base64
+import time
+
+from kubernetes.client.rest import ApiException
+from rich.table import Table
+
+GROUP = "packaging.carvel.dev"
+VERSION = "v1alpha1"
+PLURAL = "packageinstalls"
+REPOSITORY_PLURAL = "packagerepositories"
+API_VERSION = f"{GROUP}/{VERSION}"
+
+CONDITION_STYLE = {
+    "ReconcileSucceeded": "green",
+    "Reconciling": "yellow",
+    "Deleting": "yellow",
+    "ReconcileFailed": "red",
+    "DeleteFailed": "red",
+}
+
+
+def package_state(item: dict):
+    """
+    return the fields of a packageinstall that tappr renders: name, version, condition and usefulErrorMessage
+    """
+    status = item.get("status") or dict()
+    conditions = status.get("conditions") or [{"type": "Pending"}]
+    return {
+        "name": item["metadata"]["name"],
+        "version": status.get("version", ""),
+        "condition": conditions[0]["type"],
+        "error": status.get("usefulErrorMessage", ""),
+        # False until kapp-controller picked up the latest spec, e.g. right after an upgrade patched the packageinstall
+        "current": status.get("observedGeneration", 0) >= item["metadata"].get("generation", 0),
+    }
+
+
+def package_repository_object(name, namespace, url):
+    return {
+        "apiVersion": API_VERSION,
+        "kind": "PackageRepository",
+        "metadata": {"name": name, "namespace": namespace},
+        "spec": {"fetch": {"imgpkgBundle": {"image": url}}},
+    }
+
+
+def package_install_objects(name, namespace, package_name, version, values: str):
+    """
+    return the objects tanzu package install creates: a service account bound to a cluster-admin like role,
+    the values secret and the PackageInstall itself, named the same way the CLI names them
+    """
+    prefix = f"{name}-{namespace}"
+    return [
+        {"apiVersion": "v1", "kind": "ServiceAccount", "metadata": {"name": f"{prefix}-sa", "namespace": namespace}},
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "ClusterRole",
+            "metadata": {"name": f"{prefix}-cluster-role"},
+            "rules": [{"apiGroups": ["*"], "resources": ["*"], "verbs": ["*"]}],
+        },
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "ClusterRoleBinding",
+            "metadata": {"name": f"{prefix}-cluster-rolebinding"},
+            "roleRef": {"apiGroup": "rbac.authorization.k8s.io", "kind": "ClusterRole", "name": f"{prefix}-cluster-role"},
+            "subjects": [{"kind": "ServiceAccount", "name": f"{prefix}-sa", "namespace": namespace}],
+        },
+        {
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "metadata": {"name": f"{prefix}-values", "namespace": namespace},
+            "data": {"values.yaml": base64.b64encode(values.encode()).decode()},
+        },
+        {
+            "apiVersion": API_VERSION,
+            "kind": "PackageInstall",
+            "metadata": {"name": name, "namespace": namespace},
+            "spec": {
+                "serviceAccountName": f"{prefix}-sa",
+                "packageRef": {"refName": package_name, "versionSelection": {"constraints": version, "prereleases": {}}},
+                "values": [{"secretRef": {"name": f"{prefix}-values"}}],
+            },
+        },
+    ]
+
+
+def wait_for_reconcile(k8s_helper, client, plural, name, namespace, timeout_seconds: int = 10 * 60):
+    """
+    follow a single PackageRepository/PackageInstall with a watch until kapp-controller reconciled its latest spec
+    return success: bool, reason: str ("reconciled", "failed: <usefulErrorMessage>", "timeout" or "not found")
+    """
+    deadline = time.time() + timeout_seconds
+    success, response = k8s_helper.get_namespaced_custom_objects(
+        name=name, group=GROUP, version=VERSION, namespace=namespace, plural=plural, client=client
+    )
+    if not success:
+        return False, "not found"
+    obj = response
+    while True:
+        row = package_state(obj)
+        if row["current"] and row["condition"] == "ReconcileSucceeded":
+            return True, "reconciled"
+        if row["current"] and row["condition"] == "ReconcileFailed":
+            return False, f"failed: {row['error']}"
+        remaining = int(deadline - time.time())
+        if remaining <= 0:
+            return False, "timeout"
+        try:
+            for event in k8s_helper.watch_namespaced_custom_objects(
+                group=GROUP,
+                version=VERSION,
+                namespace=namespace,
+                plural=plural,
+                client=client,
+                resource_version=obj["metadata"]["resourceVersion"],
+                timeout_seconds=max(min(remaining, 30), 1),
+                field_selector=f"metadata.name={name}",
+            ):
+                if event["type"] in ("ADDED", "MODIFIED"):
+                    obj = event["object"]
+                    break
+                if event["type"] == "DELETED":
+                    return False, "not found"
+        except ApiException as err:
+            if err.status != 410:
+                raise
+            success, response = k8s_helper.get_namespaced_custom_objects(
+                name=name, group=GROUP, version=VERSION, namespace=namespace, plural=plural, client=client
+            )
+            if not success:
+                return False, "not found"
+            obj = response
+
+
+def state_table(rows: dict, title="TAP Packages"):
+    table = Table(title=title)
+    table.add_column("Package")
+    table.add_column("Version", style="cyan")
+    table.add_column("State")
+    for name in sorted(rows):
+        row = rows[name]
+        style = CONDITION_STYLE.get(row["condition"], "white")
+        table.add_row(name, row["version"], f"[bold][{style}]{row['condition']}[/{style}][/bold]")
+    return table
+
+
+class PackageInstallTracker:
+    """
+    Keeps an in memory map of the packageinstalls in a namespace, keyed by package name, in sync with a single watch stream.
+    """
+
+    def __init__(self, k8s_helper, k8s_context, namespace, watch_timeout_seconds: int = 300):
+        self.k8s_helper = k8s_helper
+        self.client = k8s_helper.custom_clients[k8s_context]
+        self.namespace = namespace
+        self.watch_timeout_seconds = watch_timeout_seconds
+        self.rows: dict[str, dict] = dict()
+
+    def relist(self):
+        success, response = self.k8s_helper.list_namespaced_custom_objects(
+            group=GROUP, version=VERSION, namespace=self.namespace, plural=PLURAL, client=self.client
+        )
+        if not success:
+            raise response
+        self.rows = {row["name"]: row for row in (package_state(item) for item in response["items"])}
+        return response["metadata"]["resourceVersion"]
+
+    def follow(self):
+        """
+        yield the set of package names whose row changed, starting with all packages from the initial list.
+        Reconnects when the server ends the watch stream (yielding an empty set) and lists again when the resourceVersion expired.
+        """
+        resource_version = self.relist()
+        yield set(self.rows)
+        while True:
+            try:
+                for event in self.k8s_helper.watch_namespaced_custom_objects(
+                    group=GROUP,
+                    version=VERSION,
+                    namespace=self.namespace,
+                    plural=PLURAL,
+                    client=self.client,
+                    resource_version=resource_version,
+                    timeout_seconds=self.watch_timeout_seconds,
+                ):
+                    obj = event["object"]
+                    resource_version = obj["metadata"].get("resourceVersion", resource_version)
+                    if event["type"] == "BOOKMARK":
+                        continue
+                    name = obj["metadata"]["name"]
+                    if event["type"] == "DELETED":
+                        self.rows.pop(name, None)
+                        yield {name}
+                        continue
+                    row = package_state(obj)
+                    if self.rows.get(name) != row:
+                        self.rows[name] = row
+                        yield {name}
+                yield set()
+            except ApiException as err:
+                if err.status != 410:
+                    raise
+                previous = dict(self.rows)
+                resource_version = self.relist()
+                yield {name for name in set(previous) | set(self.rows) if previous.get(name) != self.rows.get(name)}
+
+
+class ReconcileMonitor:
+    """
+    Follows the packageinstalls of a TAP install/upgrade until every package reconciled, failing fast on the first ReconcileFailed.
+    Records how long each package spent reconciling.
+    """
+
+    def __init__(self, tracker: PackageInstallTracker, root_package: str = "tap", timeout_seconds: int = 30 * 60):
+        self.tracker = tracker
+        self.root_package = root_package
+        self.timeout_seconds = timeout_seconds
+        self.started: dict[str, float] = dict()
+        self.finished: dict[str, float] = dict()
+        self.failed: list[dict] = list()
+        self.start_time = time.time()
+
+    def done(self):
+        rows = self.tracker.rows
+        if self.root_package not in rows:
+            return False
+        return all(row["current"] and row["condition"] == "ReconcileSucceeded" for row in rows.values())
+
+    def elapsed(self, name):
+        if name not in self.started:
+            return None
+        return self.finished.get(name, time.time()) - self.started[name]
+
+    def _record(self, name, now):
+        row = self.tracker.rows.get(name)
+        if row is None:
+            return
+        if not (row["current"] and row["condition"] == "ReconcileSucceeded"):
+            self.started.setdefault(name, now)
+            self.finished.pop(name, None)
+        elif name in self.started and name not in self.finished:
+            self.finished[name] = now
+        if row["current"] and row["condition"] == "ReconcileFailed":
+            self.failed.append(row)
+
+    def run(self, on_change=None):
+        """
+        return success: bool, reason: str ("reconciled", "failed" or "timeout")
+        """
+        # Short watch streams so that the timeout is checked even when nothing changes
+        self.tracker.watch_timeout_seconds = min(self.tracker.watch_timeout_seconds, 30)
+        for changed in self.tracker.follow():
+            now = time.time()
+            for name in changed:
+                self._record(name, now)
+            if on_change and changed:
+                on_change()
+            if self.failed:
+                return False, "failed"
+            if self.done():
+                return True, "reconciled"
+            if now - self.start_time > self.timeout_seconds:
+                return False, "timeout"
+        return False, "timeout"
+
+    def table(self, title="TAP Packages"):
+        table = Table(title=title)
+        table.add_column("Package")
+        table.add_column("Version", style="cyan")
+        table.add_column("State")
+        table.add_column("Reconciling for", justify="right")
+        rows = self.tracker.rows
+        for name in sorted(rows):
+            row = rows[name]
+            style = CONDITION_STYLE.get(row["condition"], "white")
+            elapsed = self.elapsed(name)
+            table.add_row(
+                name, row["version"], f"[bold][{style}]{row['condition']}[/{style}][/bold]", f"{elapsed:.0f}s" if elapsed is not None else "-"
+            )
+        return table
+
+    def timing_table(self, title="Reconcile time per package"):
+        table = Table(title=title)
+        table.add_column("Package")
+        table.add_column("Reconcile time", justify="right")
+        table.add_column("Share of total", justify="right")
+        total = time.time() - self.start_time
+        for name in sorted(self.started, key=lambda n: self.elapsed(n), reverse=True):
+            elapsed = self.elapsed(name)
+            table.add_row(name, f"{elapsed:.1f}s", f"{elapsed / total * 100:.0f}%" if total > 0 else "-")
+        return table
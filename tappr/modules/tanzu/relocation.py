@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+from rich.table import Table
+
+TAP_PACKAGES_REPOSITORY = "registry.tanzu.vmware.com/tanzu-application-platform/tap-packages"
+
+JOB_STATE_STYLE = {
+    "queued": "white",
+    "running": "yellow",
+    "retrying": "yellow",
+    "succeeded": "green",
+    "relocated": "cyan",
+    "failed": "red",
+    "skipped": "white",
+}
+
+
+def copy_command(version, to_repo, resume: bool = False):
+    """
+    return the imgpkg copy command of a TAP version. With resume imgpkg skips the layers already in the target repository.
+    """
+    cmd = ["imgpkg", "copy", "-b", f"{TAP_PACKAGES_REPOSITORY}:{version}", "--to-repo", to_repo]
+    return cmd + ["--resume"] if resume else cmd
+
+
+def state_path(to_repo):
+    return f'{os.environ.get("HOME")}/.config/tappr/relocate/{hashlib.sha256(to_repo.encode()).hexdigest()[:16]}.json'
+
+
+# noinspection PyBroadException
+class RelocationState:
+    """
+    json file of the relocation jobs to a repository, keyed by version, with their state, attempts, exit code and log file.
+    Written after every state change, so that an interrupted run knows which versions were relocated already.
+    """
+
+    def __init__(self, to_repo, path=None):
+        self.to_repo = to_repo
+        self.path = path if path else state_path(to_repo)
+        self.jobs: dict[str, dict] = dict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.jobs = json.loads(f.read()).get("jobs", dict())
+        except Exception:
+            self.jobs = dict()
+        return self
+
+    def relocated(self, version):
+        return self.jobs.get(version, dict()).get("state") == "succeeded"
+
+    def interrupted(self, version):
+        """
+        True when an earlier run started copying version without finishing it, so some of its layers are in the repository
+        """
+        return self.jobs.get(version, dict()).get("state") in ("running", "retrying", "failed")
+
+    def update(self, version, **fields):
+        with self._lock:
+            self.jobs.setdefault(version, dict()).update(fields)
+            self._write()
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"to_repo": self.to_repo, "jobs": self.jobs}))
+        os.replace(tmp_path, self.path)
+
+
+def run_copy(version, to_repo, log_path, state: RelocationState, row: dict, retries: int = 2, retry_delay_seconds: float = 10):
+    """
+    run imgpkg copy for version with its output appended to log_path, retrying up to retries times with --resume
+    return success: bool
+    """
+    resume = state.interrupted(version)
+    for attempt in range(1, retries + 2):
+        row["state"], row["attempt"] = "running" if attempt == 1 else "retrying", attempt
+        state.update(version, state=row["state"], attempts=attempt, log=log_path, started=row["started"])
+        with open(log_path, "a") as log:
+            cmd = copy_command(version, to_repo, resume=resume or attempt > 1)
+            log.write(f"{time.strftime('%H:%M:%S')} attempt {attempt}: {' '.join(cmd)}\n")
+            log.flush()
+            exit_code = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL).returncode
+            log.write(f"{time.strftime('%H:%M:%S')} attempt {attempt} exited with {exit_code}\n")
+        if exit_code == 0:
+            row["state"] = "succeeded"
+            state.update(version, state="succeeded", exit_code=0, finished=time.time())
+            return True
+        state.update(version, state="failed", exit_code=exit_code, finished=time.time())
+        if attempt <= retries:
+            time.sleep(retry_delay_seconds * attempt)
+    row["state"] = "failed"
+    return False
+
+
+def relocation_table(rows: dict, title, logs: bool = False):
+    table = Table(title=title)
+    table.add_column("Version")
+    table.add_column("State")
+    table.add_column("Attempt", justify="right")
+    table.add_column("Time", justify="right")
+    table.add_column("Log file", overflow="fold") if logs else None
+    for version, row in rows.items():
+        style = JOB_STATE_STYLE[row["state"]]
+        elapsed = (row["finished"] or time.time()) - row["started"] if row["started"] else None
+        cells = [
+            version,
+            f"[bold][{style}]{row['state']}[/{style}][/bold]",
+            str(row["attempt"]) if row["attempt"] else "-",
+            f"{elapsed:.0f}s" if elapsed is not None else "-",
+        ]
+        table.add_row(*cells, row["log"] or "-") if logs else table.add_row(*cells)
+    return table
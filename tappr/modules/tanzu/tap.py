@@ -1,20 +1,66 @@
-import base64
 import hashlib
 import json
 import os
+import re
+import shlex
 import time
-import subprocess
+import sys
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import typer
 import yaml
+from kubernetes.client.rest import ApiException
 from rich import print as rprint
+from rich.live import Live
+from rich.table import Table
+from rich.text import Text
 
 import tappr.modules.utils.k8s
+from tappr.modules.tanzu.catalog import VersionCatalog, filter_versions, parse_tag_list
+from tappr.modules.tanzu.packageinstalls import (
+    CONDITION_STYLE,
+    GROUP,
+    PLURAL,
+    REPOSITORY_PLURAL,
+    VERSION,
+    PackageInstallTracker,
+    ReconcileMonitor,
+    package_install_objects,
+    package_repository_object,
+    package_state,
+    state_table,
+    wait_for_reconcile,
+)
+from tappr.modules.tanzu.relocation import TAP_PACKAGES_REPOSITORY, RelocationState, relocation_table, run_copy
+from tappr.modules.tanzu.tapvalues import TapValues
 from tappr.modules.utils.commons import Commons
-from tappr.modules.utils.ui import Picker
+from tappr.modules.utils.dag import DAG, Journal, file_digest
+from tappr.modules.utils.jobs import Jobs
+from tappr.modules.utils.logger import FileLogger
+from tappr.modules.utils.ui import UI, Picker
 
 commons = Commons()
 
+TAP_REPOSITORY = "tanzu-tap-repository"
+TAP_PACKAGE = "tap.tanzu.vmware.com"
+# Credentials the relocate command resolved, handed to its background job. They win over the tappr init config like the command line flags.
+RELOCATE_CREDENTIALS_ENV = {
+    "tanzunet_username": "TAPPR_RELOCATE_TANZUNET_USERNAME",
+    "tanzunet_password": "TAPPR_RELOCATE_TANZUNET_PASSWORD",
+    "registry_username": "TAPPR_RELOCATE_REGISTRY_USERNAME",
+    "registry_password": "TAPPR_RELOCATE_REGISTRY_PASSWORD",
+}
+
+CLUSTER_STATE_STYLE = {
+    "queued": "white",
+    "running": "yellow",
+    "succeeded": "green",
+    "failed": "red",
+    "skipped": "white",
+}
+
 auto_complete_list = [
     "profile",
     "ceip_policy_disclosed",
@@ -140,7 +186,7 @@ auto_complete_list = [
 
 # noinspection PyBroadException
 class TanzuApplicationPlatform:
-    def __init__(self, subprocess_helper, logger, creds_helper, state, ui_helper, k8s_helper, console):
+    def __init__(self, subprocess_helper, logger, creds_helper, state, ui_helper, k8s_helper, console, jobs_helper: Jobs = None):
         self.console = console
         self.creds_helper = creds_helper
         self.logger = logger
@@ -148,22 +194,116 @@ class TanzuApplicationPlatform:
         self.state = state
         self.ui_helper = ui_helper
         self.k8s_helper: tappr.modules.utils.k8s.K8s = k8s_helper
+        self.jobs_helper = jobs_helper if jobs_helper else Jobs()
 
     def sh_call(self, cmd, msg, spinner_msg, error_msg):
         return self.ui_helper.sh_call(cmd=cmd, msg=msg, spinner_msg=spinner_msg, error_msg=error_msg, state=self.state)
 
-    def create_or_update_secret(self, list_op, secret, username, password, namespace, msg, registry_server, export_everywhere=True):
-        self.sh_call(
-            cmd=(
-                f'tanzu secret registry {"update" if secret in list_op.decode() else "add"} {secret} '
-                f"--username '{username}' --password '{password}' {'--server' if secret not in list_op.decode() else ''} "
-                f"{registry_server if secret not in list_op.decode() else ''} "
-                f'{"--export-to-all-namespaces" if export_everywhere else ""} --yes --namespace {namespace}'
-            ),
-            msg=msg,
-            spinner_msg="Setting up",
-            error_msg=None,
+    def apply_yaml(self, k8s_context, yml, namespace, msg, spinner_msg, error_msg):
+        """
+        server side apply yml through the K8s helper and log the result of every object like kubectl apply does
+        Fields owned by another field manager are taken over, like kubectl apply overwrote them: the templates carry placeholder
+        image pull secrets whose data secretgen-controller rewrites and owns from then on.
+        return success: bool
+        """
+        self.logger.msg(msg, bold=False)
+        with self.console.status(spinner_msg) if self.ui_helper.live else nullcontext():
+            success, results = self.k8s_helper.apply_yaml(
+                yml=yml, namespace=namespace, client=self.k8s_helper.custom_clients[k8s_context], discovery=self.k8s_helper.discovery, force=True
+            )
+        if not success and not isinstance(results, list):
+            self.logger.msg(f"{results}") if self.state["verbose"] else None
+            self.logger.msg(error_msg)
+            return False
+        self.log_apply_results(results)
+        if not success:
+            self.logger.msg(error_msg)
+        return success
+
+    def apply_registry_secrets(self, k8s_context, namespace, secrets: list):
+        """
+        create or update the registry secrets (dict with name, server, username, password, export and msg) and their SecretExports
+        with a single concurrent batch of server side applies
+        return success: bool
+        """
+        objects = list()
+        for secret in secrets:
+            self.logger.msg(secret["msg"], bold=False)
+            objects.extend(
+                self.k8s_helper.registry_secret_objects(
+                    name=secret["name"],
+                    namespace=namespace,
+                    server=secret["server"],
+                    username=secret["username"],
+                    password=secret["password"],
+                    export_to_all_namespaces=secret["export"],
+                )
+            )
+        # Secrets made by tanzu secret registry add/update are owned by the tanzu CLI, overwrite them as it would
+        success, results = self.k8s_helper.apply_objects(
+            objects, namespace=namespace, client=self.k8s_helper.custom_clients[k8s_context], discovery=self.k8s_helper.discovery, force=True
+        )
+        self.log_apply_results(results)
+        return success
+
+    def log_apply_results(self, results: list):
+        for result in results:
+            if result.get("conflicts"):
+                self.logger.msg(f":warning: {result['kind'].lower()}/{result['name']} took over fields: {result['conflicts']}", bold=False)
+            outcome = result["action"] if result["error"] is None else f"failed: {result['error']}"
+            self.logger.msg(f"{result['kind'].lower()}/{result['name']} {outcome}", bold=False) if self.state["verbose"] else None
+
+    @staticmethod
+    def package_repository_url(install_registry_server, version):
+        if "packages.broadcom.com" in install_registry_server:
+            return f"{install_registry_server}/{version}/tanzu-application-platform/tap-packages:{version}"
+        return f"{install_registry_server}/tanzu-application-platform/tap-packages:{version}"
+
+    def apply_package_repository(self, k8s_context, namespace, url, timeout_seconds: int):
+        """
+        server side apply the TAP PackageRepository and watch it until kapp-controller fetched the new url
+        return success: bool
+        """
+        client = self.k8s_helper.custom_clients[k8s_context]
+        # Repositories added by the tanzu CLI or an older tappr are owned by another field manager, the new url has to win
+        success, results = self.k8s_helper.apply_objects(
+            [package_repository_object(name=TAP_REPOSITORY, namespace=namespace, url=url)],
+            namespace=namespace,
+            client=client,
+            discovery=self.k8s_helper.discovery,
+            force=True,
+        )
+        self.log_apply_results(results)
+        if not success:
+            return False
+        success, reason = wait_for_reconcile(
+            k8s_helper=self.k8s_helper,
+            client=client,
+            plural=REPOSITORY_PLURAL,
+            name=TAP_REPOSITORY,
+            namespace=namespace,
+            timeout_seconds=timeout_seconds,
+        )
+        self.logger.msg(f"packagerepository/{TAP_REPOSITORY} {reason}", bold=False) if self.state["verbose"] or not success else None
+        return success
+
+    def apply_package_install(self, k8s_context, namespace, version, values_file):
+        """
+        server side apply the TAP PackageInstall with its service account, RBAC and values secret
+        return success: bool
+        """
+        with open(values_file, "r") as f:
+            values = f.read()
+        # The values file given to install wins over edits made to the values secret since, e.g. by tappr gui track
+        success, results = self.k8s_helper.apply_objects(
+            package_install_objects(name="tap", namespace=namespace, package_name=TAP_PACKAGE, version=version, values=values),
+            namespace=namespace,
+            client=self.k8s_helper.custom_clients[k8s_context],
+            discovery=self.k8s_helper.discovery,
+            force=True,
         )
+        self.log_apply_results(results)
+        return success
 
     def tap_install(
         self,
@@ -184,23 +324,23 @@ class TanzuApplicationPlatform:
         service_type,
         exclude_package,
         namespace: str = "tap-install",
+        wait_timeout: int = 30,
+        resume: bool = False,
+        tanzu_cli: bool = False,
     ):
         # Setup k8s context and which kubernetes cluster to work on
         k8s_context = commons.check_and_pick_k8s_context(
             k8s_context=None, k8s_helper=self.k8s_helper, logger=self.logger, ui_helper=self.ui_helper, state=self.state
         )
 
-        # Create staging dir
-        hash_str = str(profile + version) + str(time.time())
+        # The same install on the same cluster always stages in the same dir, which holds the journal that --resume reads
+        hash_str = json.dumps([k8s_context, namespace, profile, version])
         tmp_dir = f"/tmp/{hashlib.md5(hash_str.encode()).hexdigest()}"
         self.logger.msg(f":file_folder: Staging Installation Dir is at [yellow]{tmp_dir}[/yellow]", bold=False)
-        if not os.path.isdir(tmp_dir):
-            self.sh_call(
-                cmd=f"mkdir -p {tmp_dir}",
-                msg=":file_folder: Creating Staging Dir",
-                spinner_msg="Creating dir",
-                error_msg=":broken_heart: Unable to create staging directory. Use [bold]--verbose[/bold] flag for error details.",
-            )
+        journal = Journal(f"{tmp_dir}/journal.json")
+        if resume:
+            journal.load()
+            self.logger.msg(f":repeat: Resuming, {len(journal.entries)} completed steps in the journal", bold=False)
 
         # Get values from tappr init
         install_registry_server = self.creds_helper.get("install_registry_server", "INSTALL_REGISTRY_SERVER")
@@ -212,141 +352,218 @@ class TanzuApplicationPlatform:
         registry_tbs_repo = self.creds_helper.get("registry_tbs_repo", "REGISTRY_TBS_REPO")
         if os.path.isfile(registry_password):
             registry_password = open(registry_password, "r").read()
-        os.environ["TAP_VERSION"] = version
-        os.environ["INSTALL_REGISTRY_HOSTNAME"] = install_registry_server
-        os.environ["INSTALL_REGISTRY_USERNAME"] = tanzunet_username
-        os.environ["INSTALL_REGISTRY_PASSWORD"] = tanzunet_password
+        install_env = {
+            "TAP_VERSION": version,
+            "INSTALL_REGISTRY_HOSTNAME": install_registry_server,
+            "INSTALL_REGISTRY_USERNAME": tanzunet_username,
+            "INSTALL_REGISTRY_PASSWORD": tanzunet_password,
+        }
+        # Only the child processes of this install get these, installs to several clusters run in threads of the same process
+        self.state["kube_env"].update(install_env)
 
-        # Install Cluster essentials
-        if not skip_cluster_essentials:
-            commons.install_cluster_essentials(ui_helper=self.ui_helper, state=self.state)
+        # Generate data values
+        data_values = (
+            f"ingress_domain: {ingress_domain}\n"
+            f"ingress_issuer: '{ingress_issuer}'\n"
+            f"k8s_distribution: '{k8s_distribution}'\n"
+            f"profile: {profile}\n"
+            f"registry_server: {registry_server}\n"
+            f"registry_repo: {registry_tbs_repo}\n"
+            f"tbs_repo_push_secret: {tbs_repo_push_secret}\n"
+            f"tanzunet_pull_secret: {tanzunet_pull_secret}\n"
+            f"repo_pull_secret: {repo_pull_secret}\n"
+            f"supply_chain: {supply_chain}\n"
+            f"tap_install_ns: {namespace}\n"
+            f"contour_infra: {contour_infra}\n"
+            f"service_type: {service_type}\n"
+            f"version: {version}\n"
+            f"exclude_packages: {exclude_package}"
+        )
 
-        # Create TAP install namespace
-        ns_list = commons.get_ns_list(k8s_helper=self.k8s_helper, client=self.k8s_helper.core_clients[k8s_context])
-        if namespace not in ns_list:
-            success, response = self.k8s_helper.create_namespace(namespace=namespace, client=self.k8s_helper.core_clients[k8s_context])
-            if not success:
-                self.logger.msg(f"Error response {response}") if self.state["verbose"] else None
-                self.logger.msg(":broken_heart: Unable to create TAP install namespace. Use [bold]--verbose[/bold] flag for error details.")
-                raise typer.Exit(-1)
-        ns_list = commons.get_ns_list(k8s_helper=self.k8s_helper, client=self.k8s_helper.core_clients[k8s_context])
-        if namespace not in ns_list:
-            self.logger.msg(":broken_heart: Unable to find TAP install namespace. Use [bold]--verbose[/bold] flag for error details.")
-            raise typer.Exit(-1)
+        # Read CA Cert Data file
+        if ca_cert_file and os.path.isfile(ca_cert_file):
+            ca_cert_file_data = open(ca_cert_file, "r").read().replace("\n", "\n  ")
+            data_values += f"ca_cert_data: |\n  {ca_cert_file_data}\n"
+        values_template = os.path.dirname(os.path.abspath(__file__)).replace("/tanzu", f"/artifacts/profiles/tap-values.yml")
 
-        # Setup registry secrets
-        cmd = f"tanzu secret registry list --namespace {namespace}"
-        _, out, _ = self.sh.run_proc(cmd=cmd)
-        self.create_or_update_secret(
-            list_op=out,
-            secret=tanzunet_pull_secret,
-            username=tanzunet_username,
-            password=tanzunet_password,
-            namespace=namespace,
-            msg=f":key: Setting up Tanzu Network Image Pull Secret {tanzunet_pull_secret} and exporting to all namespaces",
-            registry_server=install_registry_server,
-        )
-        self.create_or_update_secret(
-            list_op=out,
-            secret=tbs_repo_push_secret,
-            username=registry_username,
-            password=registry_password,
-            namespace=namespace,
-            msg=f":key: Setting up User Registry Push Secret {tbs_repo_push_secret} for TBS",
-            registry_server=registry_server,
-            export_everywhere=False,
-        )
-        self.create_or_update_secret(
-            list_op=out,
-            secret=repo_pull_secret,
-            username=registry_username,
-            password=registry_password,
-            namespace=namespace,
-            msg=f":key: Setting up User Registry Image Pull Secret {repo_pull_secret} and exporting to all namespaces",
-            registry_server=registry_server,
-        )
+        # Steps run concurrently, so they log their commands instead of each drawing a spinner
+        step_ui = UI(subprocess_helper=self.sh, logger=self.logger, live=False)
+        values_file = tap_values_file or f"{tmp_dir}/tap-values.yml"
+        dag = DAG()
 
-        # Setup TAP PackageRepository
-        cmd = f"tanzu package repository list --namespace {namespace}"
-        _, out, _ = self.sh.run_proc(cmd=cmd)
+        def staging_dir():
+            os.makedirs(tmp_dir, exist_ok=True)
 
-        pkg_repo_url = f"{install_registry_server}/tanzu-application-platform/tap-packages:{version}"
-        if "packages.broadcom.com" in install_registry_server:
-            pkg_repo_url = f"{install_registry_server}/{version}/tanzu-application-platform/tap-packages:{version}"
+        def create_namespace():
+            ns_list = commons.get_ns_list(k8s_helper=self.k8s_helper, client=self.k8s_helper.core_clients[k8s_context])
+            if namespace not in ns_list:
+                success, response = self.k8s_helper.create_namespace(namespace=namespace, client=self.k8s_helper.core_clients[k8s_context])
+                if not success:
+                    self.logger.msg(f"Error response {response}") if self.state["verbose"] else None
+                    self.logger.msg(":broken_heart: Unable to create TAP install namespace. Use [bold]--verbose[/bold] flag for error details.")
+                    raise typer.Exit(-1)
+            ns_list = commons.get_ns_list(k8s_helper=self.k8s_helper, client=self.k8s_helper.core_clients[k8s_context])
+            if namespace not in ns_list:
+                self.logger.msg(":broken_heart: Unable to find TAP install namespace. Use [bold]--verbose[/bold] flag for error details.")
+                raise typer.Exit(-1)
 
-        self.sh_call(
-            cmd=f"tanzu package repository update tanzu-tap-repository --url {pkg_repo_url} --namespace {namespace}"
-            if "tanzu-tap-repository" in out.decode()
-            else f"tanzu package repository add tanzu-tap-repository --url {pkg_repo_url} --namespace {namespace}",
-            msg=":key: Setting up [yellow]tanzu-tap-repository[/yellow] package repo",
-            spinner_msg="Setting up",
-            error_msg=None,
-        )
-        _, out, _ = self.sh.run_proc(cmd=f"tanzu package repository get tanzu-tap-repository --namespace {namespace}")
-        self.logger.msg(out.decode(), bold=False) if self.state["verbose"] and out else None
+        registry_secrets = [
+            {
+                "name": tanzunet_pull_secret,
+                "server": install_registry_server,
+                "username": tanzunet_username,
+                "password": tanzunet_password,
+                "export": True,
+                "msg": f":key: Setting up Tanzu Network Image Pull Secret {tanzunet_pull_secret} and exporting to all namespaces",
+            },
+            {
+                "name": tbs_repo_push_secret,
+                "server": registry_server,
+                "username": registry_username,
+                "password": registry_password,
+                "export": False,
+                "msg": f":key: Setting up User Registry Push Secret {tbs_repo_push_secret} for TBS",
+            },
+            {
+                "name": repo_pull_secret,
+                "server": registry_server,
+                "username": registry_username,
+                "password": registry_password,
+                "export": True,
+                "msg": f":key: Setting up User Registry Image Pull Secret {repo_pull_secret} and exporting to all namespaces",
+            },
+        ]
 
-        # Create a TAP Values yaml file
-        if not tap_values_file:
-            tap_values_file = f"{tmp_dir}/tap-values.yml"
-            data_values_file = f"{tmp_dir}/values.yml"
-            # Generate data values
-            data_values = (
-                f"ingress_domain: {ingress_domain}\n"
-                f"ingress_issuer: '{ingress_issuer}'\n"
-                f"k8s_distribution: '{k8s_distribution}'\n"
-                f"profile: {profile}\n"
-                f"registry_server: {registry_server}\n"
-                f"registry_repo: {registry_tbs_repo}\n"
-                f"tbs_repo_push_secret: {tbs_repo_push_secret}\n"
-                f"tanzunet_pull_secret: {tanzunet_pull_secret}\n"
-                f"repo_pull_secret: {repo_pull_secret}\n"
-                f"supply_chain: {supply_chain}\n"
-                f"tap_install_ns: {namespace}\n"
-                f"contour_infra: {contour_infra}\n"
-                f"service_type: {service_type}\n"
-                f"version: {version}\n"
-                f"exclude_packages: {exclude_package}"
-            )
+        def apply_registry_secrets():
+            if not self.apply_registry_secrets(k8s_context=k8s_context, namespace=namespace, secrets=registry_secrets):
+                self.logger.msg(":broken_heart: Unable to setup registry secrets. Use [bold]--verbose[/bold] flag for error details.")
+                raise typer.Exit(-1)
 
-            # Read CA Cert Data file
-            if ca_cert_file and os.path.isfile(ca_cert_file):
-                ca_cert_file_data = open(ca_cert_file, "r").read().replace("\n", "\n  ")
-                data_values += f"ca_cert_data: |\n  {ca_cert_file_data}\n"
+        pkg_repo_url = self.package_repository_url(install_registry_server, version)
 
+        def package_repository():
+            if not tanzu_cli:
+                self.logger.msg(f":key: Setting up [yellow]{TAP_REPOSITORY}[/yellow] package repo", bold=False)
+                if not self.apply_package_repository(
+                    k8s_context=k8s_context, namespace=namespace, url=pkg_repo_url, timeout_seconds=wait_timeout * 60
+                ):
+                    self.logger.msg(":broken_heart: Unable to setup the package repository. Use [bold]--verbose[/bold] flag for error details.")
+                    raise typer.Exit(-1)
+                return
+            _, out, _ = self.sh.run_proc(cmd=f"tanzu package repository list --namespace {namespace}", env=self.state.get("kube_env"))
+            step_ui.sh_call(
+                cmd=(
+                    f"tanzu package repository update tanzu-tap-repository --url {pkg_repo_url} --namespace {namespace}"
+                    if "tanzu-tap-repository" in out.decode()
+                    else f"tanzu package repository add tanzu-tap-repository --url {pkg_repo_url} --namespace {namespace}"
+                ),
+                msg=":key: Setting up [yellow]tanzu-tap-repository[/yellow] package repo",
+                spinner_msg="Setting up",
+                error_msg=None,
+                state=self.state,
+            )
+            _, out, _ = self.sh.run_proc(
+                cmd=f"tanzu package repository get tanzu-tap-repository --namespace {namespace}", env=self.state.get("kube_env")
+            )
+            self.logger.msg(out.decode(), bold=False) if self.state["verbose"] and out else None
+
+        def render_values():
+            data_values_file = f"{tmp_dir}/values.yml"
             # Write data values data values
             open(f"{data_values_file}", "w").write(data_values)
             # Create TAP Values file
-            cmd = (
-                f'ytt -f {os.path.dirname(os.path.abspath(__file__)).replace("/tanzu", f"/artifacts/profiles/tap-values.yml")} '
-                f"--data-values-file {data_values_file} > {tap_values_file}"
-            )
-            return_code = self.sh_call(
+            cmd = f"ytt -f {values_template} --data-values-file {data_values_file} > {values_file}"
+            return_code = step_ui.sh_call(
                 cmd=cmd,
-                msg=f":memo: Creating values yml file at [yellow]{tap_values_file}[/yellow]",
+                msg=f":memo: Creating values yml file at [yellow]{values_file}[/yellow]",
                 spinner_msg="Waiting to reconcile",
                 error_msg=None,
+                state=self.state,
             )
             if return_code != 0:
                 self.logger.msg(":broken_heart: Unable to create TAP values file. Use [bold]--verbose[/bold] flag for error details.")
                 raise typer.Exit(-1)
 
-        # TAP install
-        cmd = f"tanzu package install tap -p tap.tanzu.vmware.com -v {version} --values-file {tap_values_file} -n {namespace} --wait={'false' if not wait else 'true'}"
-        self.logger.debug(f"Running {cmd}. Can take up to 15-20 minutes depending on your machine.") if self.state["verbose"] and out else None
-        return_code = self.sh_call(
-            cmd=cmd,
-            msg=":wine_glass: Installing [yellow]TAP[/yellow]",
-            spinner_msg="Waiting to reconcile",
-            error_msg=None,
+        def install_tap():
+            if not tanzu_cli:
+                self.logger.msg(":wine_glass: Installing [yellow]TAP[/yellow]", bold=False)
+                if not self.apply_package_install(k8s_context=k8s_context, namespace=namespace, version=version, values_file=values_file):
+                    self.logger.msg(":broken_heart: Unable to Install TAP. Use [bold]--verbose[/bold] flag for error details.")
+                    raise typer.Exit(-1)
+                return
+            # With wait, tappr follows the packageinstalls itself instead of blocking on the tanzu CLI
+            cmd = f"tanzu package install tap -p tap.tanzu.vmware.com -v {version} --values-file {values_file} -n {namespace} --wait=false"
+            return_code = step_ui.sh_call(
+                cmd=cmd,
+                msg=":wine_glass: Installing [yellow]TAP[/yellow]",
+                spinner_msg="Creating package install",
+                error_msg=None,
+                state=self.state,
+            )
+            if return_code != 0:
+                self.logger.msg(":broken_heart: Unable to Install TAP. Use [bold]--verbose[/bold] flag for error details.")
+                raise typer.Exit(-1)
+
+        # The secrets and the package repository need the carvel controllers, the install needs everything else
+        # Steps with inputs are journaled, a --resume run skips them while their inputs and the inputs of their dependencies are unchanged
+        dag.add("staging-dir", "Create staging dir", staging_dir, inputs=tmp_dir, outputs=[tmp_dir])
+        essentials = list()
+        if not skip_cluster_essentials:
+            # Not journaled, the controllers are deployed from their latest release and kapp deploy does nothing when they are up to date
+            dag.add(
+                "cluster-essentials",
+                "Install cluster essentials",
+                lambda: commons.install_cluster_essentials(ui_helper=step_ui, state=self.state),
+            )
+            essentials = ["cluster-essentials"]
+        dag.add("namespace", f"Create namespace {namespace}", create_namespace, inputs=namespace)
+        # SecretExport is a secretgen-controller CRD
+        dag.add(
+            "registry-secrets",
+            "Registry secrets",
+            apply_registry_secrets,
+            deps=["namespace"] + essentials,
+            inputs=[{k: v for k, v in secret.items() if k != "msg"} for secret in registry_secrets],
         )
-        if return_code == 0:
-            if wait:
-                self.logger.msg(":rocket: TAP installation complete")
-            else:
-                self.logger.msg(":rocket: TAP install started on the cluster")
-        else:
-            self.logger.msg(":broken_heart: Unable to Install TAP. Use [bold]--verbose[/bold] flag for error details.")
+        dag.add(
+            "package-repository",
+            f"Package repository {TAP_REPOSITORY}",
+            package_repository,
+            deps=["namespace"] + essentials,
+            inputs=[install_registry_server, version],
+        )
+        install_deps = ["registry-secrets", "package-repository"]
+        if not tap_values_file:
+            dag.add(
+                "tap-values",
+                "Render TAP values",
+                render_values,
+                deps=["staging-dir"],
+                inputs=[data_values, file_digest(values_template)],
+                outputs=[values_file],
+            )
+            install_deps.append("tap-values")
+        dag.add(
+            "install",
+            "Create TAP package install",
+            install_tap,
+            deps=install_deps,
+            inputs=[version, file_digest(tap_values_file) if tap_values_file else None],
+        )
+
+        success = dag.run(live=self.ui_helper.live, console=self.console, title=f"Installing TAP {version}", journal=journal, resume=resume)
+        self.console.print(dag.timing_table())
+        if not success:
+            for step in dag.failed():
+                if not isinstance(step.error, typer.Exit):
+                    self.logger.msg(f"{step.name}: {step.error}") if self.state["verbose"] else None
+            self.logger.msg(f":broken_heart: Unable to Install TAP, step {', '.join(step.name for step in dag.failed())} failed.")
             raise typer.Exit(-1)
+        if wait:
+            self.monitor_reconcile(k8s_context=k8s_context, namespace=namespace, timeout_minutes=wait_timeout)
+            self.logger.msg(":rocket: TAP installation complete")
+        else:
+            self.logger.msg(":rocket: TAP install started on the cluster")
 
     def developer_ns_setup(self, namespace, install_ns="tap-install"):
         k8s_context = commons.check_and_pick_k8s_context(
@@ -368,22 +585,20 @@ class TanzuApplicationPlatform:
                 raise typer.Exit(-1)
 
         dev_yaml_path = os.path.dirname(os.path.abspath(__file__)).replace("/modules/tanzu", "") + f"/modules/artifacts/rbac/developer.yml"
-        hash_str = str(time.time())
-        tmp_dir = f"/tmp/{hashlib.md5(hash_str.encode()).hexdigest()}"
-        open(tmp_dir, "w").write(open(dev_yaml_path, "r").read().replace("{$$namespace}", namespace))
-
-        exit_code = self.sh_call(
-            cmd=f"kubectl -n {namespace} apply -f {tmp_dir}",
+        if not self.apply_yaml(
+            k8s_context=k8s_context,
+            yml=open(dev_yaml_path, "r").read().replace("{$$namespace}", namespace),
+            namespace=namespace,
             msg=f":sunglasses: Setting up developer namespace {namespace}",
             spinner_msg="Finalizing",
             error_msg=":broken_heart: Unable to setup developer namespace. Use [bold]--verbose[/bold] flag for error details.",
-        )
-        if exit_code != 0:
+        ):
             raise typer.Exit(-1)
 
+        # Named explicitly, so the default namespace lands on the context that was set up whatever the current-context is
         exit_code = self.sh_call(
-            cmd=f"kubectl config set-context --current --namespace={namespace}",
-            msg=f":sunglasses: Setting namespace {namespace} as default in current context",
+            cmd=f"kubectl config set-context {shlex.quote(k8s_context)} --namespace={namespace}",
+            msg=f":sunglasses: Setting namespace {namespace} as default in context {k8s_context}",
             spinner_msg="Finalizing",
             error_msg=":broken_heart: Unable to set namespace as default. Use [bold]--verbose[/bold] flag for error details.",
         )
@@ -405,18 +620,14 @@ class TanzuApplicationPlatform:
             template_base_path = (
                 os.path.dirname(os.path.abspath(__file__)).replace("/modules/tanzu", "") + f"/modules/artifacts/templates/test-pipeline.yml"
             )
-            hash_str = str(time.time())
-            tmp_dir = f"/tmp/{hashlib.md5(hash_str.encode()).hexdigest()}"
-            open(tmp_dir, "w").write(
-                open(template_base_path, "r").read().replace("{$$testTaskImage}", test_image).replace("{$$testTaskCmd}", test_cmd)
-            )
-            exit_code = self.sh_call(
-                cmd=f"kubectl -n {namespace} apply -f {tmp_dir}",
+            if not self.apply_yaml(
+                k8s_context=k8s_context,
+                yml=open(template_base_path, "r").read().replace("{$$testTaskImage}", test_image).replace("{$$testTaskCmd}", test_cmd),
+                namespace=namespace,
                 msg=f":sunglasses: Setting up test pipeline in namespace {namespace}",
                 spinner_msg="Finalizing",
                 error_msg=":broken_heart: Unable to add tekton test pipeline to namespace. Use [bold]--verbose[/bold] flag for error details.",
-            )
-            if exit_code != 0:
+            ):
                 raise typer.Exit(-1)
 
         if_add_scan_template = self.logger.confirm(":magnifying_glass_tilted_left: Do you want to add a scan policy?", default=False)
@@ -435,18 +646,14 @@ class TanzuApplicationPlatform:
             template_base_path = (
                 os.path.dirname(os.path.abspath(__file__)).replace("/modules/tanzu", "") + f"/modules/artifacts/templates/scan-policy.yml"
             )
-            hash_str = str(time.time())
-            tmp_dir = f"/tmp/{hashlib.md5(hash_str.encode()).hexdigest()}"
-            open(tmp_dir, "w").write(
-                open(template_base_path, "r").read().replace("{$$notAllowedSeverities}", f" notAllowedSeverities := {not_allowed_levels}")
-            )
-            exit_code = self.sh_call(
-                cmd=f"kubectl -n {namespace} apply -f {tmp_dir}",
+            if not self.apply_yaml(
+                k8s_context=k8s_context,
+                yml=open(template_base_path, "r").read().replace("{$$notAllowedSeverities}", f" notAllowedSeverities := {not_allowed_levels}"),
+                namespace=namespace,
                 msg=f":sunglasses: Setting up scan policy in namespace {namespace}",
                 spinner_msg="Finalizing",
                 error_msg=":broken_heart: Unable to add scan policy to namespace. Use [bold]--verbose[/bold] flag for error details.",
-            )
-            if exit_code != 0:
+            ):
                 raise typer.Exit(-1)
 
             # Check if grype is installed
@@ -480,6 +687,165 @@ class TanzuApplicationPlatform:
                         if exit_code != 0:
                             raise typer.Exit(-1)
 
+    @staticmethod
+    def load_namespace_specs(path):
+        """
+        return the namespaces to set up from a yaml file. Entries are either a namespace name or a mapping like
+          - name: team-a
+            test_pipeline: {image: gradle, cmd: ./mvnw test}
+            scan_policy: {not_allowed_severities: ["Critical", "High"]}
+        A plain text file with one namespace per line works too.
+        raises ValueError for entries without a name
+        """
+        with open(path, "r") as f:
+            data = yaml.safe_load(f.read())
+        if isinstance(data, str):
+            data = data.split()
+        if isinstance(data, dict):
+            data = data.get("namespaces")
+        specs = list()
+        for entry in data or []:
+            spec = {"name": entry} if isinstance(entry, str) else dict(entry or dict())
+            if not spec.get("name"):
+                raise ValueError(f"Namespace entry {entry} has no name")
+            spec["name"] = str(spec["name"])
+            if spec.get("test_pipeline") is not None:
+                spec["test_pipeline"] = {"image": "gradle", "cmd": "./mvnw test", **(spec["test_pipeline"] or dict())}
+            if spec.get("scan_policy") is not None:
+                spec["scan_policy"] = {"not_allowed_severities": [], **(spec["scan_policy"] or dict())}
+                if not isinstance(spec["scan_policy"]["not_allowed_severities"], list):
+                    raise ValueError(f"not_allowed_severities of {spec['name']} is not a list")
+            specs.append(spec)
+        return specs
+
+    def bulk_developer_ns_setup(self, namespaces_from, install_ns="tap-install", parallelism: int = 16):
+        """
+        Non-interactive developer_ns_setup for every namespace in namespaces_from.
+        Namespaces are listed and templates are read once, then namespaces are provisioned by a pool of parallelism workers.
+        """
+        try:
+            specs = self.load_namespace_specs(namespaces_from)
+        except Exception as err:
+            self.logger.msg(f"{err}") if self.state["verbose"] else None
+            self.logger.msg(
+                f":broken_heart: Unable to read namespaces from [yellow]{namespaces_from}[/yellow]. Use [bold]--verbose[/bold] flag for error details."
+            )
+            raise typer.Exit(-1)
+        if not specs:
+            self.logger.msg(f":broken_heart: No namespaces found in [yellow]{namespaces_from}[/yellow].")
+            raise typer.Exit(-1)
+
+        k8s_context = commons.check_and_pick_k8s_context(
+            k8s_context=None, k8s_helper=self.k8s_helper, logger=self.logger, ui_helper=self.ui_helper, state=self.state
+        )
+        core_client, custom_client = self.k8s_helper.core_clients[k8s_context], self.k8s_helper.custom_clients[k8s_context]
+        existing = set(commons.get_ns_list(k8s_helper=self.k8s_helper, client=core_client))
+        artifacts = os.path.dirname(os.path.abspath(__file__)).replace("/modules/tanzu", "") + "/modules/artifacts"
+        templates = {
+            "developer": open(f"{artifacts}/rbac/developer.yml", "r").read(),
+            "test_pipeline": open(f"{artifacts}/templates/test-pipeline.yml", "r").read(),
+            "scan_policy": open(f"{artifacts}/templates/scan-policy.yml", "r").read(),
+        }
+
+        grype_version = None
+        if any(spec.get("scan_policy") is not None for spec in specs):
+            success, response = self.k8s_helper.get_namespaced_custom_objects(
+                name="grype", group=GROUP, version=VERSION, namespace=install_ns, plural=PLURAL, client=custom_client
+            )
+            if success and package_state(response)["condition"] == "ReconcileSucceeded":
+                grype_version = package_state(response)["version"]
+
+        def provision(spec):
+            namespace, start = spec["name"], time.time()
+            row = {"namespace": namespace, "created": False, "actions": dict(), "extras": list(), "error": None}
+
+            def apply(yml):
+                # Forced for the same reason as apply_yaml, secretgen-controller owns the data of the placeholder pull secrets
+                success, results = self.k8s_helper.apply_yaml(
+                    yml=yml, namespace=namespace, client=custom_client, discovery=self.k8s_helper.discovery, max_workers=4, force=True
+                )
+                if not isinstance(results, list):
+                    raise ValueError(results)
+                for result in results:
+                    row["actions"][result["action"]] = row["actions"].get(result["action"], 0) + 1
+                    if result.get("conflicts") and self.state["verbose"]:
+                        self.logger.msg(
+                            f"{namespace}: {result['kind'].lower()}/{result['name']} took over fields: {result['conflicts']}", bold=False
+                        )
+                if not success:
+                    raise next(result["error"] for result in results if result["error"] is not None)
+
+            try:
+                if namespace not in existing:
+                    success, response = self.k8s_helper.create_namespace(namespace=namespace, client=core_client)
+                    if not success and response.status != 409:
+                        raise response
+                    row["created"] = success
+                apply(templates["developer"].replace("{$$namespace}", namespace))
+                if spec.get("test_pipeline") is not None:
+                    pipeline = spec["test_pipeline"]
+                    apply(templates["test_pipeline"].replace("{$$testTaskImage}", pipeline["image"]).replace("{$$testTaskCmd}", pipeline["cmd"]))
+                    row["extras"].append("test pipeline")
+                if spec.get("scan_policy") is not None:
+                    severities = json.dumps(spec["scan_policy"]["not_allowed_severities"])
+                    apply(templates["scan_policy"].replace("{$$notAllowedSeverities}", f" notAllowedSeverities := {severities}"))
+                    row["extras"].append("scan policy")
+                    if grype_version:
+                        values_file = f"/tmp/{hashlib.md5(f'grype-{namespace}-{time.time()}'.encode()).hexdigest()}"
+                        open(values_file, "w").write(f"namespace: {namespace}\ntargetImagePullSecret: registry-credentials")
+                        proc, _, err = self.sh.run_proc(
+                            f"tanzu package install grype-scanner-{namespace} --package-name grype.scanning.apps.tanzu.vmware.com "
+                            f"--version {grype_version} --namespace {install_ns} --values-file {values_file}",
+                            env=self.state.get("kube_env"),
+                        )
+                        if proc.returncode != 0:
+                            raise RuntimeError(f"Unable to install grype scanner: {err.decode() if err else proc.returncode}")
+                        row["extras"].append("grype")
+            except Exception as err:
+                row["error"] = err
+            row["seconds"] = time.time() - start
+            return row
+
+        self.logger.msg(f":sunglasses: Setting up {len(specs)} developer namespaces with {parallelism} workers")
+        start, rows = time.time(), list()
+        with ThreadPoolExecutor(max_workers=max(parallelism, 1)) as executor:
+            futures = [executor.submit(provision, spec) for spec in specs]
+            with self.console.status(f"Provisioning 0/{len(specs)}") if self.ui_helper.live else nullcontext() as status:
+                for future in as_completed(futures):
+                    rows.append(future.result())
+                    status.update(f"Provisioning {len(rows)}/{len(specs)}") if status else None
+        elapsed = time.time() - start
+
+        table = Table(title="Developer namespaces")
+        table.add_column("Namespace")
+        table.add_column("Namespace created")
+        table.add_column("Objects")
+        table.add_column("Extras")
+        table.add_column("Result")
+        table.add_column("Time", justify="right")
+        failed = 0
+        for row in sorted(rows, key=lambda r: r["namespace"]):
+            failed += 1 if row["error"] is not None else 0
+            result = "[bold][green]Ready[/green][/bold]" if row["error"] is None else "[bold][red]Failed[/red][/bold]"
+            if row["error"] is not None and self.state["verbose"]:
+                result = f"{result} {row['error']}"
+            table.add_row(
+                row["namespace"],
+                "yes" if row["created"] else "no",
+                ", ".join(f"{count} {action}" for action, count in sorted(row["actions"].items())),
+                ", ".join(row["extras"]),
+                result,
+                f"{row['seconds']:.1f}s",
+            )
+        self.console.print(table)
+        self.logger.msg(f":stopwatch: {len(specs)} namespaces in {elapsed:.1f}s ({len(specs) / elapsed if elapsed > 0 else 0:.1f} namespaces/s)")
+        if failed:
+            self.logger.msg(
+                f":broken_heart: Unable to setup {failed} of {len(specs)} namespaces. Use [bold]--verbose[/bold] flag for error details."
+            )
+            raise typer.Exit(-1)
+        self.logger.msg(":rocket: Developer namespaces ready")
+
     def ingress_ip(self, service: str, namespace: str):
         k8s_context = commons.check_and_pick_k8s_context(
             k8s_context=None, k8s_helper=self.k8s_helper, logger=self.logger, ui_helper=self.ui_helper, state=self.state
@@ -499,129 +865,148 @@ class TanzuApplicationPlatform:
             self.logger.msg(":broken_heart: No external Ingress IP found")
             self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
 
-    def edit_tap_values(self, namespace: str, from_file: str, force: bool, show_current: bool):
+    def edit_tap_values(
+        self, namespace: str, from_file: str, force: bool, show_current: bool, mask_secrets: bool = True, diff_output: str = "text"
+    ):
         k8s_context = commons.check_and_pick_k8s_context(
             k8s_context=None, k8s_helper=self.k8s_helper, logger=self.logger, ui_helper=self.ui_helper, state=self.state
         )
 
-        success, response = commons.get_custom_object_data(
-            k8s_helper=self.k8s_helper,
-            namespace=namespace,
-            name="tap",
-            group="packaging.carvel.dev",
-            version="v1alpha1",
-            plural="packageinstalls",
-            client=self.k8s_helper.custom_clients[k8s_context],
-            logger=self.logger,
-            state=self.state,
-        )
-
-        # hack TODO: switch this to use a decent jsonpath lib
-        # tap_version_installed = response["spec"]["packageRef"]["versionSelection"]["constraints"]
-        tap_values_secret_name = response["spec"]["values"][0]["secretRef"]["name"]
-
-        success, response = self.k8s_helper.get_namespaced_secret(
-            secret=tap_values_secret_name, namespace=namespace, client=self.k8s_helper.core_clients[k8s_context]
-        )
+        tap_values = TapValues(
+            k8s_helper=self.k8s_helper, k8s_context=k8s_context, namespace=namespace, logger=self.logger, state=self.state
+        ).load()
+        og_cluster_tap_values = tap_values.original
 
-        if success:
-            new_cluster_tap_values = str()
+        if from_file:
+            # Get the yaml data from the file
+            if not os.path.isfile(from_file):
+                self.logger.msg(f":cry: {from_file} not found")
+                raise typer.Exit(1)
             try:
-                og_cluster_tap_values = yaml.safe_load(base64.b64decode(list(response.data.values())[0]).decode())
+                yaml_updates = yaml.safe_load(open(from_file, "r").read())
             except Exception:
-                self.logger.msg(f":cry: {tap_values_secret_name} secret was not proper yaml")
+                self.logger.msg(":cry: provided file was not valid yaml")
                 raise typer.Exit(1)
-
-            if from_file:
-                # Get the yaml data from the file
-                if os.path.isfile(from_file):
-                    try:
-                        yaml_updates = yaml.safe_load(open(from_file, "r").read())
-                    except Exception:
-                        self.logger.msg(":cry: provided file was not valid yaml")
-                        raise typer.Exit(1)
-                    new_cluster_tap_values = {**og_cluster_tap_values, **yaml_updates}
+            new_cluster_tap_values = {**og_cluster_tap_values, **yaml_updates}
+        else:
+            if show_current:
+                default = yaml.safe_dump(og_cluster_tap_values)
             else:
-                if show_current:
-                    default = yaml.safe_dump(og_cluster_tap_values)
-                else:
-                    default = ""
-                data = self.ui_helper.yaml_prompt(
-                    message="Update TAP Values YAML File",
-                    auto_complete_list=auto_complete_list,
-                    default=default,
-                )
-                try:
-                    yaml_updates = yaml.safe_load(data)
-                except Exception:
-                    self.logger.msg(":cry: inline updates were not in valid yaml format. Try again!")
-                    raise typer.Exit(1)
-                if show_current:
-                    new_cluster_tap_values = yaml_updates
-                else:
-                    if yaml_updates:
-                        new_cluster_tap_values = {**og_cluster_tap_values, **yaml_updates}
-                    else:
-                        new_cluster_tap_values = og_cluster_tap_values
-
-            self.logger.msg(":notebook: Input recorded. Calculating diff with current file")
-            commons.print_smart_diff(og_cluster_tap_values, new_cluster_tap_values)
-
-            if not force:
-                save_it = self.logger.confirm(":question_mark: Do you want to make this edit?")
-                if not save_it:
-                    self.logger.msg(":sweat_smile: Not making any updates. Maybe some other time.")
-                    raise typer.Exit(0)
-
-            # hack: TODO: if the data object structure changes, it will have to be adjusted here. currently I assume there is only 1 key
-            data_key = list(response.data.keys())[0]
-            body = {"data": {data_key: base64.b64encode(yaml.safe_dump(new_cluster_tap_values).encode()).decode()}}
-            success, response = self.k8s_helper.patch_namespaced_secret(
-                client=self.k8s_helper.core_clients[k8s_context], secret=tap_values_secret_name, namespace=namespace, body=body
+                default = ""
+            data = self.ui_helper.yaml_prompt(
+                message="Update TAP Values YAML File",
+                auto_complete_list=auto_complete_list,
+                default=default,
             )
-            if not success:
-                self.logger.msg(":broken_heart: Unable to edit the configuration secret on TAP cluster. Try again later.")
-                self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
-                raise typer.Exit(-1)
+            try:
+                yaml_updates = yaml.safe_load(data)
+            except Exception:
+                self.logger.msg(":cry: inline updates were not in valid yaml format. Try again!")
+                raise typer.Exit(1)
+            if show_current:
+                new_cluster_tap_values = yaml_updates
+            else:
+                if yaml_updates:
+                    new_cluster_tap_values = {**og_cluster_tap_values, **yaml_updates}
+                else:
+                    new_cluster_tap_values = og_cluster_tap_values
+        tap_values.values = new_cluster_tap_values
 
-        else:
-            self.logger.msg(f":broken_heart: {tap_values_secret_name} secret not found in the k8s cluster. is TAP installed properly?")
+        self.logger.msg(":notebook: Input recorded. Calculating diff with current file")
+        commons.print_smart_diff(og_cluster_tap_values, new_cluster_tap_values, mask_secrets=mask_secrets, output=diff_output)
+
+        if not force:
+            save_it = self.logger.confirm(":question_mark: Do you want to make this edit?")
+            if not save_it:
+                self.logger.msg(":sweat_smile: Not making any updates. Maybe some other time.")
+                raise typer.Exit(0)
+
+        success, response = tap_values.save()
+        if not success:
+            self.logger.msg(":broken_heart: Unable to edit the configuration secret on TAP cluster. Try again later.")
             self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
+            raise typer.Exit(-1)
 
-    def upgrade(self, version: str, wait: bool, namespace: str = "tap-install"):
-        commons.check_and_pick_k8s_context(
+    def upgrade(self, version: str, wait: bool, namespace: str = "tap-install", wait_timeout: int = 30, tanzu_cli: bool = False):
+        k8s_context = commons.check_and_pick_k8s_context(
             k8s_context=None, k8s_helper=self.k8s_helper, logger=self.logger, ui_helper=self.ui_helper, state=self.state
         )
+        if tanzu_cli:
+            self.upgrade_with_tanzu_cli(version=version, namespace=namespace)
+        else:
+            self.upgrade_package_install(k8s_context=k8s_context, version=version, namespace=namespace, timeout_seconds=wait_timeout * 60)
+        if wait:
+            self.monitor_reconcile(k8s_context=k8s_context, namespace=namespace, timeout_minutes=wait_timeout)
+            self.logger.msg(":rocket: TAP is upgraded")
+        else:
+            self.logger.msg(":rocket: TAP upgrade started on the cluster")
+
+    def upgrade_package_install(self, k8s_context, version, namespace, timeout_seconds: int):
+        client = self.k8s_helper.custom_clients[k8s_context]
+        success, response = self.k8s_helper.get_namespaced_custom_objects(
+            name="tap", group=GROUP, version=VERSION, namespace=namespace, plural=PLURAL, client=client
+        )
+        if not success:
+            self.logger.msg(f"{response}") if self.state["verbose"] else None
+            self.logger.msg(":broken_heart: TAP package not found. Nothing to upgrade. Please check if TAP is installed")
+            raise typer.Exit(1)
+
+        install_registry_server = self.creds_helper.get("install_registry_server", "INSTALL_REGISTRY_SERVER")
+        self.logger.msg(f":key: Setting up [yellow]{TAP_REPOSITORY}[/yellow] package repo", bold=False)
+        with self.console.status("Setting up") if self.ui_helper.live else nullcontext():
+            success = self.apply_package_repository(
+                k8s_context=k8s_context,
+                namespace=namespace,
+                url=self.package_repository_url(install_registry_server, version),
+                timeout_seconds=timeout_seconds,
+            )
+        if not success:
+            self.logger.msg(":broken_heart: Unable to update the package repository. Use [bold]--verbose[/bold] flag for error details.")
+            raise typer.Exit(-1)
+
+        # Only the version constraint changes, the service account and values stay whatever installed TAP
+        self.logger.msg(f":wine_glass: Updating [yellow]TAP[/yellow] to version [yellow]{version}[/yellow]", bold=False)
+        patch = {
+            "apiVersion": f"{GROUP}/{VERSION}",
+            "kind": "PackageInstall",
+            "metadata": {"name": "tap"},
+            "spec": {"packageRef": {"versionSelection": {"constraints": version}}},
+        }
+        success, response = self.k8s_helper.patch_namespaced_custom_objects(
+            yml=f"# $${GROUP},{VERSION},{PLURAL}$$\n{yaml.safe_dump(patch)}", namespace=namespace, client=client
+        )
+        if not success:
+            self.logger.msg(f"{response}") if self.state["verbose"] else None
+            self.logger.msg(":broken_heart: Unable to update TAP. Use [bold]--verbose[/bold] flag for error details.")
+            raise typer.Exit(-1)
+
+    def upgrade_with_tanzu_cli(self, version, namespace):
         cmd = f"tanzu package installed list --namespace {namespace}"
-        _, out, _ = self.sh.run_proc(cmd=cmd)
+        _, out, _ = self.sh.run_proc(cmd=cmd, env=self.state.get("kube_env"))
         if "tap.tanzu.vmware.com" not in out.decode():
             self.logger.msg(":broken_heart: TAP package not found. Nothing to upgrade. Please check if TAP is installed")
             raise typer.Exit(1)
 
         install_registry_server = self.creds_helper.get("install_registry_server", "INSTALL_REGISTRY_SERVER")
 
-        pkg_repo_url = f"{install_registry_server}/tanzu-application-platform/tap-packages:{version}"
-        if "packages.broadcom.com" in install_registry_server:
-            pkg_repo_url = f"{install_registry_server}/{version}/tanzu-application-platform/tap-packages:{version}"
+        pkg_repo_url = self.package_repository_url(install_registry_server, version)
         self.sh_call(
             cmd=f"tanzu package repository update tanzu-tap-repository --url {pkg_repo_url} --namespace {namespace}",
             msg=":key: Setting up [yellow]tanzu-tap-repository[/yellow] package repo",
             spinner_msg="Setting up",
             error_msg=None,
         )
-        _, out, _ = self.sh.run_proc(cmd=f"tanzu package repository get tanzu-tap-repository --namespace {namespace}")
+        _, out, _ = self.sh.run_proc(
+            cmd=f"tanzu package repository get tanzu-tap-repository --namespace {namespace}", env=self.state.get("kube_env")
+        )
         self.logger.msg(out.decode(), bold=False) if self.state["verbose"] and out else None
 
         self.sh_call(
-            cmd=f"tanzu package installed update tap -p tap.tanzu.vmware.com -v {version} -n {namespace} --wait={'false' if not wait else 'true'}",
+            cmd=f"tanzu package installed update tap -p tap.tanzu.vmware.com -v {version} -n {namespace} --wait=false",
             msg=f":wine_glass: Updating [yellow]TAP[/yellow] to version [yellow]{version}[/yellow]",
-            spinner_msg="Updating. Waiting to reconcile",
+            spinner_msg="Updating",
             error_msg=None,
         )
-        if wait:
-            self.logger.msg(":rocket: TAP is upgraded")
-        else:
-            self.logger.msg(":rocket: TAP upgrade started on the cluster")
 
     def uninstall(self, package: str, namespace: str = "tap-install"):
         commons.check_and_pick_k8s_context(
@@ -635,10 +1020,13 @@ class TanzuApplicationPlatform:
         )
         self.logger.msg(":rocket: TAP is uninstalled")
 
-    def status(self, namespace: str = "tap-install"):
+    def status(self, namespace: str = "tap-install", watch: bool = False):
         k8s_context = commons.check_and_pick_k8s_context(
             k8s_context=None, k8s_helper=self.k8s_helper, logger=self.logger, ui_helper=self.ui_helper, state=self.state
         )
+        if watch:
+            self.watch_status(k8s_context=k8s_context, namespace=namespace)
+            return
         success, response = self.k8s_helper.list_namespaced_custom_objects(
             group="packaging.carvel.dev",
             version="v1alpha1",
@@ -671,10 +1059,246 @@ class TanzuApplicationPlatform:
                 if "usefulErrorMessage" in err[3]:
                     rprint(f"[bold][red]Error:[/red][/bold] {err[3]['usefulErrorMessage']}")
 
+    def multi_cluster_status(self, contexts: list, namespace: str = "tap-install", timeout: int = 10):
+        """
+        print the TAP packages of every context. Each cluster gets timeout seconds in total, building its client (and running
+        exec credential plugins) and the retries included, after which it is reported as timed out.
+        """
+        results, started = dict(), dict()
+        lock, slots = threading.Lock(), threading.BoundedSemaphore(32)
+
+        def fetch(ctx):
+            with slots:
+                with lock:
+                    started[ctx] = time.monotonic()
+                try:
+                    result = self.k8s_helper.list_namespaced_custom_objects(
+                        group=GROUP,
+                        version=VERSION,
+                        namespace=namespace,
+                        plural=PLURAL,
+                        client=self.k8s_helper.custom_clients[ctx],
+                        request_timeout=timeout,
+                    )
+                except Exception as err:
+                    # Timeouts and connection errors from urllib3 are not ApiExceptions
+                    result = (False, err)
+                with lock:
+                    results.setdefault(ctx, result)
+
+        with self.console.status(f":hourglass: Getting TAP packages from {len(contexts)} clusters"):
+            # Daemon threads instead of an executor, whose workers are joined at exit, so a hung cluster cannot hold the command
+            for ctx in contexts:
+                threading.Thread(target=fetch, args=(ctx,), daemon=True).start()
+            while True:
+                with lock:
+                    now = time.monotonic()
+                    for ctx in contexts:
+                        if ctx not in results and ctx in started and now - started[ctx] > timeout:
+                            results[ctx] = (False, TimeoutError(f"No answer within {timeout}s"))
+                    if len(results) == len(contexts):
+                        break
+                time.sleep(0.1)
+
+        table = Table(title=f"TAP Packages in {namespace}")
+        table.add_column("Cluster")
+        table.add_column("Package")
+        table.add_column("Version", style="cyan")
+        table.add_column("State")
+        errs = list()
+        for ctx in contexts:
+            success, response = results[ctx]
+            if not success:
+                state = "Timed out" if isinstance(response, TimeoutError) else "Unreachable"
+                table.add_row(ctx, "-", "-", f"[bold][red]{state}[/red][/bold]")
+                errs.append([ctx, "-", state, str(response) if self.state["verbose"] else ""])
+                continue
+            for row in sorted((package_state(item) for item in response["items"]), key=lambda r: r["name"]):
+                style = CONDITION_STYLE.get(row["condition"], "white")
+                table.add_row(ctx, row["name"], row["version"], f"[bold][{style}]{row['condition']}[/{style}][/bold]")
+                if row["error"]:
+                    errs.append([ctx, row["name"], row["condition"], row["error"]])
+            table.add_section()
+        self.console.print(table)
+
+        if len(errs) > 0:
+            self.console.rule("Errors")
+        for err in errs:
+            rprint(f":worried: {err[0]} {err[1]} [bold][red]{err[2]}[/red][/bold]")
+            if err[3]:
+                rprint(f"[bold][red]Error:[/red][/bold] {err[3]}")
+
+    def for_cluster(self, k8s_context, logger):
+        """
+        return a copy of this helper pinned to k8s_context that logs everything to logger and never draws on the terminal
+        """
+        state = dict(self.state, context=k8s_context, verbose=True)
+        return TanzuApplicationPlatform(
+            subprocess_helper=self.sh,
+            logger=logger,
+            creds_helper=self.creds_helper,
+            state=state,
+            ui_helper=UI(subprocess_helper=self.sh, logger=logger, live=False),
+            k8s_helper=self.k8s_helper,
+            console=logger.console,
+            jobs_helper=self.jobs_helper,
+        )
+
+    def multi_cluster_run(self, contexts: list, operation: str, run, parallelism: int = 4, canary: list = None):
+        """
+        call run(tap_helper, k8s_context) for every context, up to parallelism clusters at a time, each with a helper from for_cluster
+        that logs to its own file. Canary contexts run first and the remaining clusters only start when all of them succeeded.
+        return success: bool
+        """
+        log_dir = f'{os.environ.get("HOME")}/.config/tappr/logs/{time.strftime("%Y%m%d-%H%M%S")}-{operation}'
+        os.makedirs(log_dir, exist_ok=True)
+        canary = [ctx for ctx in contexts if ctx in (canary or list())]
+        waves = [wave for wave in (canary, [ctx for ctx in contexts if ctx not in canary]) if wave]
+        rows = dict()
+        for ctx in contexts:
+            rows[ctx] = {
+                "wave": "canary" if ctx in canary else "rollout",
+                "state": "queued",
+                "started": None,
+                "finished": None,
+                "logger": FileLogger(f"{log_dir}/{re.sub(r'[^A-Za-z0-9_.-]', '_', ctx)}.log"),
+            }
+        self.logger.msg(f":file_folder: Cluster logs are at [yellow]{log_dir}[/yellow]", bold=False)
+
+        def run_cluster(ctx):
+            row = rows[ctx]
+            row["state"], row["started"] = "running", time.time()
+            self.logger.msg(f":hourglass: {ctx} {operation} started", bold=False) if not self.ui_helper.live else None
+            try:
+                run(self.for_cluster(ctx, row["logger"]), ctx)
+                row["state"] = "succeeded"
+            except Exception as err:
+                # typer.Exit is raised after the reason was logged, anything else is unexpected and goes to the log as well
+                row["logger"].msg(f"{type(err).__name__}: {err}") if not isinstance(err, typer.Exit) else None
+                row["state"] = "failed"
+            row["finished"] = time.time()
+            row["logger"].close()
+            self.logger.msg(f":package: {ctx} {operation} {row['state']}", bold=False) if not self.ui_helper.live else None
+
+        title = f"TAP {operation} on {len(contexts)} clusters"
+        with (
+            Live(get_renderable=lambda: self.cluster_table(rows, title), console=self.console, refresh_per_second=2, transient=True)
+            if (self.ui_helper.live)
+            else nullcontext()
+        ):
+            with ThreadPoolExecutor(max_workers=max(parallelism, 1)) as executor:
+                for wave in waves:
+                    if any(row["state"] == "failed" for row in rows.values()):
+                        break
+                    list(executor.map(run_cluster, wave))
+        for row in rows.values():
+            if row["state"] == "queued":
+                row["state"] = "skipped"
+        self.console.print(self.cluster_table(rows, title, logs=True))
+        return all(row["state"] == "succeeded" for row in rows.values())
+
+    @staticmethod
+    def cluster_table(rows: dict, title, logs: bool = False):
+        table = Table(title=title)
+        table.add_column("Cluster")
+        table.add_column("Wave")
+        table.add_column("State")
+        table.add_column("Time", justify="right")
+        table.add_column("Last message", no_wrap=True, overflow="ellipsis", max_width=60)
+        table.add_column("Log file", overflow="fold") if logs else None
+        for ctx, row in rows.items():
+            style = CLUSTER_STATE_STYLE[row["state"]]
+            elapsed = (row["finished"] or time.time()) - row["started"] if row["started"] else None
+            cells = [
+                ctx,
+                row["wave"],
+                f"[bold][{style}]{row['state']}[/{style}][/bold]",
+                f"{elapsed:.0f}s" if elapsed is not None else "-",
+                Text(row["logger"].last),
+            ]
+            table.add_row(*cells, row["logger"].path) if logs else table.add_row(*cells)
+        return table
+
+    def monitor_reconcile(self, k8s_context, namespace, timeout_minutes: int = 30):
+        monitor = ReconcileMonitor(
+            tracker=PackageInstallTracker(k8s_helper=self.k8s_helper, k8s_context=k8s_context, namespace=namespace),
+            timeout_seconds=timeout_minutes * 60,
+        )
+        self.logger.msg(":hourglass: Waiting for TAP packages to reconcile", bold=False)
+        try:
+            if self.ui_helper.live:
+                with Live(get_renderable=lambda: monitor.table(title=f"TAP Packages in {namespace}"), console=self.console, refresh_per_second=1):
+                    success, reason = monitor.run()
+            else:
+                success, reason = monitor.run(
+                    on_change=lambda: self.logger.msg(
+                        ", ".join(f"{name}: {row['condition']}" for name, row in sorted(monitor.tracker.rows.items())), bold=False
+                    )
+                )
+        except ApiException as err:
+            self.logger.msg(":broken_heart: Lost the watch on TAP packages. Use [bold]--verbose[/bold] flag for error details.")
+            self.logger.msg(f"\n{err}", bold=False) if self.state["verbose"] else None
+            raise typer.Exit(-1)
+
+        self.console.print(monitor.timing_table())
+        if not success:
+            for row in monitor.failed:
+                self.logger.msg(f":worried: {row['name']} [cyan]{row['version']}[/cyan] [bold][red]{row['condition']}[/red][/bold]", bold=False)
+                self.logger.msg(f"[bold][red]Error:[/red][/bold] {row['error']}", bold=False) if row["error"] else None
+            if reason == "timeout":
+                self.logger.msg(f":broken_heart: TAP packages did not reconcile within {timeout_minutes} minutes")
+            raise typer.Exit(-1)
+
+    def watch_status(self, k8s_context, namespace):
+        tracker = PackageInstallTracker(k8s_helper=self.k8s_helper, k8s_context=k8s_context, namespace=namespace)
+        errors = dict()
+        try:
+            with Live(console=self.console, auto_refresh=False) as live:
+                # One list followed by a single watch stream, the table is only redrawn when a package row actually changed
+                for changed in tracker.follow():
+                    if not changed:
+                        continue
+                    for name in changed:
+                        row = tracker.rows.get(name)
+                        if row and row["error"]:
+                            errors[name] = row["error"]
+                        else:
+                            errors.pop(name, None)
+                    live.update(state_table(tracker.rows, title=f"TAP Packages in {namespace} (Ctrl+C to stop watching)"), refresh=True)
+        except KeyboardInterrupt:
+            pass
+        except ApiException as err:
+            self.logger.msg(":broken_heart: Lost the watch on TAP packages. Use [bold]--verbose[/bold] flag for error details.")
+            self.logger.msg(f"\n{err}", bold=False) if self.state["verbose"] else None
+            raise typer.Exit(-1)
+        if len(errors) > 0:
+            self.console.rule("Errors")
+        for name, error in errors.items():
+            rprint(f":worried: {name} [bold][red]{tracker.rows[name]['condition']}[/red][/bold]")
+            rprint(f"[bold][red]Error:[/red][/bold] {error}")
+
     def relocate(
-        self, version, tanzunet_username, tanzunet_password, registry_server, registry_username, registry_password, pkg_relocation_repo, wait
+        self,
+        versions: list,
+        tanzunet_username,
+        tanzunet_password,
+        registry_server,
+        registry_username,
+        registry_password,
+        pkg_relocation_repo,
+        wait,
+        parallelism: int = 2,
+        retries: int = 2,
+        resume: bool = True,
+        refresh: bool = False,
+        since: str = None,
+        latest_patch: bool = False,
     ):
         self.creds_helper.get("install_registry_server", "IMGPKG_REGISTRY_HOSTNAME_0")
+        tanzunet_username = tanzunet_username or os.environ.get(RELOCATE_CREDENTIALS_ENV["tanzunet_username"])
+        tanzunet_password = tanzunet_password or os.environ.get(RELOCATE_CREDENTIALS_ENV["tanzunet_password"])
+        registry_username = registry_username or os.environ.get(RELOCATE_CREDENTIALS_ENV["registry_username"])
+        registry_password = registry_password or os.environ.get(RELOCATE_CREDENTIALS_ENV["registry_password"])
         if not tanzunet_username:
             tanzunet_username = self.creds_helper.get("tanzunet_username", "IMGPKG_REGISTRY_USERNAME_0")
         if not tanzunet_password:
@@ -691,6 +1315,18 @@ class TanzuApplicationPlatform:
         if os.path.isfile(registry_password):
             registry_password = open(registry_password, "r").read()
             os.environ["IMGPKG_REGISTRY_PASSWORD_1"] = registry_password
+        # imgpkg reads the Tanzu Network credentials from the environment, so the versions can be listed before any docker login
+        os.environ["IMGPKG_REGISTRY_USERNAME_0"], os.environ["IMGPKG_REGISTRY_PASSWORD_0"] = tanzunet_username, tanzunet_password
+
+        if not versions:
+            versions_list = self.tap_versions(refresh=refresh, since=since, latest_patch=latest_patch)
+            # Newest first
+            versions = Picker(
+                versions_list[::-1],
+                "Select TAP package versions to relocate (SPACE to select, ENTER to confirm):",
+                multiselect=True,
+                min_selection_count=1,
+            ).start()
 
         return_code = self.sh_call(
             cmd=f"echo '{tanzunet_password}' | docker login registry.tanzu.vmware.com --username '{tanzunet_username}' --password-stdin",
@@ -712,44 +1348,110 @@ class TanzuApplicationPlatform:
             self.logger.msg(":broken_heart: Unable to login to your user registry. Use [bold]--verbose[/bold] flag for error details.")
             raise typer.Exit(-1)
 
-        if not version:
-            return_code = self.sh_call(
-                cmd=f"imgpkg tag list -i registry.tanzu.vmware.com/tanzu-application-platform/tap-packages | grep -v sha | sort -V > /tmp/taps",
-                msg=f":magnifying_glass_tilted_left: Looking for all available TAP versions to relocate",
-                spinner_msg="Searching",
-                error_msg=None,
-            )
-            if return_code != 0:
-                self.logger.msg(":broken_heart: Unable to list all available TAP version. Use [bold]--verbose[/bold] flag for error details.")
-                raise typer.Exit(-1)
-
-            versions_list = open("/tmp/taps", "r").read().split("\t\n")
-            version, _ = Picker(versions_list, "Select TAP package version to relocate:").start()
-            print(version)
-
+        to_repo = f"{registry_server}/{pkg_relocation_repo}"
         if wait:
-            return_code = self.sh_call(
-                cmd=f"imgpkg copy -b registry.tanzu.vmware.com/tanzu-application-platform/tap-packages:{version} --to-repo {registry_server}/{pkg_relocation_repo}",
-                msg=f":package: Relocating TAP package version [yellow]{version}[/yellow] from Tanzu Network to [yellow]{registry_server}/{pkg_relocation_repo}[/yellow]",
-                spinner_msg="Relocating",
-                error_msg=None,
-            )
-            if return_code != 0:
-                self.logger.msg(":broken_heart: Unable to relocate TAP packages. Use [bold]--verbose[/bold] flag for error details.")
+            if not self.relocate_versions(versions=versions, to_repo=to_repo, parallelism=parallelism, retries=retries, resume=resume):
+                self.logger.msg(":broken_heart: Unable to relocate all TAP versions. See the log files above for the imgpkg output.")
                 raise typer.Exit(-1)
         else:
-            subprocess.Popen(
-                [
-                    "imgpkg",
-                    "copy",
-                    "-b",
-                    f"registry.tanzu.vmware.com/tanzu-application-platform/tap-packages:{version}",
-                    "--to-repo",
-                    f"{registry_server}/{pkg_relocation_repo}",
-                ],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.STDOUT,
-            )
+            # The same relocation in a background job, credentials go through the environment so that they are not part of the job command
+            credentials = {
+                "tanzunet_username": tanzunet_username,
+                "tanzunet_password": tanzunet_password,
+                "registry_username": registry_username,
+                "registry_password": registry_password,
+            }
+            env = dict(os.environ, **{RELOCATE_CREDENTIALS_ENV[key]: value for key, value in credentials.items()})
+            cmd = [sys.executable, "-m", "tappr.main", "tap", "relocate", "--versions", ",".join(versions), "--registry-server", registry_server]
+            cmd += ["--pkg-relocation-repo", pkg_relocation_repo, "--parallelism", str(parallelism), "--retries", str(retries)]
+            cmd += ["--resume" if resume else "--no-resume"]
+            job = self.jobs_helper.start(name="relocate", cmd=cmd, env=env)
             self.logger.msg(
-                ":package: Started relocation in the background. Use macOS or Linux [yellow][bold]ps | grep 'imgpkg copy'[/bold][/yellow] command to see the running jobs"
+                f":package: Started relocation in the background as job [yellow]{job['id']}[/yellow]. "
+                f"Use [yellow][bold]tappr jobs logs {job['id']} --follow[/bold][/yellow] to follow it"
             )
+
+    def list_repository_tags(self, repository):
+        proc, out, _ = self.ui_helper.progress(
+            cmd=f"imgpkg tag list -i {repository}",
+            message=":magnifying_glass_tilted_left: Looking for all available TAP versions",
+            state=self.state,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"imgpkg tag list exited with {proc.returncode}")
+        return parse_tag_list(out.decode())
+
+    def tap_versions(self, refresh: bool = False, since: str = None, latest_patch: bool = False, repository=TAP_PACKAGES_REPOSITORY):
+        """
+        return the TAP versions published to repository, oldest first, from the version catalog cache unless it is stale or refresh is set
+        """
+        try:
+            versions, entry = VersionCatalog().versions(repository, list_tags=lambda: self.list_repository_tags(repository), refresh=refresh)
+        except Exception as err:
+            self.logger.msg(f"{err}") if self.state["verbose"] else None
+            self.logger.msg(":broken_heart: Unable to list all available TAP version. Use [bold]--verbose[/bold] flag for error details.")
+            raise typer.Exit(-1)
+        age = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["fetched"]))
+        if entry.get("stale"):
+            self.logger.msg(f":warning: Unable to refresh the TAP versions, using the versions listed at {age}", bold=False)
+        elif self.state["verbose"]:
+            self.logger.msg(f":card_index_dividers: TAP versions listed at {age}, use [bold]--refresh[/bold] to list them again", bold=False)
+        try:
+            versions = filter_versions(versions, since=since, latest_patch=latest_patch)
+        except ValueError as err:
+            self.logger.msg(f":worried: {err}", bold=False)
+            raise typer.Exit(-1)
+        if not versions:
+            self.logger.msg(":person_shrugging: No TAP versions match. Use [bold]--refresh[/bold] to list the versions from the registry again.")
+            raise typer.Exit(-1)
+        return versions
+
+    def relocate_versions(self, versions: list, to_repo, parallelism: int = 2, retries: int = 2, resume: bool = True):
+        """
+        imgpkg copy every version to to_repo, up to parallelism at a time, each logging to its own file and retried up to retries times.
+        Job states are kept in a state file per repository: with resume, versions relocated by an earlier run are skipped
+        and copies that were interrupted continue with the layers already in the repository.
+        return success: bool
+        """
+        state = RelocationState(to_repo).load()
+        if not resume:
+            state.jobs = dict()
+        log_dir = f'{os.environ.get("HOME")}/.config/tappr/logs/{time.strftime("%Y%m%d-%H%M%S")}-relocate'
+        os.makedirs(log_dir, exist_ok=True)
+        rows = dict()
+        for version in versions:
+            relocated = state.relocated(version)
+            rows[version] = {
+                "state": "relocated" if relocated else "queued",
+                "attempt": None,
+                "started": None,
+                "finished": None,
+                "log": state.jobs[version].get("log") if relocated else f"{log_dir}/{re.sub(r'[^A-Za-z0-9_.-]', '_', version)}.log",
+            }
+        pending = [version for version in versions if rows[version]["state"] == "queued"]
+        if len(pending) < len(versions):
+            self.logger.msg(f":fast-forward_button: {len(versions) - len(pending)} versions were relocated to {to_repo} already", bold=False)
+        self.logger.msg(f":file_folder: Relocation logs are at [yellow]{log_dir}[/yellow]", bold=False)
+
+        def run_job(version):
+            row = rows[version]
+            row["started"] = time.time()
+            try:
+                run_copy(version=version, to_repo=to_repo, log_path=row["log"], state=state, row=row, retries=retries)
+            except Exception as err:
+                # imgpkg missing from the PATH and the like, each attempt would fail the same way
+                row["state"] = "failed"
+                state.update(version, state="failed", error=f"{err}", finished=time.time())
+            row["finished"] = time.time()
+            self.logger.msg(f":package: {version} {row['state']}", bold=False) if not self.ui_helper.live else None
+
+        title = f"Relocating {len(versions)} TAP versions to {to_repo}"
+        with (
+            Live(get_renderable=lambda: relocation_table(rows, title), console=self.console, refresh_per_second=2, transient=True)
+            if self.ui_helper.live
+            else nullcontext()
+        ):
+            with ThreadPoolExecutor(max_workers=max(parallelism, 1)) as executor:
+                list(executor.map(run_job, pending))
+        self.console.print(relocation_table(rows, title, logs=True))
+        return all(row["state"] in ("succeeded", "relocated") for row in rows.values())
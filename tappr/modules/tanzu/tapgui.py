@@ -1,9 +1,14 @@
 import os
 import base64
+import hashlib
+import json
 import typer
 import yaml
 import tappr.modules.utils.k8s
 
+from concurrent.futures import ThreadPoolExecutor
+
+from tappr.modules.tanzu.tapvalues import TapValues
 from tappr.modules.utils.commons import Commons
 from tappr.modules.utils.ui import Picker
 from rich.console import Console
@@ -11,6 +16,12 @@ from rich.table import Table
 
 commons = Commons()
 
+# Tokens minted with the TokenRequest API for TAP GUI, the API server may cap it with --service-account-max-token-expiration
+TOKEN_EXPIRATION_SECONDS = 365 * 24 * 60 * 60
+
+# Annotations of the TAP values secret recording where each tracked cluster was tracked from, read when rotating its token
+TRACKING_ANNOTATION_PREFIX = "tracking.tappr.io/"
+
 
 # noinspection PyBroadException
 class TanzuApplicationPlatformGUI:
@@ -45,6 +56,76 @@ class TanzuApplicationPlatformGUI:
             self.logger.msg(":broken_heart: No external TAP GUI server IP found")
             self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
 
+    def cluster_entry(self, k8s_context, namespace, name, service_account="tap-gui-viewer"):
+        """
+        return the TAP GUI cluster entry for namespace on k8s_context, authenticated with the token of service_account
+        raises ValueError with the reason when the token cannot be read
+        """
+        core_client = self.k8s_helper.core_clients[k8s_context]
+        success, source_sa = self.k8s_helper.get_namespaced_service_account(
+            client=core_client, service_account=service_account, namespace=namespace
+        )
+        if not success:
+            raise ValueError(f"Unable to get service account {service_account} from namespace {namespace}")
+        if source_sa.secrets:
+            source_secret_name = source_sa.secrets[0].name
+            success, secret = self.k8s_helper.get_namespaced_secret(client=core_client, secret=source_secret_name, namespace=namespace)
+            if not success:
+                raise ValueError(f"Unable to get secret {source_secret_name} from namespace {namespace}")
+            try:
+                cluster_token = base64.b64decode(secret.data.get("token")).decode()
+            except Exception as err:
+                raise ValueError(f"Unable to get token for the service account. Error: {err}")
+        else:
+            # Kubernetes 1.24+ no longer creates a token secret for every service account
+            cluster_token = self.mint_token(k8s_context=k8s_context, namespace=namespace, service_account=service_account)
+
+        cluster_url = self.k8s_helper.kubeconfig_index.get(k8s_context).get("server") or self.k8s_helper.api_client(k8s_context).configuration.host
+        return {
+            "authProvider": "serviceAccount",
+            "name": f"{name}-{namespace}",
+            "serviceAccountToken": f"{cluster_token}",
+            "skipTLSVerify": True,
+            "url": f"{cluster_url}",
+        }
+
+    def mint_token(self, k8s_context, namespace, service_account, expiration_seconds: int = TOKEN_EXPIRATION_SECONDS):
+        success, response = self.k8s_helper.create_service_account_token(
+            client=self.k8s_helper.core_clients[k8s_context],
+            service_account=service_account,
+            namespace=namespace,
+            expiration_seconds=expiration_seconds,
+        )
+        if not success:
+            raise ValueError(f"Unable to request a token for service account {service_account} in namespace {namespace}. Error: {response.reason}")
+        return response.status.token
+
+    def add_cluster_entries(self, values, entries):
+        """
+        add entries to the clusters TAP GUI tracks, replacing the tracked clusters with the same name
+        """
+        try:
+            _ = values["tap_gui"] and values["tap_gui"]["app_config"]
+        except KeyError:
+            self.logger.msg(f":cry: tap_gui or app_config not found in TAP values file")
+            raise typer.Exit(-1)
+
+        names = {entry["name"] for entry in entries}
+        try:
+            clusters = values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"]
+            clusters[:] = [cluster for cluster in clusters if cluster.get("name") not in names] + list(entries)
+        except Exception:
+            values["tap_gui"]["app_config"]["kubernetes"] = dict()
+            values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"] = [{"clusters": list(entries), "type": "config"}]
+
+    def save_tap_values(self, tap_values: TapValues):
+        commons.print_smart_diff(tap_values.original, tap_values.values)
+        success, response = tap_values.save()
+        if not success:
+            self.logger.msg(":broken_heart: Unable to edit the configuration secret on TAP cluster. Try again later.")
+            self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
+            raise typer.Exit(-1)
+
     def track_cluster(self, tap_install_namespace, tap_viewer_service_account="tap-gui-viewer"):
         mod_state = self.state
         mod_state["context"] = None
@@ -58,37 +139,15 @@ class TanzuApplicationPlatformGUI:
         )
         source_cluster_name = self.logger.question("What do want to call this cluster on TAP GUI", default=k8s_context)
         source_namespace = commons.pick_namespace(k8s_helper=self.k8s_helper, client=self.k8s_helper.core_clients[k8s_context])
-
-        success, source_sa = self.k8s_helper.get_namespaced_service_account(
-            client=self.k8s_helper.core_clients[k8s_context], service_account=tap_viewer_service_account, namespace=source_namespace
-        )
-        if not success:
-            self.logger.msg(f":cry: Unable to get service account {tap_viewer_service_account} from namespace {source_namespace}")
-            raise typer.Exit(-1)
-
+        source_k8s_context = k8s_context
         try:
-            source_secret_name = source_sa.secrets[0].name
-        except Exception as err:
-            self.logger.msg(f":cry: Unable to get secret name for the service account." + f"Error: {err}" if self.state["verbose"] else "")
-            raise typer.Exit(-1)
-
-        success, secret = self.k8s_helper.get_namespaced_secret(
-            client=self.k8s_helper.core_clients[k8s_context], secret=source_secret_name, namespace=source_namespace
-        )
-
-        if not success:
-            self.logger.msg(f":cry: Unable to get secret {source_secret_name} from namespace {source_namespace}")
-            raise typer.Exit(-1)
-
-        try:
-            cluster_token = base64.b64decode(secret.data.get("token")).decode()
-        except Exception as err:
-            self.logger.msg(f":cry: Unable to get token for the service account." + f"Error: {err}" if self.state["verbose"] else "")
+            entry = self.cluster_entry(
+                k8s_context=k8s_context, namespace=source_namespace, name=source_cluster_name, service_account=tap_viewer_service_account
+            )
+        except ValueError as err:
+            self.logger.msg(f":cry: {err}")
             raise typer.Exit(-1)
 
-        _, cluster_url, _ = self.sh.run_proc(cmd="kubectl config view --minify -o jsonpath='{.clusters[0].cluster.server}'")
-        cluster_url = cluster_url.decode()
-
         k8s_context = commons.check_and_pick_k8s_context(
             k8s_context=None,
             k8s_helper=self.k8s_helper,
@@ -98,88 +157,244 @@ class TanzuApplicationPlatformGUI:
             pick_message="Select a TAP cluster with TAP GUI installed where you would like to track:",
         )
 
-        success, response = commons.get_custom_object_data(
+        tap_values = TapValues(
+            k8s_helper=self.k8s_helper, k8s_context=k8s_context, namespace=tap_install_namespace, logger=self.logger, state=self.state
+        ).load()
+        self.add_cluster_entries(tap_values.values, [entry])
+        self.record_tracking(
+            tap_values,
+            entry,
+            {
+                "context": source_k8s_context,
+                "namespace": source_namespace,
+                "name": source_cluster_name,
+                "service_account": tap_viewer_service_account,
+            },
+        )
+        self.save_tap_values(tap_values)
+
+    @staticmethod
+    def load_track_specs(path, default_service_account="tap-gui-viewer"):
+        """
+        return the cluster namespaces to track from a yaml file, a list (or a mapping with a clusters list) of entries like
+          - context: dev-cluster
+            namespace: team-a
+            name: dev         # name on TAP GUI, defaults to the context
+            service_account: tap-gui-viewer
+        raises ValueError for entries without a context or namespace
+        """
+        with open(path, "r") as f:
+            data = yaml.safe_load(f.read())
+        if isinstance(data, dict):
+            data = data.get("clusters")
+        specs = list()
+        for entry in data or []:
+            if not isinstance(entry, dict) or not entry.get("context") or not entry.get("namespace"):
+                raise ValueError(f"Cluster entry {entry} needs a context and a namespace")
+            specs.append(
+                {
+                    "context": str(entry["context"]),
+                    "namespace": str(entry["namespace"]),
+                    "name": str(entry.get("name") or entry["context"]),
+                    "service_account": str(entry.get("service_account") or default_service_account),
+                }
+            )
+        return specs
+
+    def track_clusters(self, tap_install_namespace, from_file, tap_viewer_service_account="tap-gui-viewer", parallelism: int = 16):
+        """
+        Non-interactive track_cluster for every entry of from_file. Tokens are read from all source clusters concurrently
+        and the TAP values are written once, so TAP GUI reconciles once however many clusters are added.
+        Nothing is written when the token of any entry cannot be read.
+        """
+        try:
+            specs = self.load_track_specs(from_file, default_service_account=tap_viewer_service_account)
+        except Exception as err:
+            self.logger.msg(f"{err}") if self.state["verbose"] else None
+            self.logger.msg(
+                f":broken_heart: Unable to read clusters from [yellow]{from_file}[/yellow]. Use [bold]--verbose[/bold] flag for error details."
+            )
+            raise typer.Exit(-1)
+        if not specs:
+            self.logger.msg(f":broken_heart: No clusters found in [yellow]{from_file}[/yellow].")
+            raise typer.Exit(-1)
+        self.k8s_helper.load_contexts_and_clients()
+        unknown = sorted({spec["context"] for spec in specs if spec["context"] not in self.k8s_helper.contexts})
+        if unknown:
+            self.logger.msg(f":worried: No valid context named [yellow]{', '.join(unknown)}[/yellow] found in KUBECONFIG.", bold=False)
+            raise typer.Exit(-1)
+
+        k8s_context = commons.check_and_pick_k8s_context(
+            k8s_context=None,
             k8s_helper=self.k8s_helper,
-            namespace=tap_install_namespace,
-            name="tap",
-            group="packaging.carvel.dev",
-            version="v1alpha1",
-            plural="packageinstalls",
-            client=self.k8s_helper.custom_clients[k8s_context],
             logger=self.logger,
+            ui_helper=self.ui_helper,
             state=self.state,
+            pick_message="Select a TAP cluster with TAP GUI installed where you would like to track:",
         )
 
-        # hack TODO: switch this to use a decent jsonpath lib
-        # tap_version_installed = response["spec"]["packageRef"]["versionSelection"]["constraints"]
-        tap_values_secret_name = response["spec"]["values"][0]["secretRef"]["name"]
-
-        success, response = self.k8s_helper.get_namespaced_secret(
-            secret=tap_values_secret_name, namespace=tap_install_namespace, client=self.k8s_helper.core_clients[k8s_context]
-        )
-
-        if not success:
-            self.logger.msg(f":cry: Unable to get secret {tap_values_secret_name} from namespace {tap_install_namespace}")
-            raise typer.Exit(-1)
-
-        if success:
+        def fetch(spec):
             try:
-                tap_values = yaml.safe_load(base64.b64decode(list(response.data.values())[0]).decode())
-                og_tap_values = yaml.safe_load(base64.b64decode(list(response.data.values())[0]).decode())
-            except Exception:
-                self.logger.msg(f":cry: {tap_values_secret_name} secret was not proper yaml")
-                raise typer.Exit(1)
+                return self.cluster_entry(
+                    k8s_context=spec["context"], namespace=spec["namespace"], name=spec["name"], service_account=spec["service_account"]
+                )
+            except Exception as err:
+                # Connection errors of unreachable clusters are not ApiExceptions
+                return err
+
+        with self.console.status(f":key: Reading service account tokens from {len(specs)} cluster namespaces"):
+            with ThreadPoolExecutor(max_workers=max(min(parallelism, len(specs)), 1)) as executor:
+                results = list(executor.map(fetch, specs))
+
+        failed = [(spec, result) for spec, result in zip(specs, results) if isinstance(result, Exception)]
+        if failed:
+            table = Table(title="Unable to read tokens")
+            table.add_column("Context")
+            table.add_column("Namespace")
+            table.add_column("Error", style="red")
+            for spec, err in failed:
+                table.add_row(spec["context"], spec["namespace"], f"{err}")
+            self.console.print(table)
+            self.logger.msg(":broken_heart: Not tracking any cluster, fix the entries above and try again.")
+            raise typer.Exit(-1)
 
-            try:
-                _ = tap_values["tap_gui"] and tap_values["tap_gui"]["app_config"]
-            except KeyError:
-                self.logger.msg(f":cry: tap_gui or app_config not found in TAP values file")
-                raise typer.Exit(-1)
+        tap_values = TapValues(
+            k8s_helper=self.k8s_helper, k8s_context=k8s_context, namespace=tap_install_namespace, logger=self.logger, state=self.state
+        ).load()
+        self.add_cluster_entries(tap_values.values, results)
+        for spec, entry in zip(specs, results):
+            self.record_tracking(tap_values, entry, spec)
+        self.save_tap_values(tap_values)
+        self.logger.msg(f":rocket: TAP GUI is tracking {len(results)} more cluster namespaces")
+
+    @staticmethod
+    def tracking_key(name):
+        return f"{TRACKING_ANNOTATION_PREFIX}{hashlib.sha1(name.encode()).hexdigest()[:16]}"
+
+    def record_tracking(self, tap_values: TapValues, entry, spec):
+        """
+        record the context, namespace and service account entry was tracked from in an annotation of the TAP values secret
+        """
+        server = self.k8s_helper.kubeconfig_index.get(spec["context"]).get("server") or entry.get("url")
+        tap_values.annotations[self.tracking_key(entry["name"])] = json.dumps(
+            {
+                "name": entry["name"],
+                "context": spec["context"],
+                "namespace": spec["namespace"],
+                "service_account": spec["service_account"],
+                "server": server,
+            }
+        )
 
+    def tracking_record(self, tap_values: TapValues, entry):
+        """
+        return the tracking record of entry, None for clusters tracked before tappr recorded them
+        """
+        try:
+            record = json.loads(tap_values.annotations.get(self.tracking_key(entry.get("name", ""))) or "null")
+        except ValueError:
+            return None
+        return record if record and record.get("name") == entry.get("name") else None
+
+    def rotate_entry(self, entry, record, expiration_seconds):
+        """
+        return entry with a token freshly minted for the service account of its tracking record,
+        or the exception explaining why no token could be minted
+        """
+        k8s_context = record["context"]
+        if k8s_context not in self.k8s_helper.contexts:
+            return ValueError(f"No context named {k8s_context} in KUBECONFIG")
+        server = (self.k8s_helper.kubeconfig_index.get(k8s_context).get("server") or "").rstrip("/")
+        if server != f"{entry.get('url')}".rstrip("/"):
+            return ValueError(f"Context {k8s_context} points to {server}, not to {entry.get('url')}")
+        try:
+            token = self.mint_token(
+                k8s_context=k8s_context,
+                namespace=record["namespace"],
+                service_account=record["service_account"],
+                expiration_seconds=expiration_seconds,
+            )
+        except Exception as err:
+            # Connection errors of unreachable clusters are not ApiExceptions
+            return err
+        return dict(entry, serviceAccountToken=token)
+
+    def rotate_tokens(
+        self,
+        tap_install_namespace,
+        tap_viewer_service_account="tap-gui-viewer",
+        expiration_seconds: int = TOKEN_EXPIRATION_SECONDS,
+        parallelism: int = 16,
+        mapping=None,
+    ):
+        """
+        Replace the token of every serviceAccount cluster tracked by TAP GUI with one minted by the TokenRequest API.
+        Tokens are minted concurrently for the context, namespace and service account each cluster was tracked from,
+        then all tokens are written with a single update of the TAP values. Clusters whose token could not be minted keep their old token.
+        Clusters tracked before tappr recorded where they came from are only rotated when the mapping file (in the format of track --from) lists them.
+        """
+        specs = dict()
+        if mapping:
             try:
-                tap_values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"].append(
-                    {
-                        "authProvider": "serviceAccount",
-                        "name": f"{source_cluster_name}-{source_namespace}",
-                        "serviceAccountToken": f"{cluster_token}",
-                        "skipTLSVerify": True,
-                        "url": f"{cluster_url}",
-                    }
+                specs = {
+                    f"{spec['name']}-{spec['namespace']}": spec
+                    for spec in self.load_track_specs(mapping, default_service_account=tap_viewer_service_account)
+                }
+            except Exception as err:
+                self.logger.msg(f"{err}") if self.state["verbose"] else None
+                self.logger.msg(
+                    f":broken_heart: Unable to read clusters from [yellow]{mapping}[/yellow]. Use [bold]--verbose[/bold] flag for error details."
                 )
-            except Exception:
-                tap_values["tap_gui"]["app_config"]["kubernetes"] = dict()
-                tap_values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"] = list()
-                tap_values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"] = [
-                    {
-                        "clusters": [
-                            {
-                                "authProvider": "serviceAccount",
-                                "name": f"{source_cluster_name}-{source_namespace}",
-                                "serviceAccountToken": f"{cluster_token}",
-                                "skipTLSVerify": True,
-                                "url": f"{cluster_url}",
-                            }
-                        ],
-                        "type": "config",
-                    }
-                ]
-
-            commons.print_smart_diff(og_tap_values, tap_values)
-            # hack: TODO: if the data object structure changes, it will have to be adjusted here. currently I assume there is only 1 key
-            data_key = list(response.data.keys())[0]
-            body = {"data": {data_key: base64.b64encode(yaml.safe_dump(tap_values).encode()).decode()}}
-            success, response = self.k8s_helper.patch_namespaced_secret(
-                client=self.k8s_helper.core_clients[k8s_context], secret=tap_values_secret_name, namespace=tap_install_namespace, body=body
-            )
-
-            if not success:
-                self.logger.msg(":broken_heart: Unable to edit the configuration secret on TAP cluster. Try again later.")
-                self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
                 raise typer.Exit(-1)
 
-        else:
-            self.logger.msg(f":broken_heart: {tap_values_secret_name} secret not found in the k8s cluster. is TAP installed properly?")
-            self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
+        k8s_context = commons.check_and_pick_k8s_context(
+            k8s_context=None,
+            k8s_helper=self.k8s_helper,
+            logger=self.logger,
+            ui_helper=self.ui_helper,
+            state=self.state,
+            pick_message="Select a TAP cluster with TAP GUI installed:",
+        )
+        tap_values = TapValues(
+            k8s_helper=self.k8s_helper, k8s_context=k8s_context, namespace=tap_install_namespace, logger=self.logger, state=self.state
+        ).load()
+        commons.get_tap_gui_cluster_from_tap_values(tap_values=tap_values.values, logger=self.logger)
+        clusters = tap_values.values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"]
+        entries = [entry for entry in clusters if entry.get("authProvider") == "serviceAccount"]
+        if not entries:
+            self.logger.msg(":person_shrugging: No cluster tracked with a service account token.")
+            return
+
+        self.k8s_helper.load_contexts_and_clients()
+        records = {entry["name"]: self.tracking_record(tap_values, entry) or specs.get(entry["name"]) for entry in entries}
+
+        def rotate(entry):
+            if not records[entry["name"]]:
+                return ValueError("Not tracked by tappr, pass its context and namespace with --mapping")
+            return self.rotate_entry(entry, records[entry["name"]], expiration_seconds)
+
+        with self.console.status(f":key: Requesting tokens for {len(entries)} tracked clusters"):
+            with ThreadPoolExecutor(max_workers=max(min(parallelism, len(entries)), 1)) as executor:
+                results = list(executor.map(rotate, entries))
+
+        rotated = {entry["name"]: result for entry, result in zip(entries, results) if not isinstance(result, Exception)}
+        failed = [(entry, result) for entry, result in zip(entries, results) if isinstance(result, Exception)]
+        if rotated:
+            clusters[:] = [rotated.get(entry.get("name"), entry) for entry in clusters]
+            for name, entry in rotated.items():
+                if not self.tracking_record(tap_values, entry):
+                    self.record_tracking(tap_values, entry, records[name])
+            self.save_tap_values(tap_values)
+            self.logger.msg(f":rocket: Rotated the tokens of {len(rotated)} tracked clusters")
+        if failed:
+            table = Table(title="Tokens not rotated")
+            table.add_column("Name")
+            table.add_column("URL", style="green")
+            table.add_column("Error", style="red")
+            for entry, err in failed:
+                table.add_row(f"{entry.get('name')}", f"{entry.get('url')}", f"{err}")
+            self.console.print(table)
+            raise typer.Exit(-1)
 
     def untrack_cluster(self, tap_install_namespace):
         mod_state = self.state
@@ -193,61 +408,63 @@ class TanzuApplicationPlatformGUI:
             pick_message="Select a TAP cluster where TAP GUI is installed",
         )
 
-        success, response = commons.get_custom_object_data(
-            k8s_helper=self.k8s_helper,
-            namespace=tap_install_namespace,
-            name="tap",
-            group="packaging.carvel.dev",
-            version="v1alpha1",
-            plural="packageinstalls",
-            client=self.k8s_helper.custom_clients[k8s_context],
-            logger=self.logger,
-            state=self.state,
-        )
-
-        # hack TODO: switch this to use a decent jsonpath lib
-        # tap_version_installed = response["spec"]["packageRef"]["versionSelection"]["constraints"]
-        tap_values_secret_name = response["spec"]["values"][0]["secretRef"]["name"]
-
-        success, response = self.k8s_helper.get_namespaced_secret(
-            secret=tap_values_secret_name, namespace=tap_install_namespace, client=self.k8s_helper.core_clients[k8s_context]
+        tap_values = TapValues(
+            k8s_helper=self.k8s_helper, k8s_context=k8s_context, namespace=tap_install_namespace, logger=self.logger, state=self.state
+        ).load()
+        values = tap_values.values
+        clusters = commons.get_tap_gui_cluster_from_tap_values(tap_values=values, logger=self.logger)
+
+        selected = set(
+            Picker(
+                [c["name"] for c in clusters],
+                "Pick the clusters to untrack (SPACE to select, ENTER to confirm):",
+                multiselect=True,
+                min_selection_count=1,
+            ).start()
         )
-
-        if not success:
-            self.logger.msg(f":cry: Unable to get secret {tap_values_secret_name} from namespace {tap_install_namespace}")
-            raise typer.Exit(-1)
-        clusters = commons.get_tap_gui_cluster_from_tap_values(tap_values_secret_response=response, logger=self.logger)
-
-        try:
-            tap_values = yaml.safe_load(base64.b64decode(list(response.data.values())[0]).decode())
-            og_tap_values = yaml.safe_load(base64.b64decode(list(response.data.values())[0]).decode())
-        except Exception:
-            self.logger.msg(f":cry: {tap_values_secret_name} secret was not proper yaml")
-            raise typer.Exit(1)
-
-        option, _ = Picker([c["name"] for c in clusters], "Pick a cluster to untrack:").start()
         new_clusters_list = [
-            x for x in tap_values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"] if x["name"] != option
+            x for x in values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"] if x["name"] not in selected
         ]
 
+        for name in selected:
+            tap_values.annotations.pop(self.tracking_key(name), None)
         if not new_clusters_list:
-            del tap_values["tap_gui"]["app_config"]["kubernetes"]
+            del values["tap_gui"]["app_config"]["kubernetes"]
         else:
-            tap_values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"] = new_clusters_list
-        commons.print_smart_diff(og_tap_values, tap_values)
-        # hack: TODO: if the data object structure changes, it will have to be adjusted here. currently I assume there is only 1 key
-        data_key = list(response.data.keys())[0]
-        body = {"data": {data_key: base64.b64encode(yaml.safe_dump(tap_values).encode()).decode()}}
-        success, response = self.k8s_helper.patch_namespaced_secret(
-            client=self.k8s_helper.core_clients[k8s_context], secret=tap_values_secret_name, namespace=tap_install_namespace, body=body
+            values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"] = new_clusters_list
+        self.save_tap_values(tap_values)
+
+    @staticmethod
+    def probe_row(k8s_helper, entry, timeout_seconds):
+        """
+        return the latency, status and token cells of a tracked cluster entry, probed with its own url and token
+        """
+        success, response = k8s_helper.probe_server(
+            url=entry.get("url"),
+            token=entry.get("serviceAccountToken"),
+            ca_data=entry.get("caData"),
+            skip_tls_verify=bool(entry.get("skipTLSVerify")),
+            timeout_seconds=timeout_seconds,
         )
-
         if not success:
-            self.logger.msg(":broken_heart: Unable to edit the configuration secret on TAP cluster. Try again later.")
-            self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
-            raise typer.Exit(-1)
+            if k8s_helper.tls_error(response):
+                reason = "tls error"
+            else:
+                reason = "timeout" if "timed out" in f"{response}".lower() else "unreachable"
+            return "-", f"[red]{reason}[/red]", "-"
+        status = response["status"]
+        style = "green" if status == 200 else "yellow" if status == 403 else "red"
+        if not entry.get("serviceAccountToken"):
+            token = "-"
+        elif status == 401:
+            token = "[red]invalid[/red]"
+        elif status in (200, 403):
+            token = "[green]valid[/green]"
+        else:
+            token = "unknown"
+        return f"{response['seconds'] * 1000:.0f}ms", f"[{style}]{status}[/{style}]", token
 
-    def list_clusters(self, namespace):
+    def list_clusters(self, namespace, probe: bool = False, timeout_seconds: float = 5, parallelism: int = 16):
         k8s_context = commons.check_and_pick_k8s_context(
             k8s_context=None,
             k8s_helper=self.k8s_helper,
@@ -257,23 +474,29 @@ class TanzuApplicationPlatformGUI:
             pick_message="Select a TAP cluster with TAP GUI installed:",
         )
 
-        success, response = commons.get_tap_values(
+        tap_values = TapValues(
             k8s_helper=self.k8s_helper, k8s_context=k8s_context, namespace=namespace, logger=self.logger, state=self.state
-        )
-
-        if success:
-            clusters = commons.get_tap_gui_cluster_from_tap_values(tap_values_secret_response=response, logger=self.logger)
-            table = Table(title="TAP GUI Tracked Clusters")
-            table.add_column("Name")
-            table.add_column("URL", style="green")
-            table.add_column("Auth Provider")
-
-            for entry in clusters:
-                table.add_row(f"{entry.get('name')}", f"{entry.get('url')}", f"{entry.get('authProvider')}")
-            console = Console()
-            console.print("")
-            console.print(table)
-
-        else:
-            self.logger.msg(f":broken_heart: TAP Values file secret not found in the k8s cluster. is TAP installed properly?")
-            self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
+        ).load()
+        clusters = commons.get_tap_gui_cluster_from_tap_values(tap_values=tap_values.values, logger=self.logger)
+        table = Table(title="TAP GUI Tracked Clusters")
+        table.add_column("Name")
+        table.add_column("URL", style="green")
+        table.add_column("Auth Provider")
+
+        probes = [tuple()] * len(clusters)
+        if probe and clusters:
+            table.add_column("Latency", justify="right")
+            table.add_column("Status")
+            table.add_column("Token")
+            # Every cluster is probed with its own short lived client, so a slow or unreachable cluster only holds its own worker
+            with self.console.status(f":satellite: Probing {len(clusters)} tracked clusters"):
+                with ThreadPoolExecutor(max_workers=max(min(parallelism, len(clusters)), 1)) as executor:
+                    # The summarized clusters carry no tokens, probe with the entries as they are in the TAP values
+                    entries = tap_values.values["tap_gui"]["app_config"]["kubernetes"]["clusterLocatorMethods"][0]["clusters"]
+                    probes = list(executor.map(lambda entry: self.probe_row(self.k8s_helper, entry, timeout_seconds), entries))
+
+        for entry, cells in zip(clusters, probes):
+            table.add_row(f"{entry.get('name')}", f"{entry.get('url')}", f"{entry.get('authProvider')}", *cells)
+        console = Console()
+        console.print("")
+        console.print(table)
@@ -0,0 +1,110 @@
+import base64
+import copy
+
+import typer
+import yaml
+
+from tappr.modules.tanzu.packageinstalls import GROUP, PLURAL, VERSION
+from tappr.modules.utils.diff import apply_changes, structural_diff
+
+CONFLICT_RETRIES = 5
+
+
+# noinspection PyBroadException
+class TapValues:
+    """
+    The TAP values of an install, read from the values secret of its PackageInstall once per command.
+    values is the parsed document to edit, original an untouched copy of it. save() writes values back with a patch that carries
+    the resourceVersion they were read at, so that a concurrent edit is never overwritten: on a conflict the latest values
+    are fetched, the changes made since load() are replayed on top of them and the patch is retried.
+    annotations of the values secret can be edited the same way, they are saved in the same patch.
+    """
+
+    def __init__(self, k8s_helper, k8s_context, namespace, logger, state, package="tap"):
+        self.k8s_helper = k8s_helper
+        self.k8s_context = k8s_context
+        self.namespace = namespace
+        self.logger = logger
+        self.state = state
+        self.package = package
+        self.secret_name = None
+        self.data_key = None
+        self.resource_version = None
+        self.values = None
+        self.original = None
+        self.annotations = None
+        self.original_annotations = None
+
+    def load(self):
+        success, response = self.k8s_helper.get_namespaced_custom_objects(
+            name=self.package,
+            group=GROUP,
+            version=VERSION,
+            namespace=self.namespace,
+            plural=PLURAL,
+            client=self.k8s_helper.custom_clients[self.k8s_context],
+        )
+        if not success:
+            self.logger.msg(f":broken_heart: Cannot find {self.package} in {PLURAL} in namespace {self.namespace} on the cluster")
+            self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
+            raise typer.Exit(1)
+        self.secret_name = response["spec"]["values"][0]["secretRef"]["name"]
+
+        success, response = self.k8s_helper.get_namespaced_secret(
+            secret=self.secret_name, namespace=self.namespace, client=self.k8s_helper.core_clients[self.k8s_context], raw=True
+        )
+        if not success:
+            self.logger.msg(f":broken_heart: {self.secret_name} secret not found in the k8s cluster. is TAP installed properly?")
+            self.logger.msg(f"\n{response}", bold=False) if self.state["verbose"] else None
+            raise typer.Exit(-1)
+        # The values secret has a single key, named after the values file it was created from
+        self.data_key = list(response["data"].keys())[0]
+        self.resource_version = response["metadata"]["resourceVersion"]
+        self.annotations = dict(response["metadata"].get("annotations") or dict())
+        self.original_annotations = dict(self.annotations)
+        try:
+            self.values = yaml.safe_load(base64.b64decode(response["data"][self.data_key]).decode())
+        except Exception:
+            self.logger.msg(f":cry: {self.secret_name} secret was not proper yaml")
+            raise typer.Exit(1)
+        self.original = copy.deepcopy(self.values)
+        return self
+
+    def changes(self):
+        return structural_diff(self.original, self.values)
+
+    def annotation_changes(self):
+        """
+        return the annotations set or removed (None) since load()
+        """
+        changes = {key: value for key, value in self.annotations.items() if self.original_annotations.get(key) != value}
+        changes.update({key: None for key in self.original_annotations if key not in self.annotations})
+        return changes
+
+    def save(self, retries: int = CONFLICT_RETRIES):
+        """
+        return success: bool, response: V1Secret/kubernetes.client.exceptions.ApiException
+        """
+        changes, annotation_changes = self.changes(), self.annotation_changes()
+        for attempt in range(retries + 1):
+            body = {
+                "metadata": {"resourceVersion": self.resource_version},
+                "data": {self.data_key: base64.b64encode(yaml.safe_dump(self.values).encode()).decode()},
+            }
+            if annotation_changes:
+                body["metadata"]["annotations"] = annotation_changes
+            success, response = self.k8s_helper.patch_namespaced_secret(
+                client=self.k8s_helper.core_clients[self.k8s_context], secret=self.secret_name, namespace=self.namespace, body=body
+            )
+            if success:
+                self.resource_version = response.metadata.resource_version
+                self.original = copy.deepcopy(self.values)
+                self.original_annotations = dict(self.annotations)
+                return True, response
+            if getattr(response, "status", None) != 409 or attempt == retries:
+                return False, response
+            self.logger.msg(f":arrows_counterclockwise: {self.secret_name} changed on the cluster, merging with the latest values", bold=False)
+            self.load()
+            self.values = apply_changes(self.values, changes)
+            for key, value in annotation_changes.items():
+                self.annotations.pop(key, None) if value is None else self.annotations.update({key: value})
@@ -1,10 +1,16 @@
 import typer
-import yaml
-import base64
+import json
+import os
+import shutil
+import threading
+import time
 
+from kubernetes.client.rest import ApiException
 from tappr.modules.utils.ui import Picker
 from rich import print as rprint
-from difflib import Differ
+from tappr.modules.utils.diff import mask_changes, render_changes, structural_diff
+
+TANZU_CLI_CHECK_TTL_SECONDS = 24 * 60 * 60
 
 
 class Commons:
@@ -32,11 +38,35 @@ class Commons:
         return
 
     @staticmethod
-    def check_tanzu_cli(ui_helper, state, logger):
+    def check_tanzu_cli(ui_helper, state, logger, ttl_seconds=TANZU_CLI_CHECK_TTL_SECONDS):
+        # A passing check is cached for the exact tanzu binary, so it only runs again after a CLI upgrade or once the TTL expires
+        cache_file = f'{os.environ.get("HOME")}/.config/tappr/tanzu-cli-check.json'
+        binary = shutil.which("tanzu")
+        key = None
+        if binary:
+            binary = os.path.realpath(binary)
+            key = {"path": binary, "mtime": os.stat(binary).st_mtime_ns}
+            try:
+                with open(cache_file, "r") as f:
+                    cached = json.loads(f.read())
+                if cached["key"] == key and time.time() - cached["checked_at"] < ttl_seconds:
+                    return
+            except Exception:
+                pass
+
         proc, _, _ = ui_helper.progress(cmd=f"tanzu package version", state=state, message="Checking")
         if proc.returncode != 0:
             logger.msg(":broken_heart: tanzu cli checks failed. Use [bold]--verbose[/bold] flag for error details.")
             raise typer.Exit(-1)
+        if key:
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}"
+                with open(tmp_file, "w") as f:
+                    f.write(json.dumps({"key": key, "checked_at": time.time()}))
+                os.replace(tmp_file, cache_file)
+            except Exception:
+                pass
 
     @staticmethod
     def check_and_pick_k8s_context(k8s_context, k8s_helper, logger, ui_helper, state, pick_message=None):
@@ -48,32 +78,69 @@ class Commons:
         if not k8s_context:
             logger.msg(":broken_heart: No valid k8s context found.")
             raise typer.Exit(1)
+        try:
+            # Clients are built on first use, so a context whose client cannot be built is only caught here
+            k8s_helper.api_client(k8s_context)
+        except Exception as err:
+            logger.msg(f"{err}", bold=False) if state.get("verbose") else None
+            logger.msg(
+                f":broken_heart: Unable to load k8s context [yellow]{k8s_context}[/yellow] from KUBECONFIG. Use [bold]--verbose[/bold] flag for error details."
+            )
+            raise typer.Exit(-1)
         Commons.check_tanzu_cli(ui_helper=ui_helper, state=state, logger=logger)
-        ui_helper.progress(cmd=f"kubectl config use-context {k8s_context}", message=":hourglass: Setting context", state=state)
+        # Child processes get the context through their environment instead of switching the current-context in the user's kubeconfig
+        state["kube_env"] = k8s_helper.context_env(k8s_context)
         logger.msg(f":file_folder: Using k8s context [yellow]{k8s_context}[/yellow]", bold=False)
         return k8s_context
 
+    @staticmethod
+    def resolve_k8s_contexts(contexts, all_contexts, k8s_helper, logger):
+        """
+        return the list of contexts from a comma separated --contexts value, or every context in KUBECONFIG with --all-contexts
+        """
+        k8s_helper.load_contexts_and_clients()
+        if all_contexts:
+            selected = list(k8s_helper.contexts)
+        else:
+            selected = [ctx.strip() for ctx in contexts.split(",") if ctx.strip()]
+        unknown = [ctx for ctx in selected if ctx not in k8s_helper.contexts]
+        if unknown:
+            logger.msg(f":worried: No valid context named [yellow]{', '.join(unknown)}[/yellow] found in KUBECONFIG.", bold=False)
+            raise typer.Exit(-1)
+        if not selected:
+            logger.msg(":broken_heart: No valid k8s context found.")
+            raise typer.Exit(1)
+        return selected
+
     @staticmethod
     def list_k8s_context(k8s_helper):
         return k8s_helper.list_context()
 
     @staticmethod
-    def print_smart_diff(old, new):
-        for line in Differ().compare(yaml.safe_dump(old).split("\n"), yaml.safe_dump(new).split("\n")):
-            if line.startswith("+"):
-                rprint(f"[green]{line}[/green]")
-            elif line.startswith("-"):
-                rprint(f"[red]{line}[/red]")
-            elif not line.startswith("   ") and not line.startswith("  -") and not line.startswith("?"):
-                print(line)
+    def print_smart_diff(old, new, mask_secrets: bool = True, output: str = "text"):
+        """
+        print only the paths that changed between old and new, as colored text or as a json list with output="json".
+        Values under password/token/secret like keys are replaced by a digest unless mask_secrets is False.
+        """
+        changes = structural_diff(old, new)
+        if mask_secrets:
+            changes = mask_changes(changes)
+        if output == "json":
+            print(json.dumps([{key: value for key, value in change.items() if key != "keys"} for change in changes], indent=2, default=str))
+            return
+        if not changes:
+            rprint("No changes")
+        for line in render_changes(changes):
+            rprint(line)
 
     @staticmethod
     def get_ns_list(k8s_helper, client):
         ns_list = list()
-        success, response = k8s_helper.list_namespaces(client=client)
-        if success and hasattr(response, "items"):
-            for item in response.items:
-                ns_list.append(item.metadata.name)
+        try:
+            for name in k8s_helper.iter_namespaces(client=client, names_only=True):
+                ns_list.append(name)
+        except ApiException:
+            pass
         return ns_list
 
     @staticmethod
@@ -105,40 +172,7 @@ class Commons:
         return option
 
     @staticmethod
-    def get_tap_values(k8s_helper, k8s_context, namespace, logger, state):
-        success, response = Commons.get_custom_object_data(
-            k8s_helper=k8s_helper,
-            namespace=namespace,
-            name="tap",
-            group="packaging.carvel.dev",
-            version="v1alpha1",
-            plural="packageinstalls",
-            client=k8s_helper.custom_clients[k8s_context],
-            logger=logger,
-            state=state,
-        )
-
-        # hack TODO: switch this to use a decent jsonpath lib
-        # tap_version_installed = response["spec"]["packageRef"]["versionSelection"]["constraints"]
-        tap_values_secret_name = response["spec"]["values"][0]["secretRef"]["name"]
-
-        success, response = k8s_helper.get_namespaced_secret(
-            secret=tap_values_secret_name, namespace=namespace, client=k8s_helper.core_clients[k8s_context]
-        )
-
-        if not success:
-            logger.msg(f":cry: Unable to get {tap_values_secret_name} from namespace {namespace}")
-            raise typer.Exit(-1)
-        return success, response
-
-    @staticmethod
-    def get_tap_gui_cluster_from_tap_values(tap_values_secret_response, logger):
-        try:
-            tap_values = yaml.safe_load(base64.b64decode(list(tap_values_secret_response.data.values())[0]).decode())
-        except Exception:
-            logger.msg(f":cry: TAP Values file secret was not proper yaml")
-            raise typer.Exit(1)
-
+    def get_tap_gui_cluster_from_tap_values(tap_values: dict, logger):
         try:
             _ = tap_values["tap_gui"] and tap_values["tap_gui"]["app_config"] and tap_values["tap_gui"]["app_config"]["kubernetes"]
         except KeyError:
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from rich.live import Live
+from rich.spinner import Spinner
+from rich.table import Table
+
+STATUS_STYLE = {
+    "pending": "white",
+    "running": "yellow",
+    "done": "green",
+    "cached": "cyan",
+    "failed": "red",
+    "skipped": "white",
+}
+
+
+def file_digest(path):
+    """
+    return the sha256 of the file content, None when it does not exist (yet)
+    """
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+@dataclass
+class Step:
+    name: str
+    description: str
+    run: Callable[[], Any]
+    deps: List[str] = field(default_factory=list)
+    # Steps without inputs always run, steps with inputs are skipped on resume when their key is in the journal
+    inputs: Any = None
+    outputs: List[str] = field(default_factory=list)
+    key: Optional[str] = field(init=False, default=None)
+    status: str = field(init=False, default="pending")
+    started: Optional[float] = field(init=False, default=None)
+    finished: Optional[float] = field(init=False, default=None)
+    error: Optional[BaseException] = field(init=False, default=None)
+    result: Any = field(init=False, default=None)
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+
+# noinspection PyBroadException
+class Journal:
+    """
+    json file of the steps that completed, keyed by step name, with the key of the inputs they completed with
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries: Dict[str, dict] = dict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.loads(f.read())
+        except Exception:
+            self.entries = dict()
+        return self
+
+    def completed(self, step: Step):
+        entry = self.entries.get(step.name)
+        return entry is not None and entry["key"] == step.key and all(os.path.exists(path) for path in step.outputs)
+
+    def record(self, step: Step):
+        with self._lock:
+            self.entries[step.name] = {"key": step.key, "finished": step.finished, "duration": step.duration}
+            self._write()
+
+    def forget(self, step: Step):
+        with self._lock:
+            if self.entries.pop(step.name, None) is not None:
+                self._write()
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(self.entries))
+        os.replace(tmp_path, self.path)
+
+
+class DAG:
+    """
+    Runs named steps as soon as the steps they depend on are done, up to max_workers at a time.
+    After the first failure no new steps are started, running steps finish and the remaining ones are marked skipped.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self.steps: Dict[str, Step] = dict()
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+
+    def add(self, name, description, run, deps=(), inputs=None, outputs=()):
+        if name in self.steps:
+            raise ValueError(f"Step {name} is already defined")
+        self.steps[name] = Step(name=name, description=description, run=run, deps=list(deps), inputs=inputs, outputs=list(outputs))
+        return self.steps[name]
+
+    def _key(self, step: Step):
+        """
+        hash of the step inputs and the keys of its dependencies, so that a change upstream also invalidates every step downstream
+        """
+        if step.key is None:
+            material = {
+                "inputs": step.inputs if step.inputs is not None else f"always:{step.name}",
+                "deps": [self._key(self.steps[dep]) for dep in step.deps],
+            }
+            step.key = hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode()).hexdigest()
+        return step.key
+
+    def validate(self):
+        for step in self.steps.values():
+            for dep in step.deps:
+                if dep not in self.steps:
+                    raise ValueError(f"Step {step.name} depends on unknown step {dep}")
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Steps have a dependency cycle through {name}")
+            visiting.add(name)
+            for dep in self.steps[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.steps:
+            visit(name)
+        for step in self.steps.values():
+            self._key(step)
+
+    def _execute(self, step: Step, journal: Journal = None):
+        with self._lock:
+            step.status, step.started = "running", time.time()
+        try:
+            result = step.run()
+            step.finished = time.time()
+            if journal is not None and step.inputs is not None:
+                journal.record(step)
+            with self._lock:
+                step.result, step.status = result, "done"
+        except Exception as err:
+            if journal is not None:
+                journal.forget(step)
+            with self._lock:
+                step.error, step.status = err, "failed"
+        finally:
+            step.finished = step.finished or time.time()
+
+    def _ready(self):
+        return [
+            step
+            for step in self.steps.values()
+            if step.status == "pending" and all(self.steps[dep].status in ("done", "cached") for dep in step.deps)
+        ]
+
+    def run(self, live: bool = True, console=None, title="Steps", journal: Journal = None, resume: bool = False):
+        """
+        return success: bool. With live, the state of every step is rendered as a table that refreshes until the run ends.
+        Completed steps are recorded in journal. With resume, steps the journal has with the same key are not run again.
+        """
+        self.validate()
+        self.start_time = time.time()
+        running = dict()
+        display = Live(self.progress_table(title), console=console, refresh_per_second=8, transient=True) if live else None
+        if display:
+            display.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while True:
+                    failed = any(step.status == "failed" for step in self.steps.values())
+                    if not failed:
+                        for step in self._ready():
+                            if resume and journal is not None and step.inputs is not None and journal.completed(step):
+                                step.status = "cached"
+                                continue
+                            if len(running) >= self.max_workers:
+                                break
+                            # Marked here so that the next scheduling pass does not submit the step twice
+                            step.status = "running"
+                            running[executor.submit(self._execute, step, journal)] = step
+                    if not running and (failed or not self._ready()):
+                        break
+                    if not running:
+                        continue
+                    done, _ = wait(list(running), timeout=0.25, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        running.pop(future)
+                    if display:
+                        display.update(self.progress_table(title))
+        finally:
+            if display:
+                display.stop()
+        for step in self.steps.values():
+            if step.status == "pending":
+                step.status = "skipped"
+        self.end_time = time.time()
+        return all(step.status in ("done", "cached") for step in self.steps.values())
+
+    def failed(self):
+        return [step for step in self.steps.values() if step.status == "failed"]
+
+    def critical_path(self):
+        """
+        return the chain of steps that bounded the run: starting from the step that finished last,
+        repeatedly follow the dependency that finished last
+        """
+        finished = [step for step in self.steps.values() if step.finished is not None]
+        if not finished:
+            return list()
+        step = max(finished, key=lambda s: s.finished)
+        path = [step.name]
+        while True:
+            deps = [self.steps[dep] for dep in step.deps if self.steps[dep].finished is not None]
+            if not deps:
+                break
+            step = max(deps, key=lambda s: s.finished)
+            path.append(step.name)
+        return list(reversed(path))
+
+    def progress_table(self, title="Steps"):
+        table = Table(title=title)
+        table.add_column("")
+        table.add_column("Step")
+        table.add_column("State")
+        table.add_column("Time", justify="right")
+        for step in self.steps.values():
+            style = STATUS_STYLE[step.status]
+            duration = step.duration
+            table.add_row(
+                Spinner("dots") if step.status == "running" else "",
+                step.description,
+                f"[{style}]{step.status}[/{style}]",
+                f"{duration:.1f}s" if duration is not None else "-",
+            )
+        return table
+
+    def timing_table(self, title="Step timings"):
+        critical = set(self.critical_path())
+        table = Table(title=title, caption="[bold]*[/bold] critical path")
+        table.add_column("Step")
+        table.add_column("Depends on")
+        table.add_column("Start", justify="right")
+        table.add_column("Duration", justify="right")
+        table.add_column("State")
+        for step in sorted(self.steps.values(), key=lambda s: (s.started is None, s.started or 0)):
+            style = STATUS_STYLE[step.status]
+            table.add_row(
+                f"[bold]* {step.name}[/bold]" if step.name in critical else f"  {step.name}",
+                ", ".join(step.deps),
+                f"+{step.started - self.start_time:.1f}s" if step.started is not None else "-",
+                f"{step.duration:.1f}s" if step.duration is not None else "-",
+                f"[{style}]{step.status}[/{style}]",
+            )
+        if self.end_time is not None:
+            table.add_row("[bold]total[/bold]", "", "", f"[bold]{self.end_time - self.start_time:.1f}s[/bold]", "")
+        return table
@@ -0,0 +1,186 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+
+from rich.markup import escape
+
+# Keys whose values are never printed as is, e.g. the serviceAccountToken of a cluster tracked by TAP GUI
+SECRET_KEY_PATTERN = re.compile(
+    r"password|passwd|token|private_?key|api_?key|access_?key|secret_?key|client_?secret|credential|dockerconfigjson", re.IGNORECASE
+)
+
+# Masked values are keyed digests with a key that only lives as long as the process, equal values still show the same digest
+# within one diff, but a digest cannot be matched against a dictionary of hashed passwords
+MASK_KEY = os.urandom(16)
+
+OP_STYLE = {"added": ("+", "green"), "removed": ("-", "red"), "modified": ("~", "yellow")}
+
+
+def _path(keys):
+    path = ""
+    for key in keys:
+        if isinstance(key, int):
+            path += f"[{key}]"
+        elif isinstance(key, tuple):
+            path += f"[name={key[1]}]"
+        else:
+            path += f".{key}" if path else str(key)
+    return path
+
+
+def _change(op, keys, old, new):
+    # keys locate the change for apply_changes: dict keys, list indexes and ("name", value) for lists matched by name
+    return {"op": op, "path": _path(keys), "keys": keys, "old": old, "new": new}
+
+
+def _named(items):
+    """
+    return the items of a list of dicts keyed by their unique name, None when the list cannot be matched by name
+    """
+    if not items or not all(isinstance(item, dict) and "name" in item for item in items):
+        return None
+    named = {item["name"]: item for item in items}
+    return named if len(named) == len(items) else None
+
+
+def structural_diff(old, new):
+    """
+    return the changed paths between two parsed yaml/json documents as a list of {"op", "path", "keys", "old", "new"},
+    op being added, removed or modified. Dicts are walked by key, lists of dicts with a unique name by name
+    and any other list by index, so every node of both documents is visited once.
+    """
+    changes = list()
+    stack = [((), old, new)]
+    while stack:
+        keys, old, new = stack.pop()
+        if isinstance(old, dict) and isinstance(new, dict):
+            for key in old:
+                if key not in new:
+                    changes.append(_change("removed", keys + (key,), old[key], None))
+                elif old[key] != new[key]:
+                    stack.append((keys + (key,), old[key], new[key]))
+            for key in new:
+                if key not in old:
+                    changes.append(_change("added", keys + (key,), None, new[key]))
+        elif isinstance(old, list) and isinstance(new, list):
+            old_named, new_named = _named(old), _named(new)
+            if old_named is not None and new_named is not None:
+                for name in old_named:
+                    if name not in new_named:
+                        changes.append(_change("removed", keys + (("name", name),), old_named[name], None))
+                    elif old_named[name] != new_named[name]:
+                        stack.append((keys + (("name", name),), old_named[name], new_named[name]))
+                for name in new_named:
+                    if name not in old_named:
+                        changes.append(_change("added", keys + (("name", name),), None, new_named[name]))
+                continue
+            for index in range(max(len(old), len(new))):
+                if index >= len(new):
+                    changes.append(_change("removed", keys + (index,), old[index], None))
+                elif index >= len(old):
+                    changes.append(_change("added", keys + (index,), None, new[index]))
+                elif old[index] != new[index]:
+                    stack.append((keys + (index,), old[index], new[index]))
+        elif old != new:
+            changes.append(_change("modified", keys, old, new))
+    # The stack walks the documents in reverse, sort so that the output follows the paths
+    return sorted(changes, key=lambda change: change["path"])
+
+
+def _locate(document, key):
+    """
+    return the position of key in a dict or list of document, None when it is not there
+    """
+    if isinstance(key, tuple):
+        if not isinstance(document, list):
+            return None
+        return next((index for index, item in enumerate(document) if isinstance(item, dict) and item.get("name") == key[1]), None)
+    if isinstance(document, list):
+        return key if isinstance(key, int) and key < len(document) else None
+    return key if isinstance(document, dict) and key in document else None
+
+
+def apply_changes(document, changes):
+    """
+    apply the changes of structural_diff to document in place, e.g. to replay an edit on top of a newer version of the document.
+    Changes whose parent no longer exists are skipped, index based list removals are applied from the last index down.
+    return document, or the new root when the root itself was modified
+    """
+    removals = [change for change in changes if change["op"] == "removed" and isinstance(change["keys"][-1], int)]
+    removal_ids = {id(change) for change in removals}
+    ordered = [change for change in changes if id(change) not in removal_ids]
+    ordered += sorted(removals, key=lambda change: change["keys"][-1], reverse=True)
+    for change in ordered:
+        keys = change["keys"]
+        if not keys:
+            document = change["new"]
+            continue
+        parent = document
+        for key in keys[:-1]:
+            position = _locate(parent, key)
+            if position is None:
+                parent = None
+                break
+            parent = parent[position]
+        if parent is None:
+            continue
+        position = _locate(parent, keys[-1])
+        if change["op"] == "removed":
+            if position is not None:
+                del parent[position]
+        elif position is not None:
+            parent[position] = change["new"]
+        elif isinstance(parent, list):
+            parent.append(change["new"])
+        elif isinstance(parent, dict):
+            parent[keys[-1]] = change["new"]
+    return document
+
+
+def mask(value):
+    """
+    return value with every string under a secret looking key replaced by a short digest, so that a change is still visible
+    """
+    if isinstance(value, dict):
+        return {key: _masked(item) if SECRET_KEY_PATTERN.search(str(key)) else mask(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [mask(item) for item in value]
+    return value
+
+
+def _masked(value):
+    if value is None or isinstance(value, (dict, list)) and not value:
+        return value
+    return f"****({hmac.new(MASK_KEY, json.dumps(value, sort_keys=True, default=str).encode(), hashlib.sha256).hexdigest()[:8]})"
+
+
+def mask_changes(changes):
+    masked = list()
+    for change in changes:
+        # Only the key of the last path segment, list selectors like [name=...] are not keys
+        if SECRET_KEY_PATTERN.search(change["path"].rsplit(".", 1)[-1].split("[", 1)[0]):
+            masked.append(dict(change, old=_masked(change["old"]), new=_masked(change["new"])))
+        else:
+            masked.append(dict(change, old=mask(change["old"]), new=mask(change["new"])))
+    return masked
+
+
+def _compact(value):
+    return json.dumps(value, default=str) if isinstance(value, (dict, list)) else str(value)
+
+
+def render_changes(changes):
+    """
+    return one rich markup line per change
+    """
+    lines = list()
+    for change in changes:
+        symbol, style = OP_STYLE[change["op"]]
+        if change["op"] == "modified":
+            value = f"{escape(_compact(change['old']))} -> {escape(_compact(change['new']))}"
+        else:
+            value = escape(_compact(change["new"] if change["op"] == "added" else change["old"]))
+        lines.append(f"[{style}]{symbol} {escape(change['path'] or '.')}: {value}[/{style}]")
+    return lines
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+DISCOVERY_TTL_SECONDS = 6 * 60 * 60
+
+
+def discovery_dir():
+    return f'{os.environ.get("HOME")}/.config/tappr/discovery'
+
+
+def group_version_path(api_version):
+    # The core group is served under /api, every other group under /apis
+    return f"/api/{api_version}" if "/" not in api_version else f"/apis/{api_version}"
+
+
+def resource_path(api_version, plural, namespaced, namespace=None, name=None):
+    path = group_version_path(api_version)
+    if namespaced:
+        path = f"{path}/namespaces/{namespace}"
+    path = f"{path}/{plural}"
+    return f"{path}/{name}" if name else path
+
+
+# noinspection PyBroadException
+class DiscoveryCache:
+    """
+    On disk cache of the resources served by each cluster, keyed by the cluster server and group version.
+    A group version is only fetched from the server when it is missing, older than the TTL, or does not serve the kind asked for,
+    e.g. right after its CRD was installed.
+    """
+
+    def __init__(self, ttl_seconds: int = DISCOVERY_TTL_SECONDS, path=None):
+        self.ttl_seconds = ttl_seconds
+        self.path = path if path else discovery_dir()
+        self.clusters: dict[str, dict] = dict()
+        self._lock = threading.Lock()
+
+    def resolve(self, api_client, api_version, kind):
+        """
+        return plural: str, namespaced: bool
+        raises kubernetes.client.exceptions.ApiException, LookupError when the group version does not serve kind
+        """
+        host = api_client.configuration.host
+        with self._lock:
+            cached = self._cluster(host).get(api_version)
+        if cached and time.time() - cached["fetched"] < self.ttl_seconds and kind in cached["kinds"]:
+            resource = cached["kinds"][kind]
+            return resource["plural"], resource["namespaced"]
+
+        kinds = self._fetch(api_client, api_version)
+        with self._lock:
+            self._cluster(host)[api_version] = {"fetched": time.time(), "kinds": kinds}
+            self._write(host)
+        if kind not in kinds:
+            raise LookupError(f"{kind} is not served by {api_version}")
+        return kinds[kind]["plural"], kinds[kind]["namespaced"]
+
+    def invalidate(self, api_client):
+        host = api_client.configuration.host
+        with self._lock:
+            self.clusters[host] = dict()
+            self._write(host)
+
+    @staticmethod
+    def _fetch(api_client, api_version):
+        response = api_client.call_api(
+            group_version_path(api_version),
+            "GET",
+            header_params={"Accept": "application/json"},
+            auth_settings=["BearerToken"],
+            _return_http_data_only=True,
+            _preload_content=False,
+        )
+        kinds = dict()
+        for resource in json.loads(response.data).get("resources") or []:
+            # Skip subresources like deployments/scale, they share the kind of their parent
+            if "/" in resource["name"]:
+                continue
+            kinds.setdefault(resource["kind"], {"plural": resource["name"], "namespaced": resource["namespaced"]})
+        return kinds
+
+    def _file(self, host):
+        return f"{self.path}/{hashlib.md5(host.encode()).hexdigest()}.json"
+
+    def _cluster(self, host):
+        if host not in self.clusters:
+            try:
+                with open(self._file(host), "r") as f:
+                    self.clusters[host] = json.loads(f.read())["group_versions"]
+            except Exception:
+                self.clusters[host] = dict()
+        return self.clusters[host]
+
+    def _write(self, host):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_path = f"{self._file(host)}.{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps({"server": host, "group_versions": self.clusters[host]}))
+            os.replace(tmp_path, self._file(host))
+        except Exception:
+            pass
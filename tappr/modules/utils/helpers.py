@@ -9,8 +9,8 @@ typer_logger = logger.TyperLogger()
 
 class SubProcessHelpers:
     @staticmethod
-    def run_proc(cmd):
-        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def run_proc(cmd, env=None):
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
         out, err = process.communicate()
         process.wait()
         return process, out, err
@@ -0,0 +1,274 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from rich.table import Table
+
+JOB_STATE_STYLE = {
+    "starting": "white",
+    "running": "yellow",
+    "succeeded": "green",
+    "failed": "red",
+    "cancelled": "white",
+    "lost": "red",
+}
+FINISHED_STATES = ("succeeded", "failed", "cancelled", "lost")
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+STARTING_GRACE_SECONDS = 10
+
+
+def jobs_dir():
+    return f'{os.environ.get("HOME")}/.config/tappr/jobs'
+
+
+def alive(pid):
+    if not pid:
+        return False
+    try:
+        # Reaps the supervisor when it is a child of this process, an exited child is a zombie that kill(pid, 0) still finds
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# noinspection PyBroadException
+class Jobs:
+    """
+    Background jobs of tappr. Every job is a detached supervisor process (python -m tappr.modules.utils.jobs <job dir>) that runs
+    the job command in its own session, writes its output to rotating log files and records pid, command, start/end time
+    and exit code in the state.json of the job directory under ~/.config/tappr/jobs.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path else jobs_dir()
+
+    def start(self, name, cmd, env=None):
+        """
+        start cmd (a list of arguments, or a shell command line when a str) in the background
+        return the state of the new job
+        """
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}"
+        suffix, job_dir = 1, f"{self.path}/{job_id}"
+        while os.path.exists(job_dir):
+            suffix += 1
+            job_dir = f"{self.path}/{job_id}-{suffix}"
+        os.makedirs(job_dir)
+        job = {
+            "id": os.path.basename(job_dir),
+            "name": name,
+            "cmd": cmd,
+            "state": "starting",
+            "pid": None,
+            "child_pid": None,
+            "start": time.time(),
+            "end": None,
+            "exit_code": None,
+            "log": f"{job_dir}/output.log",
+        }
+        write_state(job_dir, job)
+        with open(f"{job_dir}/supervisor.log", "a") as supervisor_log:
+            supervisor = subprocess.Popen(
+                [sys.executable, "-m", "tappr.modules.utils.jobs", job_dir],
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=supervisor_log,
+                start_new_session=True,
+            )
+        # Merged into the state the supervisor may have written already, so that a supervisor that dies before running is seen as lost
+        return update_state(job_dir, pid=supervisor.pid)
+
+    def get(self, job_id):
+        """
+        return the state of the job, None when there is no such job. Running jobs whose supervisor is gone are reported lost.
+        """
+        try:
+            with open(f"{self.path}/{job_id}/state.json", "r") as f:
+                job = json.loads(f.read())
+        except Exception:
+            return None
+        if job["state"] in ("starting", "running") and not alive(job["pid"]):
+            # The pid is recorded right after the supervisor was spawned
+            if job["pid"] is not None or time.time() - job["start"] > STARTING_GRACE_SECONDS:
+                job["state"] = "lost"
+        return job
+
+    def list(self):
+        try:
+            job_ids = sorted(os.listdir(self.path))
+        except OSError:
+            return []
+        jobs = [self.get(job_id) for job_id in job_ids]
+        return [job for job in jobs if job is not None]
+
+    def tail(self, job_id, lines: int = 50):
+        """
+        return the last lines of the job output, across the current and the last rotated log file
+        """
+        log = f"{self.path}/{job_id}/output.log"
+        output = list()
+        for path in (f"{log}.1", log):
+            try:
+                with open(path, "r", errors="replace") as f:
+                    output.extend(f.read().splitlines())
+            except OSError:
+                pass
+        return output[-lines:] if lines > 0 else output
+
+    def follow(self, job_id, poll_seconds: float = 0.5):
+        """
+        yield the lines the job writes from now on, until it finished
+        """
+        log = f"{self.path}/{job_id}/output.log"
+        position = os.path.getsize(log) if os.path.exists(log) else 0
+        while True:
+            finished = self.get(job_id)["state"] in FINISHED_STATES
+            if os.path.exists(log):
+                if os.path.getsize(log) < position:
+                    # Rotated
+                    position = 0
+                with open(log, "r", errors="replace") as f:
+                    f.seek(position)
+                    chunk = f.read()
+                    position = f.tell()
+                yield from chunk.splitlines()
+            if finished:
+                return
+            time.sleep(poll_seconds)
+
+    def wait(self, job_id, timeout_seconds: float = None, poll_seconds: float = 1):
+        """
+        return the state of the job once it finished, or as it is when timeout_seconds passed first
+        """
+        deadline = time.time() + timeout_seconds if timeout_seconds else None
+        while True:
+            job = self.get(job_id)
+            if job is None or job["state"] in FINISHED_STATES or (deadline and time.time() > deadline):
+                return job
+            time.sleep(poll_seconds)
+
+    def cancel(self, job_id):
+        """
+        send SIGTERM to the process group of the job, the supervisor records it as cancelled
+        return success: bool
+        """
+        job = self.get(job_id)
+        if job is None or job["state"] in FINISHED_STATES or not job["pid"]:
+            return False
+        try:
+            os.killpg(job["pid"], signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            return False
+        return True
+
+    @staticmethod
+    def table(jobs: list, title="tappr jobs"):
+        table = Table(title=title)
+        table.add_column("Job")
+        table.add_column("State")
+        table.add_column("Exit code", justify="right")
+        table.add_column("Started")
+        table.add_column("Duration", justify="right")
+        table.add_column("Command", no_wrap=True, overflow="ellipsis", max_width=60)
+        for job in jobs:
+            style = JOB_STATE_STYLE.get(job["state"], "white")
+            duration = (job["end"] or time.time()) - job["start"] if job["state"] != "lost" or job["end"] else None
+            table.add_row(
+                job["id"],
+                f"[bold][{style}]{job['state']}[/{style}][/bold]",
+                str(job["exit_code"]) if job["exit_code"] is not None else "-",
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job["start"])),
+                f"{duration:.0f}s" if duration is not None else "-",
+                command_line(job["cmd"]),
+            )
+        return table
+
+
+def command_line(cmd):
+    return cmd if isinstance(cmd, str) else " ".join(shlex.quote(arg) for arg in cmd)
+
+
+def write_state(job_dir, job):
+    tmp_path = f"{job_dir}/state.json.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(job))
+    os.replace(tmp_path, f"{job_dir}/state.json")
+
+
+def update_state(job_dir, **fields):
+    """
+    set fields in the state of the job in job_dir, under a lock shared by tappr and the supervisor of the job
+    return the updated state
+    """
+    with open(f"{job_dir}/state.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(f"{job_dir}/state.json", "r") as f:
+            job = json.loads(f.read())
+        job.update(fields)
+        write_state(job_dir, job)
+    return job
+
+
+def supervise(job_dir):
+    """
+    run the command of the job in job_dir to completion, the entry point of the detached supervisor process
+    """
+    with open(f"{job_dir}/state.json", "r") as f:
+        job = json.loads(f.read())
+    handler = RotatingFileHandler(f"{job_dir}/output.log", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    output = logging.getLogger(f"tappr.jobs.{job['id']}")
+    output.addHandler(handler)
+    output.setLevel(logging.INFO)
+    output.propagate = False
+
+    try:
+        child = subprocess.Popen(
+            job["cmd"], shell=isinstance(job["cmd"], str), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+    except OSError as err:
+        output.info(f"{err}")
+        update_state(job_dir, state="failed", pid=os.getpid(), end=time.time(), exit_code=127)
+        return 127
+
+    cancelled = threading.Event()
+
+    def terminate(signum, frame):
+        cancelled.set()
+        try:
+            child.terminate()
+        except ProcessLookupError:
+            pass
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    update_state(job_dir, state="running", pid=os.getpid(), child_pid=child.pid)
+
+    for line in iter(child.stdout.readline, b""):
+        output.info(line.decode(errors="replace").rstrip("\n"))
+    exit_code = child.wait()
+    state = "cancelled" if cancelled.is_set() else "succeeded" if exit_code == 0 else "failed"
+    update_state(job_dir, state=state, end=time.time(), exit_code=exit_code)
+    handler.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(supervise(sys.argv[1]))
@@ -1,9 +1,218 @@
+import base64
+import binascii
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import kubernetes as k8s
+import urllib3
+import yaml
 
-from kubernetes.client.rest import ApiException
+from kubernetes.client.rest import ApiException, RESTClientObject
+from rich.table import Table
+from tappr.modules.utils.discovery import DiscoveryCache, resource_path
+from tappr.modules.utils.kubeconfig import KubeconfigIndex, kubeconfig_files
 from tappr.modules.utils.ui import Picker
 from tappr.modules.utils.logger import TyperLogger
 
+# Ask the API server for PartialObjectMetadataList so that names only listings skip everything but metadata
+PARTIAL_METADATA_LIST = "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,application/json"
+DEFAULT_PAGE_SIZE = 500
+FIELD_MANAGER = "tappr"
+# Applied before everything else in a batch, as the other documents can live in or be instances of them
+APPLY_FIRST_KINDS = ("Namespace", "CustomResourceDefinition")
+
+# Client side rate limit per context, same idea as the QPS/Burst of a client-go rest.Config
+K8S_QPS = float(os.environ.get("TAPPR_K8S_QPS", "50"))
+K8S_BURST = int(os.environ.get("TAPPR_K8S_BURST", "100"))
+K8S_MAX_RETRIES = int(os.environ.get("TAPPR_K8S_MAX_RETRIES", "5"))
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_MAX_DELAY_SECONDS = 30
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+
+class LazyClients(dict):
+    """
+    dict of context name -> API client that builds the client on first access of clients[context]
+    """
+
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def __missing__(self, context):
+        client = self.factory(context)
+        self[context] = client
+        return client
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket that refills at qps up to burst tokens. take() blocks until a token is available.
+    """
+
+    def __init__(self, qps: float = K8S_QPS, burst: int = K8S_BURST):
+        self.qps = qps
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        return the seconds spent waiting for a token
+        """
+        if self.qps <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.qps)
+            self.updated = now
+            # Reserve the token right away, callers that went negative wait for the refill in order
+            self.tokens -= 1
+            wait = -self.tokens / self.qps if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class CallStats:
+    """
+    Per verb request count, latency, retries and rate limiter wait time, shared by all contexts of a K8s helper
+    """
+
+    def __init__(self):
+        self.verbs: dict[str, dict] = dict()
+        self._lock = threading.Lock()
+
+    def record(self, verb, seconds, retries=0, throttled=0.0):
+        with self._lock:
+            stats = self.verbs.setdefault(verb, {"count": 0, "total": 0.0, "max": 0.0, "retries": 0, "throttled": 0.0})
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["retries"] += retries
+            stats["throttled"] += throttled
+
+    def table(self, title="Kubernetes API calls"):
+        table = Table(title=title)
+        table.add_column("Verb")
+        table.add_column("Calls", justify="right")
+        table.add_column("Avg", justify="right")
+        table.add_column("Max", justify="right")
+        table.add_column("Retries", justify="right")
+        table.add_column("Throttled", justify="right")
+        with self._lock:
+            for verb in sorted(self.verbs):
+                stats = self.verbs[verb]
+                table.add_row(
+                    verb,
+                    str(stats["count"]),
+                    f"{stats['total'] / stats['count'] * 1000:.0f}ms",
+                    f"{stats['max'] * 1000:.0f}ms",
+                    str(stats["retries"]),
+                    f"{stats['throttled']:.1f}s",
+                )
+        return table
+
+
+class RetryingRESTClient(RESTClientObject):
+    """
+    REST client of an ApiClient that waits on a TokenBucket before every request and retries transient failures:
+    429 and 502/503/504 responses (honoring Retry-After) and reset connections, with exponential backoff and jitter.
+    POST is only retried when the server asked for it, i.e. on 429 or with a Retry-After header, as it is not idempotent.
+    """
+
+    def __init__(self, configuration, limiter: TokenBucket, stats: CallStats, max_retries: int = K8S_MAX_RETRIES):
+        super().__init__(configuration)
+        self.limiter = limiter
+        self.stats = stats
+        self.max_retries = max_retries
+
+    @staticmethod
+    def verb(method, query_params):
+        if method == "GET" and any(key == "watch" and str(value).lower() == "true" for key, value in query_params or []):
+            return "WATCH"
+        return method
+
+    @staticmethod
+    def backoff(attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, RETRY_MAX_DELAY_SECONDS)
+        delay = min(RETRY_BASE_DELAY_SECONDS * 2**attempt, RETRY_MAX_DELAY_SECONDS)
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def retry_after(err: ApiException):
+        try:
+            return float((err.headers or dict()).get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+
+    def request(self, method, url, query_params=None, headers=None, body=None, post_params=None, _preload_content=True, _request_timeout=None):
+        method = method.upper()
+        verb = self.verb(method, query_params)
+        retries, throttled = 0, 0.0
+        start = time.monotonic()
+        try:
+            while True:
+                throttled += self.limiter.take()
+                try:
+                    # The base class adds to headers and the url, so every attempt gets its own copy
+                    return super().request(
+                        method,
+                        url,
+                        query_params=query_params,
+                        headers=dict(headers or dict()),
+                        body=body,
+                        post_params=post_params,
+                        _preload_content=_preload_content,
+                        _request_timeout=_request_timeout,
+                    )
+                except ApiException as err:
+                    retry_after = self.retry_after(err)
+                    retryable = err.status == 429 or (err.status in RETRYABLE_STATUSES and (method != "POST" or retry_after is not None))
+                    if not retryable or retries >= self.max_retries:
+                        raise
+                    delay = self.backoff(retries, retry_after)
+                except (urllib3.exceptions.ProtocolError, urllib3.exceptions.MaxRetryError) as err:
+                    # Only dropped connections, an unreachable server or a timeout is not going to get better within a few seconds
+                    reset = isinstance(err, urllib3.exceptions.ProtocolError) or isinstance(err.reason, urllib3.exceptions.ProtocolError)
+                    if not reset or method == "POST" or retries >= self.max_retries:
+                        raise
+                    delay = self.backoff(retries)
+                retries += 1
+                time.sleep(delay)
+        finally:
+            self.stats.record(verb, time.monotonic() - start, retries=retries, throttled=throttled)
+
+
+def apply_action(status, obj: dict, field_manager, date=None):
+    """
+    return created/configured/unchanged for the response of a server side apply: status code, object and Date header.
+    An apply that changes nothing is not written, so the Apply entry of field_manager in managedFields keeps the time of the last write.
+    """
+    if status == 201:
+        return "created"
+    try:
+        applied = next(
+            entry["time"]
+            for entry in obj["metadata"].get("managedFields") or []
+            if entry.get("manager") == field_manager and entry.get("operation") == "Apply"
+        )
+        applied = datetime.datetime.strptime(applied, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+        now = email.utils.parsedate_to_datetime(date)
+    except (StopIteration, KeyError, TypeError, ValueError):
+        return "configured"
+    # Both times come from the API server clock with a resolution of a second
+    return "configured" if (now - applied).total_seconds() <= 1 else "unchanged"
+
 
 # noinspection PyBroadException,PyTypeChecker
 class K8s:
@@ -13,29 +222,63 @@ class K8s:
         self.config = k8s.config
         self.client = k8s.client
         self.contexts: list[str] = list()
-        self.core_clients: dict[str, k8s.client.CoreV1Api] = dict()
-        self.custom_clients: dict[str, k8s.client.CustomObjectsApi] = dict()
-        self.plural_of = dict()
-
-        # Not doing this on init cause it takes a while if you have multiple active contexts in your file
-        # self.load_contexts_and_clients()
+        self.kubeconfig_index = KubeconfigIndex()
+        # Clients are only built when a command touches a context, and both APIs of a context share one ApiClient
+        self.api_clients: dict[str, k8s.client.ApiClient] = dict()
+        self.core_clients: dict[str, k8s.client.CoreV1Api] = LazyClients(lambda ctx: self.client.CoreV1Api(api_client=self.api_client(ctx)))
+        self.custom_clients: dict[str, k8s.client.CustomObjectsApi] = LazyClients(
+            lambda ctx: self.client.CustomObjectsApi(api_client=self.api_client(ctx))
+        )
+        # apiVersion/kind -> plural and scope, per cluster server
+        self.discovery = DiscoveryCache()
+        self.call_stats = CallStats()
+        self.limiters: dict[str, TokenBucket] = LazyClients(lambda ctx: TokenBucket())
+        self._client_locks: dict[str, threading.Lock] = dict()
+        self._lock = threading.Lock()
 
     def load_contexts_and_clients(self):
         # Adding try/catch block so that tappr init does not blow up if the KUBECONFIG has no clusters/entries
         if len(self.contexts) == 0:
             try:
-                contexts_obj, current_context = self.config.list_kube_config_contexts()
-                for ctx in contexts_obj:
-                    try:
-                        self.core_clients[ctx["name"]] = self.client.CoreV1Api(api_client=self.config.new_client_from_config(context=ctx["name"]))
-                        self.custom_clients[ctx["name"]] = self.client.CustomObjectsApi(
-                            api_client=self.config.new_client_from_config(context=ctx["name"])
-                        )
-                        self.contexts.append(ctx["name"])
-                    except Exception:
-                        pass
+                self.contexts.extend(self.kubeconfig_index.load())
             except Exception:
-                pass
+                try:
+                    contexts_obj, current_context = self.config.list_kube_config_contexts()
+                    self.contexts.extend(ctx["name"] for ctx in contexts_obj)
+                except Exception:
+                    pass
+
+    def api_client(self, context) -> k8s.client.ApiClient:
+        with self._lock:
+            lock = self._client_locks.setdefault(context, threading.Lock())
+        with lock:
+            if context not in self.api_clients:
+                api_client = self.config.new_client_from_config(context=context)
+                # Every request made through the helpers, typed, raw or watch, goes through the same limiter and retry policy
+                # urllib3 does not retry at all, so RetryingRESTClient alone owns the backoff and Retry-After of every request
+                api_client.configuration.retries = False
+                api_client.rest_client = RetryingRESTClient(api_client.configuration, limiter=self.limiters[context], stats=self.call_stats)
+                self.api_clients[context] = api_client
+            return self.api_clients[context]
+
+    @staticmethod
+    def context_env(context):
+        """
+        return a copy of the environment for child processes (kubectl, tanzu, kapp) that targets context.
+        KUBECONFIG is prefixed with a file that only sets current-context, as the first file to set it wins when kubeconfig files are merged.
+        The user's kubeconfig files are left untouched.
+        """
+        pin_dir = f'{os.environ.get("HOME")}/.config/tappr/contexts'
+        pin_file = f"{pin_dir}/{hashlib.md5(context.encode()).hexdigest()}.yml"
+        if not os.path.isfile(pin_file):
+            os.makedirs(pin_dir, exist_ok=True)
+            tmp_file = f"{pin_file}.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_file, "w") as f:
+                f.write(yaml.safe_dump({"apiVersion": "v1", "kind": "Config", "current-context": context}))
+            os.replace(tmp_file, pin_file)
+        env = dict(os.environ)
+        env["KUBECONFIG"] = os.pathsep.join([pin_file] + kubeconfig_files())
+        return env
 
     @staticmethod
     def create_namespace(namespace, client: k8s.client.CoreV1Api):
@@ -49,19 +292,69 @@ class K8s:
             return False, err
 
     @staticmethod
-    def list_namespaces(client: k8s.client.CoreV1Api):
+    def raw_json(response):
+        """
+        Parse a response fetched with _preload_content=False straight from the response bytes into plain dicts/lists
+        """
+        return json.loads(response.data)
+
+    @staticmethod
+    def list_namespaces(client: k8s.client.CoreV1Api, raw: bool = False):
         """
         return success:bool, obj: kubernetes.client.models.v1_namespace.V1Namespace/kubernetes.client.exceptions.ApiException
+        With raw, obj is the plain dict parsed from the response json without any OpenAPI model deserialization
         """
         try:
+            if raw:
+                return True, K8s.raw_json(client.list_namespace(_preload_content=False))
             response = client.list_namespace()
             return True, response
         except ApiException as err:
             return False, err
 
     @staticmethod
-    def get_namespaced_secret(client: k8s.client.CoreV1Api, secret, namespace):
+    def iter_namespaces(client: k8s.client.CoreV1Api, limit: int = DEFAULT_PAGE_SIZE, names_only: bool = False):
+        """
+        yield kubernetes.client.models.v1_namespace.V1Namespace (or the namespace name with names_only) page by page
+        raises kubernetes.client.exceptions.ApiException
+        """
+        if names_only:
+            yield from K8s._iter_metadata_names(api_client=client.api_client, path="/api/v1/namespaces", limit=limit)
+            return
+        _continue = None
+        while True:
+            page = client.list_namespace(limit=limit, _continue=_continue)
+            yield from page.items
+            _continue = page.metadata._continue
+            if not _continue:
+                return
+
+    @staticmethod
+    def _iter_metadata_names(api_client: k8s.client.ApiClient, path: str, limit: int = DEFAULT_PAGE_SIZE):
+        _continue = None
+        while True:
+            query_params = [("limit", limit)] + ([("continue", _continue)] if _continue else [])
+            response = api_client.call_api(
+                path,
+                "GET",
+                query_params=query_params,
+                header_params={"Accept": PARTIAL_METADATA_LIST},
+                auth_settings=["BearerToken"],
+                _return_http_data_only=True,
+                _preload_content=False,
+            )
+            page = json.loads(response.data)
+            for item in page.get("items") or []:
+                yield item["metadata"]["name"]
+            _continue = page.get("metadata", dict()).get("continue")
+            if not _continue:
+                return
+
+    @staticmethod
+    def get_namespaced_secret(client: k8s.client.CoreV1Api, secret, namespace, raw: bool = False):
         try:
+            if raw:
+                return True, K8s.raw_json(client.read_namespaced_secret(name=secret, namespace=namespace, _preload_content=False))
             response = client.read_namespaced_secret(name=secret, namespace=namespace)
             return True, response
         except ApiException as err:
@@ -75,6 +368,20 @@ class K8s:
         except ApiException as err:
             return False, err
 
+    @staticmethod
+    def create_service_account_token(client: k8s.client.CoreV1Api, service_account, namespace, expiration_seconds: int = None):
+        """
+        mint a token for service_account with the TokenRequest API, the only way to get one on clusters that no longer create token secrets.
+        The API server may cap expiration_seconds, the audiences default to the API server's own.
+        return success:bool, obj: kubernetes.client.models.authentication_v1_token_request.AuthenticationV1TokenRequest/kubernetes.client.exceptions.ApiException
+        """
+        try:
+            body = k8s.client.AuthenticationV1TokenRequest(spec=k8s.client.V1TokenRequestSpec(audiences=[], expiration_seconds=expiration_seconds))
+            response = client.create_namespaced_service_account_token(name=service_account, namespace=namespace, body=body)
+            return True, response
+        except ApiException as err:
+            return False, err
+
     @staticmethod
     def patch_namespaced_secret(client: k8s.client.CoreV1Api, secret, namespace, body):
         try:
@@ -84,13 +391,63 @@ class K8s:
             return False, err
 
     @staticmethod
-    def get_namespaced_service(service, namespace, client: k8s.client.CoreV1Api):
+    def get_namespaced_service(service, namespace, client: k8s.client.CoreV1Api, raw: bool = False):
         try:
+            if raw:
+                return True, K8s.raw_json(client.read_namespaced_service(name=service, namespace=namespace, _preload_content=False))
             response = client.read_namespaced_service(name=service, namespace=namespace)
             return True, response
         except ApiException as err:
             return False, err
 
+    @staticmethod
+    def probe_server(url, token=None, ca_data=None, skip_tls_verify: bool = False, timeout_seconds: float = 5):
+        """
+        GET /version of the API server at url, authenticated with token when one is given, without any retry.
+        The server certificate is verified against ca_data (base64 PEM, like caData in a kubeconfig) when given, else the system CAs.
+        return success: bool (the server answered), {"status": int, "seconds": float, "version": str}/exception
+        A token the API server does not accept is answered with 401, even on /version
+        """
+        configuration = k8s.client.Configuration(host=url)
+        configuration.verify_ssl = not skip_tls_verify
+        configuration.retries = False
+        if token:
+            configuration.api_key = {"authorization": token}
+            configuration.api_key_prefix = {"authorization": "Bearer"}
+        ca_file = None
+        start = time.monotonic()
+        try:
+            if ca_data and not skip_tls_verify:
+                with tempfile.NamedTemporaryFile("wb", suffix=".crt", delete=False) as f:
+                    ca_file = f.name
+                    f.write(base64.b64decode(ca_data, validate=True))
+                configuration.ssl_ca_cert = ca_file
+            with k8s.client.ApiClient(configuration) as api_client:
+                response = k8s.client.VersionApi(api_client).get_code(_request_timeout=timeout_seconds, _preload_content=False)
+                version = K8s.raw_json(response).get("gitVersion", "")
+            return True, {"status": response.status, "seconds": time.monotonic() - start, "version": version}
+        except ApiException as err:
+            if err.status == 0:
+                # The client raises urllib3 SSLErrors as an ApiException without a status
+                return False, err
+            return True, {"status": err.status, "seconds": time.monotonic() - start, "version": ""}
+        except Exception as err:
+            # Connection refused and timeout errors from urllib3, or a caData that is not base64
+            return False, err
+        finally:
+            os.remove(ca_file) if ca_file else None
+
+    @staticmethod
+    def tls_error(err):
+        """
+        return True when err, as returned by probe_server, is a TLS handshake or certificate error
+        """
+        if isinstance(err, ApiException):
+            return err.status == 0
+        return isinstance(err, (urllib3.exceptions.SSLError, binascii.Error)) or isinstance(
+            getattr(err, "reason", None), urllib3.exceptions.SSLError
+        )
+
     def pick_context(self, context=None, message=None):
         self.load_contexts_and_clients()
         options = self.contexts
@@ -120,13 +477,60 @@ class K8s:
         return selected
 
     @staticmethod
-    def list_namespaced_custom_objects(group, version, namespace, plural, client: k8s.client.CustomObjectsApi):
+    def list_namespaced_custom_objects(group, version, namespace, plural, client: k8s.client.CustomObjectsApi, request_timeout=None):
+        # Custom objects are returned as plain dicts already, the client does no model deserialization for them
         try:
-            response = client.list_namespaced_custom_object(group=group, version=version, namespace=namespace, plural=plural)
+            response = client.list_namespaced_custom_object(
+                group=group, version=version, namespace=namespace, plural=plural, _request_timeout=request_timeout
+            )
             return True, response
         except ApiException as err:
             return False, err
 
+    @staticmethod
+    def iter_namespaced_custom_objects(
+        group, version, namespace, plural, client: k8s.client.CustomObjectsApi, limit: int = DEFAULT_PAGE_SIZE, names_only: bool = False
+    ):
+        """
+        yield custom objects as dict (or the object name with names_only) page by page
+        raises kubernetes.client.exceptions.ApiException
+        """
+        if names_only:
+            yield from K8s._iter_metadata_names(
+                api_client=client.api_client, path=f"/apis/{group}/{version}/namespaces/{namespace}/{plural}", limit=limit
+            )
+            return
+        _continue = None
+        while True:
+            page = client.list_namespaced_custom_object(
+                group=group, version=version, namespace=namespace, plural=plural, limit=limit, _continue=_continue
+            )
+            yield from page.get("items") or []
+            _continue = page.get("metadata", dict()).get("continue")
+            if not _continue:
+                return
+
+    @staticmethod
+    def watch_namespaced_custom_objects(
+        group, version, namespace, plural, client: k8s.client.CustomObjectsApi, resource_version, timeout_seconds: int = 300, field_selector=None
+    ):
+        """
+        yield watch events {"type": ADDED/MODIFIED/DELETED/BOOKMARK, "object": dict} starting after resource_version,
+        until the server ends the stream after timeout_seconds.
+        raises kubernetes.client.exceptions.ApiException, with status 410 when resource_version is too old to watch from
+        """
+        yield from k8s.watch.Watch().stream(
+            client.list_namespaced_custom_object,
+            group=group,
+            version=version,
+            namespace=namespace,
+            plural=plural,
+            resource_version=resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=timeout_seconds,
+            field_selector=field_selector,
+        )
+
     @staticmethod
     def get_namespaced_custom_objects(name, group, version, namespace, plural, client: k8s.client.CustomObjectsApi):
         try:
@@ -136,19 +540,161 @@ class K8s:
             return False, err
 
     @staticmethod
-    def patch_namespaced_custom_objects(yml, namespace: str = "default", client=None):
-        # Any file in the template directory will expect the first line to be of this format
-        # $$group,version,plural$$
+    def resolve_resource(api_version, kind, client, discovery: DiscoveryCache):
+        """
+        return success:bool, obj: (plural: str, namespaced: bool)/kubernetes.client.exceptions.ApiException/LookupError
+        """
         try:
-            components = yml.split("\n")[0].split("$$")[1].split(",")
-            group = components[0]
-            version = components[1]
-            plural = components[2]
-        except Exception as err:
+            return True, discovery.resolve(client.api_client, api_version, kind)
+        except (ApiException, LookupError) as err:
+            return False, err
+
+    @staticmethod
+    def apply_object(body: dict, namespace, client, discovery: DiscoveryCache, field_manager: str = FIELD_MANAGER, force: bool = False):
+        """
+        server side apply body, defaulting namespaced objects to namespace like kubectl -n
+        Without force, fields owned by another field manager are a conflict and the apply fails with a 409, like kubectl apply --server-side.
+        With force, a conflicting apply is retried with force=true, taking the fields over, and the conflicts it overrode are returned.
+        return {"kind", "name", "namespace", "action": created/configured/unchanged/failed, "error": exception or None, "conflicts": str or None}
+        """
+        metadata = body.setdefault("metadata", dict())
+        result = {"kind": body.get("kind"), "name": metadata.get("name"), "namespace": None, "action": "failed", "error": None, "conflicts": None}
+        try:
+            plural, namespaced = discovery.resolve(client.api_client, body["apiVersion"], body["kind"])
+            if namespaced:
+                metadata.setdefault("namespace", namespace)
+                result["namespace"] = metadata["namespace"]
+            path = resource_path(body["apiVersion"], plural, namespaced, namespace=metadata.get("namespace"), name=metadata["name"])
+            query_params = [("fieldManager", field_manager)]
+            try:
+                response = K8s._apply_patch(client, path, body, query_params)
+            except ApiException as err:
+                if err.status != 409 or not force:
+                    raise
+                try:
+                    result["conflicts"] = json.loads(err.body).get("message") or f"{err.reason}"
+                except (TypeError, ValueError):
+                    result["conflicts"] = f"{err.reason}"
+                response = K8s._apply_patch(client, path, body, query_params + [("force", "true")])
+            result["action"] = apply_action(response.status, K8s.raw_json(response), field_manager, date=response.headers.get("Date"))
+        except (ApiException, LookupError, KeyError) as err:
+            result["error"] = err
+        return result
+
+    @staticmethod
+    def _apply_patch(client, path, body, query_params):
+        return client.api_client.call_api(
+            path,
+            "PATCH",
+            query_params=query_params,
+            header_params={"Accept": "application/json", "Content-Type": "application/apply-patch+yaml"},
+            body=body,
+            auth_settings=["BearerToken"],
+            _return_http_data_only=True,
+            _preload_content=False,
+        )
+
+    @staticmethod
+    def apply_yaml(
+        yml, namespace, client, discovery: DiscoveryCache, field_manager: str = FIELD_MANAGER, max_workers: int = 8, force: bool = False
+    ):
+        """
+        server side apply every document of a multi document yaml, the same way kubectl -n namespace apply --server-side would.
+        Namespaces and CRDs go first, the remaining documents are applied concurrently.
+        return success:bool, results: list of apply_object results in document order / str when yml could not be parsed
+        """
+        try:
+            documents = [doc for doc in yaml.safe_load_all(yml) if doc]
+        except yaml.YAMLError as err:
+            return False, f"Unable to parse yaml: {err}"
+        return K8s.apply_objects(documents, namespace, client, discovery, field_manager=field_manager, max_workers=max_workers, force=force)
+
+    @staticmethod
+    def apply_objects(
+        documents: list, namespace, client, discovery: DiscoveryCache, field_manager: str = FIELD_MANAGER, max_workers: int = 8, force: bool = False
+    ):
+        """
+        server side apply a batch of objects as dict, Namespaces and CRDs first and the remaining objects concurrently.
+        return success:bool, results: list of apply_object results in document order
+        """
+        first = [doc for doc in documents if doc.get("kind") in APPLY_FIRST_KINDS]
+        rest = [doc for doc in documents if doc.get("kind") not in APPLY_FIRST_KINDS]
+        results = dict()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch in (first, rest):
+                for doc, result in zip(
+                    batch,
+                    executor.map(lambda doc: K8s.apply_object(doc, namespace, client, discovery, field_manager=field_manager, force=force), batch),
+                ):
+                    results[id(doc)] = result
+        results = [results[id(doc)] for doc in documents]
+        return all(result["error"] is None for result in results), results
+
+    @staticmethod
+    def registry_secret_objects(name, namespace, server, username, password, export_to_all_namespaces: bool = True):
+        """
+        return the objects tanzu secret registry add creates: a dockerconfigjson Secret,
+        plus a secretgen SecretExport that offers it to every namespace when export_to_all_namespaces
+        """
+        auth = base64.b64encode(f"{username}:{password}".encode()).decode()
+        docker_config = {"auths": {server: {"username": username, "password": password, "auth": auth}}}
+        objects = [
+            {
+                "apiVersion": "v1",
+                "kind": "Secret",
+                "metadata": {"name": name, "namespace": namespace},
+                "type": "kubernetes.io/dockerconfigjson",
+                "data": {".dockerconfigjson": base64.b64encode(json.dumps(docker_config).encode()).decode()},
+            }
+        ]
+        if export_to_all_namespaces:
+            objects.append(
+                {
+                    "apiVersion": "secretgen.carvel.dev/v1alpha1",
+                    "kind": "SecretExport",
+                    "metadata": {"name": name, "namespace": namespace},
+                    "spec": {"toNamespaces": ["*"]},
+                }
+            )
+        return objects
+
+    @staticmethod
+    def patch_namespaced_custom_objects(yml, namespace: str = "default", client=None, discovery: DiscoveryCache = None):
+        """
+        merge patch the object in yml. Templates can pin the resource with a first line of the format # $$group,version,plural$$,
+        otherwise plural and scope of its apiVersion/kind are looked up through discovery.
+        return success:bool, obj: dict/kubernetes.client.exceptions.ApiException/str
+        """
+        try:
+            body = yaml.safe_load(yml)
+            api_version, kind = body["apiVersion"], body["kind"]
+        except Exception:
+            return False, "Template file is not a Kubernetes object with an apiVersion and kind"
+
+        if yml.startswith("# $$"):
+            try:
+                components = yml.split("\n")[0].split("$$")[1].split(",")
+                api_version, plural, namespaced = f"{components[0]}/{components[1]}", components[2], True
+            except Exception:
+                return False, "Template file has a malformed '# $$group,version,plural$$' on the first line"
+        elif discovery is not None:
+            success, response = K8s.resolve_resource(api_version=api_version, kind=kind, client=client, discovery=discovery)
+            if not success:
+                return False, response
+            plural, namespaced = response
+        else:
             return False, "Template file is missing '# $$group,version,plural$$' on the first line"
 
         try:
-            response = client.patch_namespaced_custom_object(group=group, version=version, namespace=namespace, plural=plural, body=yml)
-            return True, response
+            response = client.api_client.call_api(
+                resource_path(api_version, plural, namespaced, namespace=namespace, name=body["metadata"]["name"]),
+                "PATCH",
+                header_params={"Accept": "application/json", "Content-Type": "application/merge-patch+json"},
+                body=body,
+                auth_settings=["BearerToken"],
+                _return_http_data_only=True,
+                _preload_content=False,
+            )
+            return True, K8s.raw_json(response)
         except ApiException as err:
             return False, err
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+
+import yaml
+
+
+def index_path():
+    return f'{os.environ.get("HOME")}/.config/tappr/kubeconfig-index.json'
+
+
+def kubeconfig_files():
+    kubeconfig = os.environ.get("KUBECONFIG")
+    if not kubeconfig:
+        return [os.path.abspath(os.path.expanduser("~/.kube/config"))]
+    return [os.path.abspath(os.path.expanduser(f)) for f in kubeconfig.split(os.pathsep) if f]
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def auth_type(user: dict):
+    if not user:
+        return "none"
+    if "exec" in user:
+        return "exec"
+    if "auth-provider" in user:
+        return "auth-provider"
+    if "token" in user or "tokenFile" in user:
+        return "token"
+    if "client-certificate" in user or "client-certificate-data" in user:
+        return "client-certificate"
+    if "username" in user:
+        return "basic"
+    return "none"
+
+
+# noinspection PyBroadException
+class KubeconfigIndex:
+    """
+    On disk index of the contexts in KUBECONFIG, their cluster servers and auth types.
+    Files are only re-parsed when their mtime and content hash no longer match the index.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path else index_path()
+        self.current_context = None
+        self.contexts: dict[str, dict] = dict()
+
+    def load(self):
+        files = kubeconfig_files()
+        index = self._read()
+        fresh, touched = self._is_fresh(index, files) if index is not None else (False, False)
+        if not fresh:
+            index = self._build(files)
+        if not fresh or touched:
+            self._write(index)
+        self.current_context = index["current_context"]
+        self.contexts = {ctx["name"]: ctx for ctx in index["contexts"]}
+        return list(self.contexts.keys())
+
+    def get(self, context):
+        return self.contexts.get(context, dict())
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.loads(f.read())
+        except Exception:
+            return None
+
+    def _write(self, index):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(index))
+            os.replace(tmp_path, self.path)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_fresh(index, files):
+        """
+        return fresh: bool, touched: bool (an mtime changed without the content changing)
+        """
+        if [entry["path"] for entry in index.get("files", [])] != files:
+            return False, False
+        touched = False
+        for entry in index["files"]:
+            try:
+                stat = os.stat(entry["path"])
+            except OSError:
+                if entry["sha256"] is None:
+                    continue
+                return False, False
+            if stat.st_mtime_ns == entry["mtime"] and stat.st_size == entry["size"]:
+                continue
+            # Rewritten with the same content, e.g. by a kubectl command that did not change anything
+            if entry["sha256"] is None or file_hash(entry["path"]) != entry["sha256"]:
+                return False, False
+            entry["mtime"], entry["size"] = stat.st_mtime_ns, stat.st_size
+            touched = True
+        return True, touched
+
+    @staticmethod
+    def _build(files):
+        file_entries, contexts, clusters, users = list(), dict(), dict(), dict()
+        current_context = None
+        for path in files:
+            try:
+                stat = os.stat(path)
+                with open(path, "rb") as f:
+                    raw = f.read()
+            except OSError:
+                file_entries.append({"path": path, "mtime": None, "size": None, "sha256": None})
+                continue
+            file_entries.append({"path": path, "mtime": stat.st_mtime_ns, "size": stat.st_size, "sha256": hashlib.sha256(raw).hexdigest()})
+            try:
+                data = yaml.safe_load(raw) or dict()
+            except Exception:
+                continue
+
+            # Same merge rules as kubectl, the first file to define a name or the current-context wins
+            if not current_context and data.get("current-context"):
+                current_context = data.get("current-context")
+            for entry in data.get("contexts") or []:
+                contexts.setdefault(entry.get("name"), entry.get("context") or dict())
+            for entry in data.get("clusters") or []:
+                clusters.setdefault(entry.get("name"), entry.get("cluster") or dict())
+            for entry in data.get("users") or []:
+                users.setdefault(entry.get("name"), entry.get("user") or dict())
+
+        index_contexts = list()
+        for name, ctx in contexts.items():
+            if not name:
+                continue
+            index_contexts.append(
+                {
+                    "name": name,
+                    "cluster": ctx.get("cluster"),
+                    "user": ctx.get("user"),
+                    "namespace": ctx.get("namespace"),
+                    "server": clusters.get(ctx.get("cluster"), dict()).get("server"),
+                    "auth_type": auth_type(users.get(ctx.get("user"))),
+                }
+            )
+        return {"files": file_entries, "current_context": current_context, "contexts": index_contexts}
@@ -1,5 +1,10 @@
+import time
+
 from rich import print
+from rich.console import Console
+from rich.errors import MarkupError
 from rich.prompt import Confirm, Prompt
+from rich.text import Text
 
 
 class TyperLogger:
@@ -55,3 +60,56 @@ class TyperLogger:
         if bold:
             return Confirm.ask(f"[bold]{message}[/bold]", default=default)
         return Confirm.ask(f"{message}", default=default)
+
+
+class FileLogger:
+    """
+    Logger with the TyperLogger interface that appends timestamped plain text to a file instead of the terminal,
+    e.g. for one cluster of a multi-cluster install. Prompts are not possible and return their default.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.console = Console(file=open(path, "a", buffering=1), no_color=True, width=160, highlight=False)
+        # Last line logged, shown in the combined progress view
+        self.last = ""
+
+    def _write(self, message):
+        try:
+            text = Text.from_markup(str(message))
+        except MarkupError:
+            # Command output is logged as is and can contain brackets that are not markup
+            text = Text(str(message))
+        lines = [line for line in text.plain.strip().split("\n") if line.strip()]
+        if lines:
+            self.last = lines[-1].strip()
+        self.console.print(Text(time.strftime("%H:%M:%S ")).append_text(text), soft_wrap=True)
+
+    def debug(self, message, bold=False):
+        self._write(message)
+
+    def error(self, message, bold=False):
+        self._write(message)
+
+    def success(self, message, bold=False):
+        self._write(message)
+
+    def msg(self, message, bold=False):
+        self._write(message)
+
+    def important(self, message, bold=False):
+        self._write(message)
+
+    def question(self, message, bold=False, default=None):
+        self._write(f"{message} -> {default}")
+        return default
+
+    def question_with_type(self, message, choices, bold=False, default=None):
+        return self.question(message, default=default)
+
+    def confirm(self, message, bold=False, default=True):
+        self._write(f"{message} -> {default}")
+        return default
+
+    def close(self):
+        self.console.file.close()
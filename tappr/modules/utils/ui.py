@@ -160,18 +160,25 @@ class Picker:
 
 
 class UI:
-    def __init__(self, subprocess_helper, logger):
+    def __init__(self, subprocess_helper, logger, live: bool = True):
         self.sh = subprocess_helper
         self.logger = logger
+        # False when output is not an interactive terminal owned by this command, e.g. a cluster in a multi-cluster run
+        self.live = live
 
     def progress(self, cmd, message, state):
         self.logger.msg(f"Running: {cmd}", bold=False) if state["verbose"] else None
         proc, out, err = None, None, None
-        with Progress(TextColumn(f"{message}"), SpinnerColumn(spinner_name="point"), TimeElapsedColumn(), transient=True) as progress:
-            task = progress.add_task("", total=1)
-            while not progress.finished:
-                proc, out, err = self.sh.run_proc(f"{cmd}")
-                progress.update(task_id=task, advance=1)
+        # Set by Commons.check_and_pick_k8s_context so that child processes target the picked context
+        env = state.get("kube_env")
+        if not self.live:
+            proc, out, err = self.sh.run_proc(f"{cmd}", env=env)
+        else:
+            with Progress(TextColumn(f"{message}"), SpinnerColumn(spinner_name="point"), TimeElapsedColumn(), transient=True) as progress:
+                task = progress.add_task("", total=1)
+                while not progress.finished:
+                    proc, out, err = self.sh.run_proc(f"{cmd}", env=env)
+                    progress.update(task_id=task, advance=1)
 
         self.logger.msg(f"\n{out.decode()}", bold=False) if state["verbose"] and out else None
         self.logger.msg(f"\n{err.decode()}", bold=False) if state["verbose"] and err else None